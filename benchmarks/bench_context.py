@@ -0,0 +1,83 @@
+"""
+Benchmark prompt size for each context mode (full, scoped, diff-only).
+
+Copies a corpus of Python files (by default this package's own source and tests) into a
+throwaway repository, edits one line in every few functions, and reports how many tokens the
+diff portion of the prompt costs under each mode.
+
+    uv run python benchmarks/bench_context.py --every 3
+"""
+
+import argparse
+import ast
+import contextlib
+import io
+import pathlib
+import shutil
+import subprocess
+import tempfile
+
+import git
+
+from diffweave import context, prompt, repo
+
+PACKAGE_ROOT = pathlib.Path(__file__).resolve().parent.parent
+DEFAULT_CORPUS = [PACKAGE_ROOT / "diffweave", PACKAGE_ROOT / "tests"]
+
+
+def build_repo(root: pathlib.Path, corpus: list[pathlib.Path], every: int) -> git.Repo:
+    subprocess.run(["git", "init", "-q", str(root)], check=True)
+    files = []
+    for source_dir in corpus:
+        for path in sorted(source_dir.rglob("*.py")):
+            target = root / source_dir.name / path.relative_to(source_dir)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(path, target)
+            files.append(target)
+
+    git_cmd = ["git", "-C", str(root), "-c", "user.name=bench", "-c", "user.email=bench@example.com"]
+    subprocess.run([*git_cmd, "add", "-A"], check=True)
+    subprocess.run([*git_cmd, "commit", "-q", "-m", "initial"], check=True)
+
+    for path in files:
+        edit_functions(path, every)
+    subprocess.run([*git_cmd, "add", "-A"], check=True)
+    return git.Repo(root)
+
+
+def edit_functions(path: pathlib.Path, every: int):
+    """
+    Append a comment to the last line of every `every`-th function in the file.
+    """
+    lines = path.read_text().splitlines(keepends=True)
+    functions = [
+        node
+        for node in ast.walk(ast.parse("".join(lines)))
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+    ]
+    for node in functions[::every]:
+        lines[node.end_lineno - 1] = lines[node.end_lineno - 1].rstrip("\n") + "  # edited\n"
+    path.write_text("".join(lines))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=pathlib.Path, nargs="+", default=DEFAULT_CORPUS)
+    parser.add_argument("--every", type=int, default=3, help="edit every N-th function")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = pathlib.Path(tmpdir)
+        current_repo = build_repo(root, args.corpus, args.every)
+
+        baseline = None
+        for mode in context.CONTEXT_MODES:
+            with contextlib.redirect_stdout(io.StringIO()):
+                rendered = repo.generate_diffs_with_context(current_repo, token_budget=10_000_000, context_mode=mode)
+            tokens = prompt.estimate_tokens(rendered)
+            baseline = baseline or tokens
+            print(f"{mode:<10} {tokens:>9,} tokens  {100 * (1 - tokens / baseline):5.1f}% smaller than full")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark sequential vs. concurrent per-file diff assembly.
+
+Builds a throwaway repository with thousands of staged modifications and times
+`repo.generate_diffs_with_context`, the path the CLI takes, with files assembled one after
+another, on a thread pool and on a process pool. Context mode is picked from the size of the
+change, as it is on the command line, unless `--context` says otherwise.
+
+    uv run python benchmarks/bench_diff_assembly.py --files 2000
+    uv run python benchmarks/bench_diff_assembly.py --files 2000 --context scoped
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import pathlib
+import subprocess
+import tempfile
+import time
+
+import git
+
+from diffweave import context, repo
+
+
+def build_repo(root: pathlib.Path, num_files: int, lines_per_file: int) -> git.Repo:
+    subprocess.run(["git", "init", "-q", str(root)], check=True)
+    for i in range(num_files):
+        path = root / f"pkg_{i % 50}" / f"module_{i}.py"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("".join(f"value_{j} = {j}\n" for j in range(lines_per_file)))
+    git_cmd = ["git", "-C", str(root), "-c", "user.name=bench", "-c", "user.email=bench@example.com"]
+    subprocess.run([*git_cmd, "add", "-A"], check=True)
+    subprocess.run([*git_cmd, "commit", "-q", "-m", "initial"], check=True)
+    for path in root.glob("pkg_*/module_*.py"):
+        with path.open("a") as f:
+            f.write("changed = True\n")
+    subprocess.run([*git_cmd, "add", "-A"], check=True)
+    return git.Repo(root)
+
+
+def time_assembly(current_repo: git.Repo, context_mode: str, workers: int, processes: bool, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            repo.generate_diffs_with_context(
+                current_repo, context_mode=context_mode, workers=workers, processes=processes
+            )
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=2_000)
+    parser.add_argument("--lines", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--context", default=context.AUTO, choices=[context.AUTO, *context.CONTEXT_MODES])
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = pathlib.Path(tmpdir)
+        current_repo = build_repo(root, args.files, args.lines)
+        # git commands are run from the current directory, as they are when run inside a repository
+        os.chdir(root)
+
+        print(f"{os.cpu_count()} CPU(s), {args.files:,} staged files, context {args.context}")
+        baseline = time_assembly(current_repo, args.context, 1, False, args.repeats)
+        print(f"{'sequential':<12} {baseline * 1000:8.1f} ms")
+        for processes in (False, True):
+            for workers in args.workers:
+                elapsed = time_assembly(current_repo, args.context, workers, processes, args.repeats)
+                name = f"{'processes' if processes else 'threads'}={workers}"
+                print(f"{name:<12} {elapsed * 1000:8.1f} ms  speedup x{baseline / elapsed:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Benchmark peak memory of building the pull request prompt.
+
+Builds a throwaway repository with a feature branch of several commits, each adding a large
+file, and measures the peak traced memory of `repo.generate_diffs_for_pull_request` (streamed,
+one file at a time) against feeding a GitPython `DiffIndex` of the whole branch to the same
+prompt builder.
+
+Then builds branches of `--many-files` files and of four times as many, and checks that the
+peak grows by no more than `MAX_BYTES_PER_FILE` per extra file, both when the prompt is cut
+down to fit and when it's summarized group by group (with a model that answers instantly, so
+only diffweave's own memory is measured). Exits non-zero if it grows by more.
+
+    uv run python benchmarks/bench_pr_memory.py --files 8 --lines 200000 --many-files 1000
+"""
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import io
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+import git
+
+from diffweave import ai, repo
+
+# how much the peak may grow for every extra file on the branch: its path, line counts and one-line
+# summary are kept until the prompt is done, but none of its diff or contents
+MAX_BYTES_PER_FILE = 1024
+
+
+class InstantLLM(ai.LLM):
+    """
+    A model that answers every request immediately, without any configuration or network.
+    """
+
+    def __init__(self):
+        self.model_name = "instant"
+        self.loop = asyncio.new_event_loop()
+
+    async def query_model(self, prompt, on_token=None, temperature=None, system_prompt=None, sample=0):
+        return "- changed some files"
+
+
+def build_repo(root: pathlib.Path, num_files: int, lines_per_file: int) -> git.Repo:
+    subprocess.run(["git", "init", "-q", "-b", "main", str(root)], check=True)
+    git_cmd = ["git", "-C", str(root), "-c", "user.name=bench", "-c", "user.email=bench@example.com"]
+    (root / "README.md").write_text("benchmark\n")
+    subprocess.run([*git_cmd, "add", "-A"], check=True)
+    subprocess.run([*git_cmd, "commit", "-q", "-m", "initial"], check=True)
+    subprocess.run([*git_cmd, "checkout", "-q", "-b", "feature"], check=True)
+    for n in range(num_files):
+        with (root / f"data_{n}.csv").open("w") as f:
+            for i in range(lines_per_file):
+                f.write(f"{i},{i * 2},{i * 3}\n")
+        subprocess.run([*git_cmd, "add", "-A"], check=True)
+        subprocess.run([*git_cmd, "commit", "-q", "-m", f"add data {n}"], check=True)
+    return git.Repo(root)
+
+
+def build_wide_repo(root: pathlib.Path, num_files: int, lines_per_file: int) -> git.Repo:
+    subprocess.run(["git", "init", "-q", "-b", "main", str(root)], check=True)
+    git_cmd = ["git", "-C", str(root), "-c", "user.name=bench", "-c", "user.email=bench@example.com"]
+    (root / "README.md").write_text("benchmark\n")
+    subprocess.run([*git_cmd, "add", "-A"], check=True)
+    subprocess.run([*git_cmd, "commit", "-q", "-m", "initial"], check=True)
+    subprocess.run([*git_cmd, "checkout", "-q", "-b", "feature"], check=True)
+    for n in range(num_files):
+        package = root / f"package_{n // 100}"
+        package.mkdir(exist_ok=True)
+        (package / f"module_{n}.py").write_text("".join(f"value_{i} = {i * n}\n" for i in range(lines_per_file)))
+    subprocess.run([*git_cmd, "add", "-A"], check=True)
+    subprocess.run([*git_cmd, "commit", "-q", "-m", "add modules"], check=True)
+    return git.Repo(root)
+
+
+def in_repo(root: pathlib.Path, fn):
+    # the commit log is read from the current directory, as it is when run inside a repository
+    previous = os.getcwd()
+    os.chdir(root)
+    try:
+        return fn()
+    finally:
+        os.chdir(previous)
+
+
+def peak_memory(fn) -> int:
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--lines", type=int, default=200_000)
+    parser.add_argument("--many-files", type=int, default=1_000)
+    parser.add_argument("--many-lines", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = pathlib.Path(tmpdir)
+        current_repo = build_repo(root, args.files, args.lines)
+        largest_file = max(path.stat().st_size for path in root.glob("data_*.csv"))
+        branch_size = sum(path.stat().st_size for path in root.glob("data_*.csv"))
+
+        def gitpython():
+            diffs = current_repo.commit("main").diff(
+                current_repo.head.commit.tree, create_patch=True, find_renames=True, find_copies=True
+            )
+            repo.generate_diffs_with_valid_prior_commit(root, diffs)
+
+        def streamed():
+            in_repo(root, lambda: repo.generate_diffs_for_pull_request(current_repo, "main"))
+
+        print(f"largest file {largest_file / 1e6:8.1f} MB, whole branch {branch_size / 1e6:8.1f} MB")
+        for name, fn in [("gitpython", gitpython), ("streamed", streamed)]:
+            peak = peak_memory(fn)
+            print(f"{name:<10} peak {peak / 1e6:8.1f} MB  ({peak / largest_file:.2f}x the largest file)")
+
+    print()
+    file_counts = (args.many_files, args.many_files * 4)
+    peaks: dict[str, list[int]] = {"summarized": [], "map-reduce": []}
+    for num_files in file_counts:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root = pathlib.Path(tmpdir)
+            current_repo = build_wide_repo(root, num_files, args.many_lines)
+            file_size = sum(path.stat().st_size for path in root.glob("package_*/*.py")) / num_files
+            for name, llm in [("summarized", None), ("map-reduce", InstantLLM())]:
+                generate = functools.partial(repo.generate_diffs_for_pull_request, current_repo, "main", llm=llm)
+                peak = peak_memory(functools.partial(in_repo, root, generate))
+                peaks[name].append(peak)
+                print(f"{num_files:>7,} files  {name:<10} peak {peak / 1e6:8.1f} MB")
+
+    print(f"each file adds {file_size:,.0f} bytes to the branch")
+    failed = False
+    for name, (fewer, more) in peaks.items():
+        per_file = (more - fewer) / (file_counts[1] - file_counts[0])
+        print(f"{name:<10} peak grew {per_file:,.0f} bytes per extra file")
+        failed |= per_file > MAX_BYTES_PER_FILE
+    if failed:
+        sys.exit(f"peak memory grew by more than {MAX_BYTES_PER_FILE:,} bytes per file")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark CLI startup cost per command with `python -X importtime`.
+
+Runs each command in a fresh interpreter, the way the `diffweave-ai` entry point does, and
+reports the total import time and the slowest top-level packages it imported. Commands that
+only print help or change configuration should never load the model client or GitPython.
+
+    uv run python benchmarks/bench_startup.py --repeats 5
+"""
+
+import argparse
+import collections
+import statistics
+import subprocess
+import sys
+
+COMMANDS = [
+    ["--help"],
+    ["pr", "--help"],
+    ["set-token-model", "--help"],
+    ["cache", "--help"],
+]
+
+SCRIPT = """
+import contextlib, io, sys
+from diffweave import app
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        app(sys.argv[1:])
+    except SystemExit:
+        pass
+"""
+
+
+def import_times(argv: list[str]) -> dict[str, int]:
+    """
+    Cumulative import time in microseconds of every top-level package imported by one run.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", SCRIPT, *argv], capture_output=True, text=True, check=True
+    )
+    times = collections.Counter()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not name.startswith("  ") and cumulative.strip().isdigit():
+            # unindented entries are top-level imports, whose cumulative time includes their children
+            times[name.strip().split(".")[0]] += int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    for argv in COMMANDS:
+        runs = [import_times(argv) for _ in range(args.repeats)]
+        total = statistics.median(sum(run.values()) for run in runs)
+        slowest = collections.Counter()
+        for run in runs:
+            slowest.update(run)
+        top = ", ".join(f"{name} {us / len(runs) / 1000:.1f}" for name, us in slowest.most_common(args.top))
+        print(f"{' '.join(argv):<24} {total / 1000:8.1f} ms imports  ({top})")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,9 +10,28 @@ Main components:
 - models: LLM model configuration
 - interface: User interface for git operations
 - cli: Command-line interface for the tool
+
+Submodules are imported on first use (e.g. `diffweave.repo`), so starting the CLI doesn't
+load the model client or GitPython until a command needs them.
 """
 
-from .utils import run_cmd
-from . import ai
-from . import repo
-from .cli import app
+import importlib
+
+__all__ = ["ai", "app", "repo", "run_cmd", "run_command"]
+
+
+def __getattr__(name: str):
+    if name == "app":
+        from .cli import app
+
+        return app
+    if name in ("run_cmd", "run_command"):
+        from . import utils
+
+        return getattr(utils, name)
+    try:
+        return importlib.import_module(f".{name}", __name__)
+    except ModuleNotFoundError as e:
+        if e.name != f"{__name__}.{name}":
+            raise
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
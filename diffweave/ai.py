@@ -4,18 +4,40 @@ from pathlib import Path
 import json
 import datetime
 import subprocess
+from typing import TYPE_CHECKING, Any, TypeVar
+from collections.abc import Callable, Coroutine
 
-import openai
 import rich
 import rich.console
+import rich.live
+import rich.markup
+import rich.spinner
 import rich.text
 import rich.panel
 import yaml
-import dateutil.parser
+
+from . import cache
+
+if TYPE_CHECKING:
+    import openai
 
 CONFIG_BASEDIR = Path().home() / ".config"
 CONFIG_DIRECTORY = CONFIG_BASEDIR / "diffweave"
 CONFIG_FILE = CONFIG_DIRECTORY / "config.yaml"
+CACHE_DIRECTORY = CONFIG_DIRECTORY / "cache"
+# summaries of single commits, keyed by model and commit SHA, for `pr --incremental`
+COMMIT_SUMMARY_DIRECTORY = CONFIG_DIRECTORY / "commit_summaries"
+# messages generated ahead of time by `watch`, keyed by the staged tree
+SPECULATIVE_DIRECTORY = CONFIG_DIRECTORY / "speculative"
+# settings that aren't part of the model configuration, kept when a new model is configured
+PRESERVED_CONFIG_KEYS = ("ignore", "summarize")
+T = TypeVar("T")
+# a conversation turn: plain strings are user turns, dicts are sent as they are
+Turn = str | dict[str, str]
+# sampling temperature of each concurrently generated candidate, cycled through when more are requested,
+# in which case the cycle number keeps otherwise identical requests apart in the response cache.
+# None leaves the provider's default, so the first candidate matches a single generation
+CANDIDATE_TEMPERATURES = (None, 0.7, 1.0)
 
 
 def configure_token_model(model_name: str, endpoint: str, token: str):
@@ -27,11 +49,13 @@ def configure_token_model(model_name: str, endpoint: str, token: str):
         endpoint: The API endpoint URL for the model
         token: The authentication token for accessing the model API
     """
+    preserved = _preserved_settings()
     config_file = _initialize_config()
 
     config_file.write_text(
         yaml.safe_dump(
             {
+                **preserved,
                 "type": "token",
                 "model_name": model_name,
                 "endpoint": endpoint,
@@ -41,10 +65,12 @@ def configure_token_model(model_name: str, endpoint: str, token: str):
     )
 
 def configure_databricks_browser_model(model_name: str, account: str):
+    preserved = _preserved_settings()
     config_file = _initialize_config()
     config_file.write_text(
         yaml.safe_dump(
             {
+                **preserved,
                 "type": "databricks",
                 "model_name": model_name,
                 "account": account,
@@ -59,14 +85,19 @@ class LLM:
         self,
         verbose: bool = False,
         prompt: str = None,
+        use_cache: bool = True,
     ):
+        # the client library is slow to import, so it's only loaded once a model is actually used
+        import openai
+
         self.verbose = verbose
         self.console = rich.console.Console()
+        self.cache = cache.ResponseCache(CACHE_DIRECTORY) if use_cache else None
 
-        config_file = _initialize_config()
-        model_config = yaml.safe_load(config_file.read_text())
+        _initialize_config()
+        model_config = load_config()
 
-        if model_config is None:
+        if "model_name" not in model_config:
             self.console.print(rich.panel.Panel(
                 "No model configured yet. Run one of:\n\n"
                 "  [bold]diffweave-ai set-token-model[/bold] [dim]<model> -t <token>[/dim]\n"
@@ -79,7 +110,7 @@ class LLM:
         self.model_name = model_config["model_name"]
         match model_config:
             case {"type": "token"}:
-                self.client = openai.OpenAI(
+                self.client = openai.AsyncOpenAI(
                     base_url=model_config["endpoint"],
                     api_key=model_config["token"],
                 )
@@ -87,51 +118,86 @@ class LLM:
                 account = model_config["account"]
                 host = f"https://{account}.cloud.databricks.com"
                 if (token := load_databricks_token_from_cache(account)) is None:
-                    subprocess.run(f'databricks auth login --profile {account} --host {host}', shell=True)
+                    subprocess.run(["databricks", "auth", "login", "--profile", account, "--host", host])
                     token = load_databricks_token_from_cache(account)
 
-                self.client = openai.OpenAI(
+                self.client = openai.AsyncOpenAI(
                     base_url="https://block-lakehouse-production.cloud.databricks.com/serving-endpoints",
                     api_key=token
                 )
 
         if prompt is None:
             prompt = "prompt"
-        self.system_prompt = (Path(__file__).parent / "prompts" / f"{prompt}.md").read_text()
+        self.system_prompt = load_system_prompt(prompt)
+        # one loop for every request, so the client's connections can be reused between them
+        self.loop = asyncio.new_event_loop()
+
+    def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        """
+        Run a coroutine that uses this model to completion.
+        """
+        return self.loop.run_until_complete(coroutine)
 
     def iterate_on_commit_message(
-        self, repo_status_prompt: str, context: str, return_first: bool = False, no_panel: bool = False
+        self,
+        repo_status_prompt: str | Callable[[], str],
+        context: str,
+        return_first: bool = False,
+        no_panel: bool = False,
+        candidates: int = 1,
+        first_message: str | None = None,
     ) -> str:
-        message_attempts = []
-        feedback = []
-        user_prompt = [repo_status_prompt, f"\n\nAdditional context provided by the user:\n{context}\n"]
+        """
+        Generate a message, then refine it with the user's feedback until they accept one.
 
-        loop = asyncio.new_event_loop()
+        Args:
+            repo_status_prompt: The repository status and diffs to describe, or a function that
+                builds them, called only once the model has to be queried
+            context: Additional context provided by the user
+            return_first: Return the first message without asking for feedback
+            no_panel: Print the message as plain text, for PR descriptions
+            candidates: Number of messages to generate concurrently for the user to pick from.
+                With `return_first`, whichever candidate finishes first is used
+            first_message: A message generated earlier for the same changes, shown as the first
+                attempt instead of querying the model
 
-        while True:
-            if message_attempts and feedback:
-                for a, f in zip(message_attempts, feedback):
-                    user_prompt.append(
-                        f"Previously REJECTED commit message attempts:\nAttempt: {a}\nUser Feedback: {f}\n---\n"
-                    )
+        Returns:
+            The accepted message
+        """
 
-            if self.verbose:
-                self.console.rule("Prompt")
-                for portion in user_prompt:
-                    self.console.print(portion)
-                self.console.rule()
+        def start_conversation() -> list[Turn]:
+            prompt = repo_status_prompt() if callable(repo_status_prompt) else repo_status_prompt
+            return initial_conversation(prompt, context)
 
-            with self.console.status("Generating message..."):
-                msg = loop.run_until_complete(self.query_model(user_prompt))
-            self.console.print("[dim]Done.[/dim]")
-            message_attempts.append(msg)
+        # with a first message there's nothing to query yet, so the diffs may never be needed
+        conversation = None if first_message is not None else start_conversation()
 
-            if no_panel:
-                self.console.rule("[bold]Generated PR description[/bold]")
-                self.console.print(msg)
+        while True:
+            if self.verbose and conversation is not None:
+                self.console.rule("Prompt")
+                for turn in conversation:
+                    if isinstance(turn, dict):
+                        self.console.rule(f"[dim]{turn['role']}[/dim]", align="left", characters="·")
+                        turn = turn["content"]
+                    self.console.print(turn, markup=False)
                 self.console.rule()
+
+            if first_message is not None:
+                msg, first_message = first_message, None
+            elif candidates > 1:
+                msg, shown = self.run(self._choose_candidate(conversation, candidates, no_panel, pick=not return_first))
+                if msg is not None:
+                    return msg
+                self.console.print(rich.text.Text("Provide feedback to improve the messages", style="yellow"))
+                conversation.extend(revision_turns("\n\n---\n\n".join(shown), self.console.input("> ").strip()))
+                continue
             else:
-                self.console.print(rich.panel.Panel(msg, title="Generated commit message"))
+                msg = self.run(self._stream_message(conversation, no_panel))
+                self.console.print("[dim]Done.[/dim]")
+
+            self._print_message(
+                msg, no_panel, title="Generated PR description" if no_panel else "Generated commit message"
+            )
 
             if return_first:
                 return msg
@@ -142,46 +208,258 @@ class LLM:
                     style="yellow",
                 )
             )
-            we_good = self.console.input("> ").strip()
-            feedback.append(we_good)
-            if we_good == "":
+            feedback = self.console.input("> ").strip()
+            if feedback == "":
                 break
+            if conversation is None:
+                conversation = start_conversation()
+            # each rejection adds exactly one attempt and one piece of feedback, so the prompt
+            # grows linearly with the number of rounds
+            conversation.extend(revision_turns(msg, feedback))
 
         return msg
 
-    async def query_model(self, prompt: list[str]) -> str:
+    async def _stream_message(self, prompt: list[Turn], no_panel: bool = False) -> str:
         """
-        Query an LLM model with a prompt and system message.
+        Query the model, showing the message live as it is generated.
+
+        A spinner shows until the first token arrives. The live view is cleared afterwards, so the
+        caller can print the final (fence-stripped) message in its place.
+        """
+        streamed = []
+
+        def render():
+            if not streamed:
+                return rich.spinner.Spinner("dots", "Generating message...")
+            text = rich.text.Text("".join(streamed))
+            return text if no_panel else rich.panel.Panel(text, title="Generating commit message...")
+
+        with rich.live.Live(render(), console=self.console, refresh_per_second=15, transient=True) as live:
 
-        This asynchronous function sends a prompt to the specified LLM model
-        along with a system message to guide the model's response.
+            def on_token(token: str):
+                streamed.append(token)
+                live.update(render())
 
-        https://platform.openai.com/docs/guides/structured-outputs?api-mode=responses
+            return await self.query_model(prompt, on_token=on_token)
+
+    async def _choose_candidate(
+        self, prompt: list[Turn], count: int, no_panel: bool = False, pick: bool = True
+    ) -> tuple[str | None, list[str]]:
+        """
+        Generate `count` candidate messages concurrently and let the user pick one.
+
+        Candidates are shown as they finish, skipping any identical to one already shown. The user can pick from those that are done, wait
+        for the rest, or reject them all. Requests still running once a choice is made are
+        cancelled.
+
+        Returns:
+            The chosen message, or None if the user rejected them all, and every message shown
+        """
+        tasks = [
+            asyncio.create_task(
+                self.query_model(
+                    prompt,
+                    temperature=CANDIDATE_TEMPERATURES[i % len(CANDIDATE_TEMPERATURES)],
+                    sample=i // len(CANDIDATE_TEMPERATURES),
+                )
+            )
+            for i in range(count)
+        ]
+        pending = set(tasks)
+        finished: list[str] = []
+        errors: list[BaseException] = []
+
+        try:
+            while True:
+                with self.console.status(f"Generating {len(pending)} candidate message(s)..."):
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in sorted(done, key=tasks.index):
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        self.console.print(f"[yellow]Candidate failed:[/yellow] {task.exception()}")
+                        continue
+                    if task.result() in finished:
+                        self.console.print("[dim]A candidate came back identical to an earlier one[/dim]")
+                        continue
+                    finished.append(task.result())
+                    self._print_message(task.result(), no_panel, title=f"Candidate {len(finished)}")
+
+                if not finished:
+                    if not pending:
+                        raise errors[0]
+                    continue
+                if not pick:
+                    return finished[0], finished
+
+                options = [f"Candidate {i + 1}: {msg.splitlines()[0] if msg else ''}" for i, msg in enumerate(finished)]
+                if pending:
+                    options.append(f"Wait for {len(pending)} more candidate(s)")
+                options.append("None of these, provide feedback")
+
+                import beaupy
+
+                beaupy.Config.raise_on_interrupt = True
+                choice = await asyncio.to_thread(
+                    beaupy.select, [rich.markup.escape(o) for o in options], return_index=True
+                )
+                if choice is None:
+                    raise KeyboardInterrupt
+                if choice < len(finished):
+                    return finished[choice], finished
+                if choice == len(options) - 1:
+                    return None, finished
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def _messages(self, prompt: list[Turn], system_prompt: str | None = None) -> list[dict[str, str]]:
+        """
+        The messages sent for a conversation.
+
+        The system prompt comes first, then the repository payload, then the user's context and
+        any feedback rounds. Turns are only ever appended, so every retry, candidate and feedback
+        round starts with the same bytes as the request before it, which providers with prompt
+        caching can serve from cache instead of processing again.
+        """
+        return [
+            {"role": "system", "content": self.system_prompt if system_prompt is None else system_prompt},
+            *({"role": "user", "content": turn} if isinstance(turn, str) else turn for turn in prompt),
+        ]
+
+    def _print_message(self, msg: str, no_panel: bool, title: str):
+        if no_panel:
+            self.console.rule(f"[bold]{title}[/bold]")
+            self.console.print(msg)
+            self.console.rule()
+        else:
+            self.console.print(rich.panel.Panel(msg, title=title))
+
+    async def query_model(
+        self,
+        prompt: list[Turn],
+        on_token: Callable[[str], None] | None = None,
+        temperature: float | None = None,
+        system_prompt: str | None = None,
+        sample: int = 0,
+    ) -> str:
+        """
+        Query an LLM model with a prompt and system message.
+
+        The response is streamed, so `on_token` sees each piece of the message as soon as the
+        provider sends it, rather than after the whole message has been generated.
+        An identical earlier request is answered from the response cache, in a single `on_token` call.
 
         Args:
-            prompt: The main prompt text to send to the model
+            prompt: The conversation after the system message. Strings are sent as user turns,
+                dicts (e.g. an assistant turn holding an earlier attempt) as they are
+            on_token: Called with each chunk of text as it arrives
+            temperature: Sampling temperature, or None for the provider's default
+            system_prompt: A system prompt to use instead of the model's own, e.g. for summarizing
+            sample: Tells apart otherwise identical requests that should each get their own response
 
         Returns:
-            The model's response as a string
+            The model's complete response as a string, with any surrounding code fence removed
         """
-        response = self.client.chat.completions.create(
+        messages = self._messages(prompt, system_prompt)
+        key = None
+        if self.cache is not None:
+            key = cache.response_key(
+                self.model_name,
+                *(f"{m['role']}:{m['content']}" for m in messages),
+                f"temperature={temperature}",
+                # left out of the first cycle, so the first candidate shares its response with a single generation
+                *([f"sample={sample}"] if sample else []),
+            )
+            if (cached := self.cache.get(key)) is not None:
+                if self.verbose:
+                    self.console.print("[dim]Using cached response[/dim]")
+                if on_token is not None:
+                    on_token(cached)
+                return cached
+
+        options = {} if temperature is None else {"temperature": temperature}
+        if self.verbose:
+            # token counts come in a final chunk, only sent when asked for
+            options["stream_options"] = {"include_usage": True}
+        stream = await self.client.chat.completions.create(
             model=self.model_name,
             max_tokens=1000,
-            stream=False,
-            messages=[
-                {"role": "system", "content": self.system_prompt},
-                *[{"role": "user", "content": p} for p in prompt],
-            ],
+            stream=True,
+            messages=messages,
+            **options,
         )
-        message = response.choices[0].message.content.strip()
 
-        if message.startswith("```\n"):
-            message = "\n".join(message.split("\n")[1:])
+        chunks = []
+        async for chunk in stream:
+            if chunk.usage is not None and self.verbose:
+                self.console.print(rich.text.Text(format_usage(chunk.usage), style="dim"))
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            chunks.append(chunk.choices[0].delta.content)
+            if on_token is not None:
+                on_token(chunk.choices[0].delta.content)
+
+        message = strip_code_fence("".join(chunks))
+        if key is not None and message:
+            self.cache.put(key, message)
+        return message
 
-        if message.endswith("\n```"):
-            message = "\n".join(message.split("\n")[:-1])
 
-        return message
+def load_system_prompt(name: str) -> str:
+    """
+    Read one of the bundled system prompts, e.g. "prompt" or "pull_request".
+    """
+    return (Path(__file__).parent / "prompts" / f"{name}.md").read_text()
+
+
+def format_usage(usage: "openai.types.CompletionUsage") -> str:
+    """
+    Describe the token usage of a request, including how much of the prompt the provider had cached.
+    """
+    details = usage.prompt_tokens_details
+    cached = (details.cached_tokens if details is not None else None) or 0
+    share = f" ({cached / usage.prompt_tokens:.0%})" if usage.prompt_tokens else ""
+    return (
+        f"Tokens: {usage.prompt_tokens:,} prompt, {cached:,} of them cached{share}, "
+        f"{usage.completion_tokens:,} completion"
+    )
+
+
+def initial_conversation(repo_status_prompt: str, context: str) -> list[Turn]:
+    """
+    The turns of a first request: the repository payload, then the context provided by the user.
+    """
+    return [repo_status_prompt, f"\n\nAdditional context provided by the user:\n{context}\n"]
+
+
+def revision_turns(attempt: str, feedback: str) -> list[Turn]:
+    """
+    The turns recording a rejected attempt: the attempt as the model's own reply, then the
+    user's feedback asking for a revision.
+    """
+    request = (
+        f"That message was rejected. Revise it based on this feedback:\n{feedback}"
+        if feedback
+        else "That message was rejected. Write a different one."
+    )
+    return [{"role": "assistant", "content": attempt}, {"role": "user", "content": request}]
+
+
+def strip_code_fence(message: str) -> str:
+    """
+    Remove a code fence the model wrapped its whole response in.
+    """
+    message = message.strip()
+
+    if message.startswith("```\n"):
+        message = "\n".join(message.split("\n")[1:])
+
+    if message.endswith("\n```"):
+        message = "\n".join(message.split("\n")[:-1])
+
+    return message
 
 
 def _initialize_config():
@@ -191,7 +469,26 @@ def _initialize_config():
     return CONFIG_FILE
 
 
+def load_config() -> dict:
+    """
+    Read the diffweave configuration file, without creating it if it doesn't exist yet.
+
+    Returns:
+        The parsed configuration, or an empty dict if there is none
+    """
+    if not CONFIG_FILE.is_file():
+        return {}
+    return yaml.safe_load(CONFIG_FILE.read_text()) or {}
+
+
+def _preserved_settings() -> dict:
+    config = load_config()
+    return {key: config[key] for key in PRESERVED_CONFIG_KEYS if key in config}
+
+
 def load_databricks_token_from_cache(account: str) -> str | None:
+    import dateutil.parser
+
     homedir = Path().home()
     databricks_config_dir = homedir / '.databricks'
     token_cache = databricks_config_dir / 'token-cache.json'
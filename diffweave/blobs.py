@@ -0,0 +1,177 @@
+"""
+Bulk blob reads through a single long-lived `git cat-file --batch` process.
+
+Reading the staged (index) version of a file via git, rather than the working tree, means the
+prompt reflects exactly what will be committed, and every file comes through one pipe instead
+of paying open/stat/read per file. Sizes are always checked before anything is read, so
+oversized files are never pulled into memory.
+"""
+
+import pathlib
+import subprocess
+import threading
+from collections.abc import Iterable
+
+# requests written before reading any responses back; kept well under the OS pipe buffer so
+# writing a batch can never block on git waiting for us to drain its output
+BATCH_SIZE = 64
+# the unread rest of an object is drained from the pipe this much at a time
+DISCARD_CHUNK_SIZE = 64 * 1024
+
+
+class BlobReader:
+    """
+    Reads git objects through one `git cat-file --batch` subprocess.
+
+    Objects can be named by blob id, or by `:<path>` for the staged version of a path.
+    Object sizes can be looked up first (through a second, `--batch-check` process started on
+    first use) so oversized blobs never have to be read at all.
+    Use as a context manager so the subprocesses are always shut down.
+    """
+
+    def __init__(self, project_root: pathlib.Path):
+        self.project_root = project_root
+        self.process = _start_cat_file(project_root, "--batch")
+        self._check_process = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for process in (self.process, self._check_process):
+            if process is None:
+                continue
+            if process.poll() is None:
+                process.stdin.close()
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+            process.stdout.close()
+
+    def sizes(self, object_names: Iterable[str]) -> list[int | None]:
+        """
+        Look up the size in bytes of several objects without reading them.
+
+        Returns:
+            The size of each object in request order, None for objects that don't exist
+        """
+        object_names = list(object_names)
+        results: list[int | None] = []
+        with self._lock:
+            if self._check_process is None:
+                self._check_process = _start_cat_file(self.project_root, "--batch-check")
+            for batch in _batches(object_names):
+                _write_requests(self._check_process, batch)
+                for _ in batch:
+                    results.append(_parse_header(self._check_process.stdout.readline()))
+        return results
+
+    def read(self, object_name: str) -> bytes | None:
+        """
+        Read a single object, or None if it doesn't exist.
+        """
+        return self.read_many([object_name])[0]
+
+    def read_many(self, object_names: Iterable[str]) -> list[bytes | None]:
+        """
+        Read several objects, pipelining the requests `BATCH_SIZE` at a time.
+
+        Returns:
+            The contents of each object in request order, None for objects that don't exist
+        """
+        object_names = list(object_names)
+        results: list[bytes | None] = []
+        with self._lock:
+            for batch in _batches(object_names):
+                _write_requests(self.process, batch)
+                results.extend(self._read_response() for _ in batch)
+        return results
+
+    def read_heads(self, object_names: Iterable[str], num_bytes: int) -> list[bytes | None]:
+        """
+        Read the first `num_bytes` of several objects, without holding any of them whole in memory.
+
+        Returns:
+            The start of each object in request order, None for objects that don't exist
+        """
+        object_names = list(object_names)
+        results: list[bytes | None] = []
+        with self._lock:
+            for batch in _batches(object_names):
+                _write_requests(self.process, batch)
+                results.extend(self._read_response(num_bytes) for _ in batch)
+        return results
+
+    def _read_response(self, limit: int | None = None) -> bytes | None:
+        size = _parse_header(self.process.stdout.readline())
+        if size is None:
+            return None
+
+        contents = self.process.stdout.read(size if limit is None else min(size, limit))
+        remaining = size - len(contents)
+        while remaining > 0:
+            remaining -= len(self.process.stdout.read(min(remaining, DISCARD_CHUNK_SIZE)))
+        # every object is followed by a newline
+        self.process.stdout.read(1)
+        return contents
+
+
+def load_file(path: pathlib.Path, max_size: int) -> tuple[int, bytes | None]:
+    """
+    Read a working tree file, checking its size before reading it.
+
+    Returns:
+        The size of the file in bytes, and its contents, or None if it is `max_size` or larger
+    """
+    size = path.stat().st_size
+    if size >= max_size:
+        return size, None
+    return size, path.read_bytes()
+
+
+def read_file_head(path: pathlib.Path, num_bytes: int) -> bytes:
+    """
+    Read the first `num_bytes` of a working tree file.
+    """
+    with path.open("rb") as f:
+        return f.read(num_bytes)
+
+
+def _start_cat_file(project_root: pathlib.Path, mode: str) -> subprocess.Popen:
+    return subprocess.Popen(
+        ["git", "cat-file", mode],
+        cwd=project_root,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def _batches(object_names: list[str]) -> Iterable[list[str]]:
+    for start in range(0, len(object_names), BATCH_SIZE):
+        batch = object_names[start : start + BATCH_SIZE]
+        if any("\n" in name for name in batch):
+            raise ValueError("object names read through git cat-file can't contain newlines")
+        yield batch
+
+
+def _write_requests(process: subprocess.Popen, batch: list[str]):
+    process.stdin.write("".join(f"{name}\n" for name in batch).encode("utf-8", "surrogateescape"))
+    process.stdin.flush()
+
+
+def _parse_header(header: bytes) -> int | None:
+    if not header:
+        raise SystemError("git cat-file exited unexpectedly")
+
+    # "<oid> <type> <size>" or "<name> missing" / "<name> ambiguous"
+    fields = header.rstrip(b"\n").split(b" ")
+    if len(fields) != 3 or not fields[2].isdigit():
+        return None
+    return int(fields[2])
@@ -0,0 +1,141 @@
+"""
+An on-disk cache of model responses, keyed by a hash of everything sent to the model.
+
+Running `--dry-run` and then the real commit, or re-running after a failed push, sends exactly
+the same request twice; with the cache the second run reads the earlier response back from
+disk instead of waiting on the model again.
+
+Each response is one file named by its key. Files are written to a temporary name and renamed
+into place, so concurrent runs never see a partial entry, and a file's modification time
+records when it was last used. Entries unused for too long are dropped, and once the cache
+grows past its size limit the least recently used entries are evicted first.
+"""
+
+import hashlib
+import os
+import pathlib
+import tempfile
+import time
+
+MAX_CACHE_BYTES = 10 * 1024 * 1024
+MAX_CACHE_AGE_SECONDS = 30 * 24 * 60 * 60
+ENTRY_SUFFIX = ".txt"
+
+
+def response_key(*parts: str) -> str:
+    """
+    Hash the parts of a request into a cache key.
+
+    Each part is length-prefixed, so moving text from one part into its neighbour changes the key.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        encoded = part.encode("utf-8", errors="surrogateescape")
+        digest.update(f"{len(encoded)}:".encode())
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    Model responses stored one file per key in `directory`.
+
+    Args:
+        directory: Where entries are stored, created on first write
+        max_bytes: Total size the cache is trimmed back to after each write
+        max_age: Seconds since an entry was last used before it expires
+    """
+
+    def __init__(
+        self,
+        directory: pathlib.Path,
+        max_bytes: int = MAX_CACHE_BYTES,
+        max_age: float = MAX_CACHE_AGE_SECONDS,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.directory / f"{key}{ENTRY_SUFFIX}"
+
+    def get(self, key: str) -> str | None:
+        """
+        Look up a response, marking it as recently used.
+
+        Returns:
+            The cached response, or None if there is none or it has expired
+        """
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+                return None
+            response = path.read_text(encoding="utf-8")
+            os.utime(path)
+        except FileNotFoundError:
+            # never cached, or evicted by another process since
+            return None
+        return response
+
+    def put(self, key: str, response: str):
+        """
+        Store a response, then evict expired and least recently used entries.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(dir=self.directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(response)
+            os.replace(temp_name, self._path(key))
+        except BaseException:
+            pathlib.Path(temp_name).unlink(missing_ok=True)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Drop expired entries, then the least recently used ones until the cache fits `max_bytes`.
+        """
+        now = time.time()
+        entries = []
+        for path, stat in self._entries():
+            if now - stat.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self) -> int:
+        """
+        Remove every entry.
+
+        Returns:
+            The number of entries removed
+        """
+        removed = 0
+        for path, _ in self._entries():
+            path.unlink(missing_ok=True)
+            removed += 1
+        return removed
+
+    def _entries(self) -> list[tuple[pathlib.Path, os.stat_result]]:
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith(ENTRY_SUFFIX):
+                        continue
+                    try:
+                        entries.append((pathlib.Path(entry.path), entry.stat()))
+                    except FileNotFoundError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return entries
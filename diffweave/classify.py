@@ -0,0 +1,189 @@
+"""
+Cheap detection of files that shouldn't go into the prompt verbatim.
+
+Binary files, lockfiles and generated code (minified bundles, protobuf output, ...) are sniffed
+from their name and their first few KB, and replaced by a one-line structural summary such as
+"lockfile: 14 packages bumped" or "binary: 2.3 MB -> 2.4 MB".
+"""
+
+import pathlib
+import re
+
+# how much of the start of a file is looked at
+SNIFF_SIZE = 8 * 1024
+
+BINARY = "binary"
+LOCKFILE = "lockfile"
+GENERATED = "generated"
+
+LOCKFILE_NAMES = {
+    "uv.lock",
+    "poetry.lock",
+    "pdm.lock",
+    "Pipfile.lock",
+    "package-lock.json",
+    "npm-shrinkwrap.json",
+    "yarn.lock",
+    "pnpm-lock.yaml",
+    "bun.lockb",
+    "Cargo.lock",
+    "Gemfile.lock",
+    "composer.lock",
+    "go.sum",
+    "flake.lock",
+    "mix.lock",
+    "Podfile.lock",
+    "Package.resolved",
+    "gradle.lockfile",
+}
+GENERATED_SUFFIXES = (
+    ".min.js",
+    ".min.css",
+    ".js.map",
+    ".css.map",
+    "_pb2.py",
+    "_pb2.pyi",
+    "_pb2_grpc.py",
+    ".pb.go",
+    ".pb.h",
+    ".pb.cc",
+    ".pb.swift",
+)
+# a comment line near the top of a file, capturing the comment's text
+COMMENT_LINE = re.compile(
+    rb"^[ \t]*(?://+|#+|/\*+|\*+|--|;+|<!--)[ \t]*(.*?)[ \t]*(?:\*/|-->)?[ \t]*\r?$",
+    flags=re.MULTILINE,
+)
+# what generators put at the start of such a comment, e.g. Go's `// Code generated ... DO NOT EDIT.`
+GENERATED_MARKER = re.compile(
+    rb"""^(?:
+        Code\ generated\ .*\ DO\ NOT\ EDIT\.$
+        | (?:This\ file\ is\ (?:automatically\ )?)?@generated\b
+        | Generated\ by\ the\ protocol\ buffer\ compiler\.
+        | This\ file\ (?:is|was)\ (?:automatically|auto-)\ ?generated\b
+        | Autogenerated\ by\b
+        | <auto-generated\b
+    )""",
+    flags=re.VERBOSE,
+)
+# lines this long only show up in minified files, but also in prose and data files, so they only
+# count for the file types that get minified
+MINIFIABLE_SUFFIXES = (".js", ".mjs", ".cjs", ".css", ".map")
+MAX_HUMAN_LINE_LENGTH = 1_000
+MAX_HUMAN_MEAN_LINE_LENGTH = 300
+
+# one changed "version" line per package, across the common lockfile formats:
+# toml (uv, poetry, cargo), json (npm, composer), yarn v1/berry, pnpm, and go.sum
+LOCKFILE_VERSION_LINE = re.compile(
+    rb"""^[+-]\s*(?:"?version"?\s*[=:]\s*|version\s+"|\S+\s+v\d\S*\s+h1:)""",
+    flags=re.MULTILINE,
+)
+
+
+def classify_file(path: str, head: bytes, patch: bytes = b"") -> str | None:
+    """
+    Decide whether a file should be summarized instead of shown.
+
+    Args:
+        path: Path of the file relative to the repository root
+        head: The first `SNIFF_SIZE` or so bytes of the file, may be empty if unavailable
+        patch: The start of the file's patch, used for git's own binary detection
+
+    Returns:
+        One of `BINARY`, `LOCKFILE`, `GENERATED`, or None for regular files
+    """
+    name = pathlib.PurePosixPath(path).name
+    if name in LOCKFILE_NAMES:
+        return LOCKFILE
+    if b"\0" in head[:SNIFF_SIZE] or patch.startswith(b"Binary files ") or not _decodes(head[:SNIFF_SIZE]):
+        return BINARY
+    if name.endswith(GENERATED_SUFFIXES):
+        return GENERATED
+
+    head = head[:SNIFF_SIZE]
+    first_lines = head[:1024]
+    if any(GENERATED_MARKER.match(comment) for comment in COMMENT_LINE.findall(first_lines)):
+        return GENERATED
+
+    if name.endswith(MINIFIABLE_SUFFIXES):
+        lines = head.split(b"\n")
+        if max(len(line) for line in lines) > MAX_HUMAN_LINE_LENGTH:
+            return GENERATED
+        if len(head) >= 1024 and len(head) / len(lines) > MAX_HUMAN_MEAN_LINE_LENGTH:
+            return GENERATED
+
+    return None
+
+
+def classify_path(path: str) -> str | None:
+    """
+    Classify a file from its path alone, before anything about it has been read.
+
+    Returns:
+        `LOCKFILE` or `GENERATED` for files recognized by name, otherwise None
+    """
+    name = pathlib.PurePosixPath(path).name
+    if name in LOCKFILE_NAMES:
+        return LOCKFILE
+    if name.endswith(GENERATED_SUFFIXES):
+        return GENERATED
+    return None
+
+
+def _decodes(head: bytes) -> bool:
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # the sniffed window may cut a multi-byte character in half at the very end
+        return e.start >= len(head) - 3
+    return True
+
+
+def summarize(
+    kind: str,
+    change_type: str,
+    patch: bytes = b"",
+    old_size: int | None = None,
+    new_size: int | None = None,
+    additions: int = 0,
+    deletions: int = 0,
+) -> str:
+    """
+    Build the one-line summary shown in place of a classified file.
+    """
+    if kind == BINARY:
+        if change_type == "added":
+            return f"binary: added, {format_size(new_size)}"
+        if change_type == "removed":
+            return f"binary: removed, {format_size(old_size)}"
+        return f"binary: {format_size(old_size)} -> {format_size(new_size)}"
+
+    if kind == LOCKFILE:
+        if not patch:
+            size = old_size if change_type == "removed" else new_size
+            return f"lockfile: {change_type}, {format_size(size)}"
+        added = removed = 0
+        for match in LOCKFILE_VERSION_LINE.finditer(patch):
+            if match.group().startswith(b"+"):
+                added += 1
+            else:
+                removed += 1
+        bumped = min(added, removed)
+        parts = [f"{bumped} packages bumped"]
+        if added > bumped:
+            parts.append(f"{added - bumped} added")
+        if removed > bumped:
+            parts.append(f"{removed - bumped} removed")
+        return "lockfile: " + ", ".join(parts)
+
+    return f"generated: {change_type}, +{additions} -{deletions} lines"
+
+
+def format_size(num_bytes: int | None) -> str:
+    if num_bytes is None:
+        return "unknown size"
+    size = float(num_bytes)
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1000 or unit == "GB":
+            return f"{int(size)} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1000
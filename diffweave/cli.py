@@ -1,18 +1,15 @@
+import pathlib
 import sys
-import shlex
+from typing import Literal
 from typing_extensions import Annotated
-import webbrowser
 
 import cyclopts
 from cyclopts import Parameter
-import rich
-import rich.text
-import rich.panel
-import rich.status
-import rich.padding
-import copykitten
 
-from . import run_cmd, repo, ai
+# everything else is imported inside the command that needs it, so `--help` and the
+# configuration commands start without loading the model client, GitPython or the pickers
+from .utils import run_command
+from . import context as code_context
 
 app = cyclopts.App()
 
@@ -35,6 +32,31 @@ def commit(
     ] = False,
     verbose: Annotated[bool, Parameter(alias="-v", help="Print the prompt sent to the model before each generation attempt")] = False,
     open_browser: Annotated[bool, Parameter(alias="-w", help="Open the repository URL in a browser after pushing")] = False,
+    context_mode: Annotated[
+        Literal["auto", "full", "scoped", "diff-only"],
+        Parameter(
+            name="--context",
+            help="How much of each changed file to show: the whole file, only the functions/classes around each change, or just the diff. 'auto' picks based on the size of the change",
+        ),
+    ] = code_context.AUTO,
+    candidates: Annotated[
+        int,
+        Parameter(
+            alias="-n",
+            help="Generate this many messages at once and pick one, instead of regenerating after rejecting one. Non-interactive runs use whichever finishes first",
+        ),
+    ] = 1,
+    cache: Annotated[
+        bool,
+        Parameter(help="Reuse the response to an identical earlier request instead of querying the model again"),
+    ] = True,
+    use_daemon: Annotated[
+        bool,
+        Parameter(
+            name="--daemon",
+            help="Have a running daemon (see `diffweave-ai daemon start`) generate the message. Only used with --dry-run or --non-interactive, and generates in-process if no daemon is running",
+        ),
+    ] = False,
 ):
     """
     Generate a commit message for the current state of the repository.
@@ -53,12 +75,54 @@ def commit(
 
     Run `diffweave-ai set-token-model` or `diffweave-ai set-databricks-browser-model` to configure your LLM before first use.
     """
+    import webbrowser
+
+    import rich.console
+    import rich.text
+
+    from . import daemon
+
     console = rich.console.Console()
 
     skip_interaction = dry_run or non_interactive
 
+    if use_daemon:
+        if not skip_interaction or candidates > 1 or verbose:
+            console.print(
+                "[dim]The daemon only serves --dry-run and --non-interactive runs of a single candidate "
+                "without --verbose, generating in-process[/dim]"
+            )
+        elif not daemon.is_running():
+            console.print(
+                "[dim]No daemon running, generating in-process. Start one with `diffweave-ai daemon start`[/dim]"
+            )
+        else:
+            console.rule("[bold]diffweave-ai[/bold]")
+            repo_status, _ = run_command(["git", "status"])
+            reply = daemon.generate(
+                {
+                    "command": "commit",
+                    "prompt": "simple" if simple else "prompt",
+                    "context_mode": context_mode,
+                    "use_cache": cache,
+                    "repo_status": repo_status,
+                },
+                console,
+                title="Generated commit message",
+            )
+            if reply.get("empty"):
+                console.print(rich.text.Text("No staged changes to commit, quitting!"), style="bold yellow")
+                sys.exit()
+            if not dry_run:
+                run_command(["git", "commit", "-m", reply["message"]], stream=True)
+                run_command(["git", "push"], stream=True)
+            return
+
+    # only generating in-process needs the model client and GitPython
+    from . import ai, repo, speculate
+
     try:
-        llm = ai.LLM(verbose=verbose, prompt="simple" if simple else "prompt")
+        llm = ai.LLM(verbose=verbose, prompt="simple" if simple else "prompt", use_cache=cache)
     except EnvironmentError:
         app('-h')
         sys.exit(1)
@@ -68,18 +132,24 @@ def commit(
 
     current_repo = repo.get_repo()
 
-    repo_status, _ = run_cmd("git status")
+    repo_status, _ = run_command(["git", "status"])
 
     if not skip_interaction:
         repo.add_files(current_repo)
 
-    diffs = repo.generate_diffs_with_context(current_repo)
+    prompt_name = "simple" if simple else "prompt"
+    # a message `watch` generated for exactly these staged changes. Looking it up only takes a `git write-tree`,
+    # so it comes first and the diffs are only built once they're needed
+    pregenerated = speculate.lookup(current_repo, llm.model_name, prompt_name, context_mode) if cache else None
 
-    if diffs == "":
-        console.print(rich.text.Text("No staged changes to commit, quitting!"), style="bold yellow")
-        sys.exit()
+    def build_repo_status_prompt() -> str:
+        diffs = repo.generate_diffs_with_context(current_repo, context_mode=context_mode, verbose=verbose, llm=llm)
+        if diffs == "":
+            console.print(rich.text.Text("No staged changes to commit, quitting!"), style="bold yellow")
+            sys.exit()
+        return f"{repo_status}\n\n{diffs}"
 
-    repo_status_prompt = f"{repo_status}\n\n{diffs}"
+    repo_status_prompt = build_repo_status_prompt if pregenerated is not None else build_repo_status_prompt()
     if skip_interaction:
         context = ""
     else:
@@ -91,27 +161,39 @@ def commit(
         )
         context = console.input("> ").strip().lower()
 
+    if context != "":
+        # generated without the context the user just gave
+        pregenerated = None
+    if pregenerated is not None:
+        console.print("[dim]Using the message generated ahead of time by `diffweave-ai watch`[/dim]")
+
     try:
-        msg = llm.iterate_on_commit_message(repo_status_prompt, context, return_first=skip_interaction)
+        msg = llm.iterate_on_commit_message(
+            repo_status_prompt,
+            context,
+            return_first=skip_interaction,
+            candidates=candidates,
+            first_message=pregenerated,
+        )
 
         if dry_run:
             return
 
         try:
-            run_cmd(f"git commit -m {shlex.quote(msg)}")
+            run_command(["git", "commit", "-m", msg], stream=True)
         except SystemError:
             console.print("[yellow]Commit failed — re-staging and retrying...[/yellow]")
             repo.add_files(current_repo)
-            run_cmd(f"git commit -m {shlex.quote(msg)}")
+            run_command(["git", "commit", "-m", msg], stream=True)
 
         if skip_interaction:
-            run_cmd("git push")
+            run_command(["git", "push"], stream=True)
             return
 
         console.print(rich.text.Text("Push? <enter>/y for yes, anything else for no", style="yellow"))
         should_push = console.input("> ").strip().lower()
         if should_push in ["", "y", "yes"]:
-            run_cmd("git push")
+            run_command(["git", "push"], stream=True)
 
         if open_browser:
             url = repo.get_repo_url(current_repo)
@@ -125,6 +207,31 @@ def commit(
 def pr(
     branch: Annotated[str, Parameter(help="Base branch to diff the current branch against")] = "main",
     verbose: Annotated[bool, Parameter(alias="-v", help="Print the prompt sent to the model before each generation attempt")] = False,
+    context_mode: Annotated[
+        Literal["auto", "full", "scoped", "diff-only"],
+        Parameter(
+            name="--context",
+            help="How much of each changed file to show: the whole file, only the functions/classes around each change, or just the diff. 'auto' picks based on the size of the change",
+        ),
+    ] = code_context.AUTO,
+    cache: Annotated[
+        bool,
+        Parameter(help="Reuse the response to an identical earlier request instead of querying the model again"),
+    ] = True,
+    incremental: Annotated[
+        bool,
+        Parameter(
+            alias="-i",
+            help="Summarize each commit once, caching the summary by commit SHA, and write the description from the commit summaries instead of the whole branch diff",
+        ),
+    ] = False,
+    use_daemon: Annotated[
+        bool,
+        Parameter(
+            name="--daemon",
+            help="Have a running daemon (see `diffweave-ai daemon start`) generate the description, or generate in-process if no daemon is running",
+        ),
+    ] = False,
 ):
     """
     Generate a pull request title and description for the current branch.
@@ -133,13 +240,58 @@ def pr(
     configured model to produce a PR title and body. The result is copied to your
     system clipboard automatically.
 
+    With `--incremental`, each commit on the branch is summarized instead, and only
+    commits that haven't been summarized before are sent to the model. Use it on
+    long-lived branches where the description is regenerated often.
+
     You will be prompted for optional context (e.g. reviewer notes, issue links)
     before generation.
     """
+    import copykitten
+    import rich.console
+    import rich.text
+
+    from . import daemon
+
     console = rich.console.Console()
 
+    if use_daemon:
+        if verbose:
+            console.print("[dim]The daemon doesn't serve --verbose runs, generating in-process[/dim]")
+        elif not daemon.is_running():
+            console.print(
+                "[dim]No daemon running, generating in-process. Start one with `diffweave-ai daemon start`[/dim]"
+            )
+        else:
+            console.rule("[bold]diffweave-ai pr[/bold]")
+            console.print(
+                rich.text.Text(
+                    "Do you have any additional context/information for this pull request? Leave blank for none.",
+                    style="yellow",
+                )
+            )
+            context = console.input("> ").strip().lower()
+            reply = daemon.generate(
+                {
+                    "command": "pr",
+                    "branch": branch,
+                    "context_mode": context_mode,
+                    "use_cache": cache,
+                    "incremental": incremental,
+                    "context": context,
+                },
+                console,
+                title="Generated PR description",
+                no_panel=True,
+            )
+            copykitten.copy(reply["message"])
+            console.print("Contents copied to system clipboard!", style="bold green")
+            return
+
+    from . import ai, repo
+
     try:
-        llm = ai.LLM(verbose=verbose, prompt="pull_request")
+        llm = ai.LLM(verbose=verbose, prompt="pull_request", use_cache=cache)
     except EnvironmentError:
         app('-h')
         sys.exit(1)
@@ -149,7 +301,13 @@ def pr(
 
     current_repo = repo.get_repo()
 
-    commit_summary, diffs = repo.generate_diffs_for_pull_request(current_repo, branch)
+    if incremental:
+        repo_status_prompt = repo.summarize_commits_for_pull_request(current_repo, branch, llm, use_cache=cache)
+    else:
+        commit_summary, diffs = repo.generate_diffs_for_pull_request(
+            current_repo, branch, context_mode=context_mode, verbose=verbose, llm=llm
+        )
+        repo_status_prompt = f"{commit_summary}\n\n{diffs}"
 
     console.print(
         rich.text.Text(
@@ -159,8 +317,6 @@ def pr(
     )
     context = console.input("> ").strip().lower()
 
-    repo_status_prompt = f"{commit_summary}\n\n{diffs}"
-
     try:
         msg = llm.iterate_on_commit_message(repo_status_prompt, context, return_first=True, no_panel=True)
         copykitten.copy(msg)
@@ -169,6 +325,61 @@ def pr(
         console.print(rich.text.Text("Quitting..."), style="bold red")
 
 
+@app.command
+def watch(
+    simple: Annotated[
+        bool,
+        Parameter(alias="-s", help="Use natural-language style instead of Conventional Commits (feat:, fix:, etc.)"),
+    ] = False,
+    context_mode: Annotated[
+        Literal["auto", "full", "scoped", "diff-only"],
+        Parameter(
+            name="--context",
+            help="How much of each changed file to show: the whole file, only the functions/classes around each change, or just the diff. 'auto' picks based on the size of the change",
+        ),
+    ] = code_context.AUTO,
+    settle: Annotated[
+        float | None,
+        Parameter(help="Seconds the staged changes must stay the same before a message is generated. Defaults to 2"),
+    ] = None,
+):
+    """
+    Generate commit messages in the background while you stage changes.
+
+    Watches the repository's index, and whenever the staged changes stop changing generates a
+    message for them. A later `diffweave-ai` run (with the same `--simple` and `--context`)
+    whose staged changes are exactly the same uses that message instead of waiting for the model.
+    Runs until interrupted with Ctrl-C.
+    """
+    import rich.console
+    import rich.text
+
+    from . import ai, repo, speculate
+
+    console = rich.console.Console()
+    prompt_name = "simple" if simple else "prompt"
+
+    try:
+        llm = ai.LLM(prompt=prompt_name)
+    except OSError:
+        app("-h")
+        sys.exit(1)
+
+    console.print(f"[dim]Model: {llm.model_name}[/dim]")
+    console.rule("[bold]diffweave-ai watch[/bold]")
+
+    try:
+        speculate.watch(
+            repo.get_repo(),
+            llm,
+            prompt_name,
+            context_mode,
+            settle=speculate.SETTLE_SECONDS if settle is None else settle,
+        )
+    except KeyboardInterrupt:
+        console.print(rich.text.Text("Stopped watching."), style="bold red")
+
+
 @app.command
 def set_token_model(
     model_name: Annotated[str, Parameter(alias="-m", help="Model identifier to pass to the API (e.g. gpt-4o, claude-3-5-sonnet-20241022)")],
@@ -176,6 +387,10 @@ def set_token_model(
     endpoint: Annotated[str, Parameter(alias="-e", help="Base URL of the OpenAI-compatible API endpoint")] = "https://api.openai.com/v1",
 ):
     """Configure a token-authenticated OpenAI-compatible model as the active LLM. Overwrites any existing configuration."""
+    import rich.console
+
+    from . import ai
+
     console = rich.console.Console()
     ai.configure_token_model(model_name, endpoint, token)
     console.print(f"Model [bold]{model_name}[/bold] configured.", style="green")
@@ -186,9 +401,189 @@ def set_databricks_browser_model(
     account: Annotated[str, Parameter(alias="-a", help="Databricks workspace account name (e.g. my-org)")],
 ):
     """Configure a Databricks-hosted model as the active LLM using browser-based authentication. Overwrites any existing configuration."""
+    import rich.console
+
+    from . import ai
+
     console = rich.console.Console()
     ai.configure_databricks_browser_model(model_name, account)
     console.print(f"Model [bold]{model_name}[/bold] configured.", style="green")
 
+
+cache_app = cyclopts.App(name="cache", help="Manage the cache of model responses.")
+app.command(cache_app)
+
+
+@cache_app.command(name="clear")
+def clear_cache():
+    """Remove every cached model response, commit summary and message generated by `watch`."""
+    import rich.console
+
+    from . import ai
+    from . import cache as response_cache
+
+    console = rich.console.Console()
+    removed = response_cache.ResponseCache(ai.CACHE_DIRECTORY).clear()
+    removed += response_cache.ResponseCache(ai.COMMIT_SUMMARY_DIRECTORY).clear()
+    removed += response_cache.ResponseCache(ai.SPECULATIVE_DIRECTORY).clear()
+    console.print(f"Removed {removed:,} cached response(s).", style="green")
+
+
+daemon_app = cyclopts.App(name="daemon", help="Run a background process that keeps the model client warm between runs.")
+app.command(daemon_app)
+
+
+@daemon_app.command(name="start")
+def start_daemon(
+    idle_timeout: Annotated[
+        float | None,
+        Parameter(help="Seconds without a request before the daemon exits. Defaults to 15 minutes"),
+    ] = None,
+    foreground: Annotated[
+        bool, Parameter(help="Serve requests from this process instead of starting one in the background")
+    ] = False,
+):
+    """Start a daemon that generates messages for `commit --daemon` and `pr --daemon`."""
+    import rich.console
+
+    from . import daemon
+
+    console = rich.console.Console()
+    if idle_timeout is None:
+        idle_timeout = daemon.IDLE_TIMEOUT_SECONDS
+    if foreground:
+        daemon.serve(idle_timeout)
+        return
+    if daemon.is_running():
+        console.print("A daemon is already running.", style="yellow")
+        return
+    pid = daemon.start(idle_timeout)
+    console.print(f"Daemon started (pid {pid}), logging to {daemon.LOG_FILE}.", style="green")
+
+
+@daemon_app.command(name="stop")
+def stop_daemon():
+    """Stop the running daemon."""
+    import rich.console
+
+    from . import daemon
+
+    console = rich.console.Console()
+    try:
+        daemon.request({"command": "stop"})
+    except ConnectionError:
+        console.print("No daemon is running.", style="yellow")
+        return
+    console.print("Daemon stopped.", style="green")
+
+
+@daemon_app.command(name="status")
+def daemon_status():
+    """Show whether a daemon is running, and which models it keeps warm."""
+    import rich.console
+
+    from . import daemon
+
+    console = rich.console.Console()
+    try:
+        status = daemon.request({"command": "status"})
+    except ConnectionError:
+        console.print("No daemon is running.", style="yellow")
+        return
+    models = ", ".join(status["models"]) or "none yet"
+    console.print(
+        f"Daemon running (pid {status['pid']}) for {status['uptime']:.0f}s, "
+        f"served {status['requests']:,} request(s), models: {models}"
+    )
+
+
+hook_app = cyclopts.App(name="hook", help="Generate messages for plain `git commit` with a prepare-commit-msg hook.")
+app.command(hook_app)
+
+
+@hook_app.command(name="install")
+def install_hook(
+    deadline: Annotated[
+        float | None,
+        Parameter(help="Seconds the hook may take before the commit goes ahead with an empty message. Defaults to 5"),
+    ] = None,
+    simple: Annotated[
+        bool,
+        Parameter(alias="-s", help="Use natural-language style instead of Conventional Commits (feat:, fix:, etc.)"),
+    ] = False,
+    force: Annotated[
+        bool, Parameter(help="Replace a prepare-commit-msg hook that wasn't installed by diffweave-ai")
+    ] = False,
+):
+    """Install a prepare-commit-msg hook in the current repository."""
+    import rich.console
+
+    from . import hook
+
+    console = rich.console.Console()
+    try:
+        path = hook.install(
+            pathlib.Path.cwd(),
+            deadline=hook.DEFAULT_DEADLINE_SECONDS if deadline is None else deadline,
+            simple=simple,
+            force=force,
+        )
+    except FileExistsError as e:
+        console.print(f"{e}. Use --force to replace it.", style="yellow")
+        sys.exit(1)
+    console.print(f"Installed {path}, logging to {hook.LOG_FILE}.", style="green")
+
+
+@hook_app.command(name="uninstall")
+def uninstall_hook():
+    """Remove the prepare-commit-msg hook installed by diffweave-ai from the current repository."""
+    import rich.console
+
+    from . import hook
+
+    console = rich.console.Console()
+    if hook.uninstall(pathlib.Path.cwd()):
+        console.print("Hook removed.", style="green")
+    else:
+        console.print("No hook installed by diffweave-ai.", style="yellow")
+
+
+@hook_app.command(name="run")
+def run_hook(
+    message_file: Annotated[pathlib.Path, Parameter(help="The commit message file, as passed by git")],
+    source: Annotated[str, Parameter(help="The source of the message, as passed by git")] = "",
+    commit_sha: Annotated[str, Parameter(help="The commit being amended, as passed by git")] = "",
+    deadline: Annotated[float | None, Parameter(help="Seconds to wait for a message. Defaults to 5")] = None,
+    simple: Annotated[
+        bool,
+        Parameter(alias="-s", help="Use natural-language style instead of Conventional Commits (feat:, fix:, etc.)"),
+    ] = False,
+):
+    """Fill in the commit message, run by the installed hook. Never asks for input."""
+    import os
+
+    import rich.console
+
+    from . import hook
+
+    console = rich.console.Console(stderr=True)
+    result = hook.run(
+        message_file,
+        source,
+        deadline=hook.DEFAULT_DEADLINE_SECONDS if deadline is None else deadline,
+        simple=simple,
+    )
+    if result.outcome in ("pregenerated", "daemon", "generated"):
+        console.print(f"[dim]diffweave-ai: message ready in {result.elapsed:.1f}s ({result.outcome})[/dim]")
+    elif result.outcome != "skipped":
+        console.print(f"[dim]diffweave-ai: no message ({result.describe()}), see {hook.LOG_FILE}[/dim]")
+
+    if result.timed_out:
+        # generation is still running on another thread; don't hold up the commit waiting for it
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(0)
+
+
 if __name__ == "__main__":
     app()
@@ -0,0 +1,201 @@
+"""
+Code context around each change, instead of whole file contents.
+
+Most of a modified file is usually unchanged, and shipping all of it costs far more tokens than
+the change itself. In "scoped" mode only the functions and classes enclosing each changed hunk
+are shown: Python files are parsed with `ast`, other languages fall back to an indentation-based
+scan for definition lines, and when no enclosing definition is found a window of lines around
+the change is shown instead.
+"""
+
+import ast
+import pathlib
+import re
+
+FULL = "full"
+SCOPED = "scoped"
+DIFF_ONLY = "diff-only"
+CONTEXT_MODES = (FULL, SCOPED, DIFF_ONLY)
+# let the planning pass pick one of the modes above from the size of the changeset
+AUTO = "auto"
+DEFAULT_CONTEXT_MODE = SCOPED
+
+# lines shown either side of a change that has no enclosing function or class
+WINDOW_LINES = 15
+# enclosing definitions longer than this are replaced by a window around the change
+MAX_SCOPE_LINES = 150
+# once the excerpts cover this much of a file, the whole file is shown instead
+FULL_FILE_RATIO = 0.8
+
+PYTHON_SUFFIXES = (".py", ".pyi")
+HUNK_RANGE = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@")
+# lines that open a function, class or similar block in common languages
+DEFINITION_LINE = re.compile(
+    r"""^\s*(?:(?:export|public|private|protected|internal|static|abstract|final|async|override|pub(?:\([\w:]+\))?
+    |default|inline|virtual|unsafe|extern|const|open|suspend|data|sealed)\s+)*
+    (?:def|class|function|func|fn|interface|struct|enum|impl|trait|module|object|namespace|protocol|extension
+    |sub|proc|fun)\b""",
+    flags=re.VERBOSE,
+)
+# C-family method signatures: `int main(int argc, char **argv) {`
+SIGNATURE_LINE = re.compile(
+    r"^\s*(?!(?:if|for|while|switch|catch|else|do|return)\b)[\w<>\[\],.*&:~ ]+\([^;]*\)[^;]*\{\s*$"
+)
+BLOCK_CLOSERS = ("}", "end", ")", "]")
+
+
+def changed_line_ranges(diff_text: str) -> list[tuple[int, int]]:
+    """
+    Find the lines of the new version of a file touched by a diff.
+
+    Removed lines are attributed to the line that now follows them.
+
+    Returns:
+        Sorted, non-overlapping (first, last) line ranges, 1-based and inclusive
+    """
+    ranges: list[tuple[int, int]] = []
+    new_line = None
+    for line in diff_text.splitlines():
+        if match := HUNK_RANGE.match(line):
+            new_line = int(match.group(1))
+            continue
+        if new_line is None or line.startswith("\\"):
+            continue
+        if line.startswith("+"):
+            _extend(ranges, new_line, new_line)
+            new_line += 1
+        elif line.startswith("-"):
+            _extend(ranges, max(new_line, 1), max(new_line, 1))
+        else:
+            new_line += 1
+    return ranges
+
+
+def extract_context(path: str, source: str, diff_text: str) -> str | None:
+    """
+    Cut a file down to the code enclosing each change in `diff_text`.
+
+    Args:
+        path: Path of the file, used to pick how it is parsed
+        source: The new version of the file
+        diff_text: The file's diff against its old version
+
+    Returns:
+        `source` itself if the enclosing code covers most of the file anyway, None if the diff
+        touches no lines of the new file, otherwise the enclosing code with line-number headings
+    """
+    lines = source.splitlines(keepends=True)
+    changes = [(min(first, len(lines)), min(last, len(lines))) for first, last in changed_line_ranges(diff_text)]
+    changes = [(first, last) for first, last in changes if first >= 1]
+    if not changes:
+        return None
+
+    scopes: list[tuple[int, int]] = []
+    for scope in sorted(_find_scopes(path, source, lines, changes)):
+        _extend(scopes, *scope)
+
+    if sum(last - first + 1 for first, last in scopes) >= FULL_FILE_RATIO * len(lines):
+        return source
+
+    excerpts = []
+    for first, last in scopes:
+        body = "".join(lines[first - 1 : last])
+        excerpts.append(f"(lines {first}-{last})\n{body}" + ("" if body.endswith("\n") else "\n"))
+    return "...\n".join(excerpts)
+
+
+def _extend(ranges: list[tuple[int, int]], first: int, last: int):
+    # ranges arrive sorted by their first line, so only the last one can overlap
+    if ranges and first <= ranges[-1][1] + 1:
+        ranges[-1] = (ranges[-1][0], max(last, ranges[-1][1]))
+    else:
+        ranges.append((first, last))
+
+
+def _find_scopes(path: str, source: str, lines: list[str], changes: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    definitions = None
+    if pathlib.PurePosixPath(path).suffix in PYTHON_SUFFIXES:
+        definitions = _python_definitions(source)
+
+    scopes = []
+    for first, last in changes:
+        if definitions is not None:
+            scope = _smallest_enclosing(definitions, first, last)
+        else:
+            scope = _indented_scope(lines, first, last)
+        if scope is None or scope[1] - scope[0] + 1 > MAX_SCOPE_LINES:
+            scope = (max(first - WINDOW_LINES, 1), min(last + WINDOW_LINES, len(lines)))
+        scopes.append(scope)
+    return scopes
+
+
+def _python_definitions(source: str) -> list[tuple[int, int]] | None:
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+
+    definitions = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            first = min([node.lineno] + [d.lineno for d in node.decorator_list])
+            definitions.append((first, node.end_lineno))
+    return definitions
+
+
+def _smallest_enclosing(definitions: list[tuple[int, int]], first: int, last: int) -> tuple[int, int] | None:
+    enclosing = [(start, end) for start, end in definitions if start <= first and end >= last]
+    return min(enclosing, key=lambda d: d[1] - d[0], default=None)
+
+
+def _indent(line: str) -> int:
+    return len(line) - len(line.lstrip())
+
+
+def _is_definition(line: str) -> bool:
+    return bool(DEFINITION_LINE.match(line) or SIGNATURE_LINE.match(line))
+
+
+def _indented_scope(lines: list[str], first: int, last: int) -> tuple[int, int] | None:
+    """
+    Find the block around lines `first`..`last` that is opened by a definition line.
+
+    Works for any language where blocks are indented, which is nearly all real-world code.
+    """
+    if _is_definition(lines[first - 1]):
+        start = first
+    else:
+        threshold = min((_indent(line) for line in lines[first - 1 : last] if line.strip()), default=None)
+        start = None
+        for n in range(first - 1, 0, -1):
+            line = lines[n - 1]
+            if not line.strip():
+                continue
+            if threshold is None or _indent(line) < threshold:
+                if _is_definition(line):
+                    start = n
+                    break
+                threshold = _indent(line)
+                if threshold == 0:
+                    return None
+        if start is None:
+            return None
+
+    end = _block_end(lines, start)
+    return (start, end) if end >= last else None
+
+
+def _block_end(lines: list[str], start: int) -> int:
+    indent = _indent(lines[start - 1])
+    end = start
+    for n in range(start + 1, len(lines) + 1):
+        line = lines[n - 1]
+        if not line.strip():
+            continue
+        if _indent(line) > indent:
+            end = n
+            continue
+        if _indent(line) == indent and line.strip().startswith(BLOCK_CLOSERS):
+            end = n
+        break
+    return end
@@ -0,0 +1,428 @@
+"""
+An opt-in background process that keeps the model client warm between runs.
+
+Every run of `diffweave-ai` pays for starting the interpreter, importing the model client and
+GitPython, parsing the configuration and opening a new connection to the provider before the
+first token arrives. `diffweave-ai daemon start` starts a process that pays those costs once.
+It listens on a Unix socket in the configuration directory and keeps a model per system prompt,
+and with it the model's connection pool, alive between requests. `commit --daemon` and
+`pr --daemon` then only read the repository status, send a request and print the reply. Models
+are rebuilt when the configuration file changes, and the daemon exits once it has been idle for
+a while.
+
+Requests are handled one at a time. A request is one line of JSON. The reply is a stream of JSON
+lines: a `{"token": ...}` for each chunk of the message as it is generated, then a final
+`{"message": ..., "model": ...}`, `{"empty": true}` when nothing is staged, or `{"error": ...}`.
+A commit request may name an `index_file` to describe instead of the repository's own index,
+which is how `git commit -a` stages changes before running the commit hooks.
+"""
+
+import contextlib
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import rich
+import rich.console
+import rich.live
+import rich.panel
+import rich.spinner
+import rich.text
+
+from . import ai
+
+if TYPE_CHECKING:
+    import git
+
+SOCKET_PATH = ai.CONFIG_DIRECTORY / "daemon.sock"
+LOG_FILE = ai.CONFIG_DIRECTORY / "daemon.log"
+IDLE_TIMEOUT_SECONDS = 15 * 60
+# how long `daemon start` waits for the new process to accept requests
+START_TIMEOUT_SECONDS = 10
+
+
+class Daemon:
+    """
+    The state kept warm between requests: one model per system prompt and one repository per
+    working directory.
+    """
+
+    def __init__(self):
+        self.models: dict[tuple[str, bool], ai.LLM] = {}
+        self.repos: dict[str, git.Repo] = {}
+        self.config_stamp = None
+        self.started = time.time()
+        self.requests = 0
+        self.stopping = False
+        # the working directory and `GIT_INDEX_FILE` a request runs with are process-wide, so
+        # requests that change them must never overlap, whichever server is calling `handle`
+        self.lock = threading.Lock()
+
+    def handle(self, request: dict, on_token: Callable[[str], None] | None = None) -> dict:
+        """
+        Serve one request.
+
+        Args:
+            request: The decoded request, with a `command` of "commit", "pr", "status" or "stop"
+            on_token: Called with each chunk of a generated message as it arrives
+
+        Returns:
+            The final reply
+        """
+        self.requests += 1
+        match request.get("command"):
+            case "stop":
+                self.stopping = True
+                return {"stopped": True}
+            case "status":
+                return {
+                    "pid": os.getpid(),
+                    "uptime": time.time() - self.started,
+                    "requests": self.requests,
+                    "models": sorted({llm.model_name for llm in self.models.values()}),
+                }
+            case "commit":
+                with self.lock, _working_directory(request["cwd"]), _index_file(request.get("index_file")):
+                    return self._commit(request, on_token)
+            case "pr":
+                with self.lock, _working_directory(request["cwd"]):
+                    return self._pull_request(request, on_token)
+            case command:
+                return {"error": f"Unknown command: {command}"}
+
+    def _commit(self, request: dict, on_token: Callable[[str], None] | None) -> dict:
+        from . import context, repo
+
+        model_key = (request.get("prompt", "prompt"), request.get("use_cache", True))
+        diffs = repo.generate_diffs_with_context(
+            self._repo(request["cwd"]),
+            context_mode=request.get("context_mode", context.AUTO),
+            llm=self._model(*model_key),
+        )
+        if diffs == "":
+            return {"empty": True}
+        return self._generate(model_key, f"{request['repo_status']}\n\n{diffs}", request.get("context", ""), on_token)
+
+    def _pull_request(self, request: dict, on_token: Callable[[str], None] | None) -> dict:
+        from . import context, repo
+
+        use_cache = request.get("use_cache", True)
+        model_key = ("pull_request", use_cache)
+        current_repo = self._repo(request["cwd"])
+        branch = request.get("branch", "main")
+        if request.get("incremental"):
+            repo_status_prompt = repo.summarize_commits_for_pull_request(
+                current_repo, branch, self._model(*model_key), use_cache=use_cache
+            )
+        else:
+            commit_summary, diffs = repo.generate_diffs_for_pull_request(
+                current_repo,
+                branch,
+                context_mode=request.get("context_mode", context.AUTO),
+                llm=self._model(*model_key),
+            )
+            repo_status_prompt = f"{commit_summary}\n\n{diffs}"
+        return self._generate(model_key, repo_status_prompt, request.get("context", ""), on_token)
+
+    def _generate(
+        self,
+        model_key: tuple[str, bool],
+        repo_status_prompt: str,
+        context: str,
+        on_token: Callable[[str], None] | None,
+    ) -> dict:
+        import openai
+
+        conversation = ai.initial_conversation(repo_status_prompt, context)
+        llm = self._model(*model_key)
+        try:
+            msg = llm.run(llm.query_model(conversation, on_token=on_token))
+        except openai.AuthenticationError:
+            # a cached Databricks token can expire while the daemon is running, so log in again once
+            self._close(self.models.pop(model_key))
+            llm = self._model(*model_key)
+            msg = llm.run(llm.query_model(conversation, on_token=on_token))
+        return {"message": msg, "model": llm.model_name}
+
+    def _model(self, prompt: str, use_cache: bool) -> ai.LLM:
+        """
+        The model for a system prompt, rebuilt whenever the configuration file changes.
+        """
+        stamp = _config_stamp()
+        if stamp != self.config_stamp:
+            for llm in self.models.values():
+                self._close(llm)
+            self.models.clear()
+            self.config_stamp = stamp
+        if (prompt, use_cache) not in self.models:
+            self.models[(prompt, use_cache)] = ai.LLM(prompt=prompt, use_cache=use_cache)
+        return self.models[(prompt, use_cache)]
+
+    def _repo(self, cwd: str) -> "git.Repo":
+        from . import repo
+
+        if cwd not in self.repos:
+            self.repos[cwd] = repo.get_repo()
+        return self.repos[cwd]
+
+    def close(self):
+        """
+        Close every model's connections and forget every repository.
+        """
+        for llm in self.models.values():
+            self._close(llm)
+        self.models.clear()
+        for current_repo in self.repos.values():
+            current_repo.close()
+        self.repos.clear()
+
+    @staticmethod
+    def _close(llm: ai.LLM):
+        llm.run(llm.client.close())
+        llm.loop.close()
+
+
+class _Server(socketserver.UnixStreamServer):
+    state: Daemon
+
+    def handle_timeout(self):
+        # no request arrived within `timeout` seconds
+        self.state.stopping = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: _Server
+
+    def handle(self):
+        def send(reply: dict):
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+            self.wfile.flush()
+
+        line = self.rfile.readline()
+        if not line:
+            # `is_running` connecting without sending anything
+            return
+        try:
+            request = json.loads(line)
+            reply = self.server.state.handle(request, on_token=lambda token: send({"token": token}))
+        except (BrokenPipeError, ConnectionResetError):
+            # the client was interrupted, nobody is left to reply to
+            return
+        except OSError as e:
+            reply = {"error": str(e) or "No model configured yet, run `diffweave-ai set-token-model` first"}
+        except (Exception, SystemExit) as e:  # noqa: BLE001
+            traceback.print_exc()
+            reply = {"error": str(e) or type(e).__name__}
+
+        with contextlib.suppress(BrokenPipeError, ConnectionResetError):
+            send(reply)
+
+
+def serve(idle_timeout: float = IDLE_TIMEOUT_SECONDS, socket_path: Path | None = None):
+    """
+    Serve requests on `socket_path` until asked to stop or idle for `idle_timeout` seconds.
+
+    Raises:
+        SystemExit: If another daemon is already listening on the socket
+    """
+    if socket_path is None:
+        socket_path = SOCKET_PATH
+    if is_running(socket_path):
+        raise SystemExit(f"A daemon is already listening on {socket_path}")
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    # left behind by a daemon that was killed
+    socket_path.unlink(missing_ok=True)
+
+    state = Daemon()
+    with _Server(str(socket_path), _Handler, bind_and_activate=False) as server:
+        server.state = state
+        server.timeout = idle_timeout
+        # only the user running the daemon may connect, since requests run git in any directory they name
+        umask = os.umask(0o177)
+        try:
+            server.server_bind()
+        finally:
+            os.umask(umask)
+        server.server_activate()
+        try:
+            while not state.stopping:
+                server.handle_request()
+        finally:
+            socket_path.unlink(missing_ok=True)
+            state.close()
+
+
+def start(idle_timeout: float = IDLE_TIMEOUT_SECONDS) -> int:
+    """
+    Start a daemon in the background, logging to `LOG_FILE`, and wait until it accepts requests.
+
+    Returns:
+        The daemon's process ID
+
+    Raises:
+        SystemExit: If the daemon exits or doesn't accept requests in time
+    """
+    LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with LOG_FILE.open("ab") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "diffweave.cli"]
+            + ["daemon", "start", "--foreground", "--idle-timeout", str(idle_timeout)],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+
+    deadline = time.monotonic() + START_TIMEOUT_SECONDS
+    while not is_running():
+        if process.poll() is not None:
+            raise SystemExit(f"The daemon exited on startup, see {LOG_FILE}")
+        if time.monotonic() > deadline:
+            raise SystemExit(f"The daemon did not start within {START_TIMEOUT_SECONDS} seconds, see {LOG_FILE}")
+        time.sleep(0.05)
+    return process.pid
+
+
+def is_running(socket_path: Path | None = None) -> bool:
+    """
+    Whether a daemon is accepting requests on `socket_path`.
+    """
+    try:
+        with _connect(socket_path):
+            return True
+    except ConnectionError:
+        return False
+
+
+def request(payload: dict, on_token: Callable[[str], None] | None = None, socket_path: Path | None = None) -> dict:
+    """
+    Send a request to the daemon and wait for its final reply.
+
+    Args:
+        payload: The request, see the module docstring
+        on_token: Called with each chunk of a generated message as it arrives
+        socket_path: The daemon's socket, `SOCKET_PATH` by default
+
+    Returns:
+        The final reply
+
+    Raises:
+        ConnectionError: If no daemon is listening, or it stops before replying
+    """
+    with _connect(socket_path) as sock, sock.makefile("rwb") as stream:
+        stream.write(json.dumps(payload).encode() + b"\n")
+        stream.flush()
+        for line in stream:
+            reply = json.loads(line)
+            if "token" not in reply:
+                return reply
+            if on_token is not None:
+                on_token(reply["token"])
+    raise ConnectionError("The daemon closed the connection without replying")
+
+
+def generate(payload: dict, console: rich.console.Console, title: str, no_panel: bool = False) -> dict:
+    """
+    Have the daemon generate a message for the current directory, showing it live as it arrives.
+
+    Args:
+        payload: The request, without the working directory
+        console: Where to show the message
+        title: Title of the finished message
+        no_panel: Print the message as plain text, for PR descriptions
+
+    Returns:
+        The final reply, either a message or `{"empty": true}`
+
+    Raises:
+        SystemExit: If the daemon replies with an error or goes away
+    """
+    streamed = []
+
+    def render():
+        if not streamed:
+            return rich.spinner.Spinner("dots", "Generating message...")
+        text = rich.text.Text("".join(streamed))
+        return text if no_panel else rich.panel.Panel(text, title="Generating commit message...")
+
+    with rich.live.Live(render(), console=console, refresh_per_second=15, transient=True) as live:
+
+        def on_token(token: str):
+            streamed.append(token)
+            live.update(render())
+
+        try:
+            reply = request({**payload, "cwd": os.getcwd()}, on_token=on_token)
+        except ConnectionError as e:
+            raise SystemExit(f"Lost the connection to the daemon: {e}")
+
+    if "error" in reply:
+        raise SystemExit(f"Daemon error: {reply['error']}")
+    if "message" in reply:
+        console.print(f"[dim]Model: {reply['model']} (daemon)[/dim]")
+        if no_panel:
+            console.rule(f"[bold]{title}[/bold]")
+            console.print(reply["message"])
+            console.rule()
+        else:
+            console.print(rich.panel.Panel(reply["message"], title=title))
+    return reply
+
+
+def _connect(socket_path: Path | None = None) -> socket.socket:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(SOCKET_PATH if socket_path is None else socket_path))
+    except (FileNotFoundError, ConnectionRefusedError) as e:
+        sock.close()
+        raise ConnectionRefusedError(f"No daemon is running: {e}") from e
+    return sock
+
+
+@contextlib.contextmanager
+def _working_directory(path: str) -> Iterator[None]:
+    """
+    Run a request in the directory it was sent from.
+    """
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+@contextlib.contextmanager
+def _index_file(path: str | None) -> Iterator[None]:
+    """
+    Point git at another index for the duration of a request, as `git commit -a` does for its hooks.
+    """
+    if path is None:
+        yield
+        return
+    previous = os.environ.get("GIT_INDEX_FILE")
+    os.environ["GIT_INDEX_FILE"] = path
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ["GIT_INDEX_FILE"]
+        else:
+            os.environ["GIT_INDEX_FILE"] = previous
+
+
+def _config_stamp() -> bytes | None:
+    # the contents rather than the modification time, which `ai.LLM` updates whenever it's built
+    try:
+        return ai.CONFIG_FILE.read_bytes()
+    except FileNotFoundError:
+        return None
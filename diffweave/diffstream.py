@@ -0,0 +1,291 @@
+"""
+Streaming `git diff` backend.
+
+Runs a single `git diff --raw --patch -z` process and parses its output incrementally into
+lightweight per-file `PatchRecord`s, so only one file's patch is held in memory at a time.
+The raw section gives exact, unquoted paths (NUL separated), and each patch in the section that
+follows is matched back to its raw entry by the paths in its `diff --git` header.
+"""
+
+import dataclasses
+import pathlib
+import subprocess
+from collections.abc import Iterator
+from typing import IO
+
+# lines that start a new file's section in the patch output
+PATCH_HEADER = b"diff --git "
+UNMERGED_HEADER = b"* Unmerged path "
+# lines kept from the patch body
+BINARY_MARKER = b"Binary files "
+HUNK_MARKER = b"@@"
+# patch bytes kept per file, anything past this is counted but not held in memory
+MAX_PATCH_SIZE = 1_000_000
+# longest chunk read at once, so a single huge (e.g. minified) line is never read whole
+READ_CHUNK_SIZE = 64 * 1024
+# characters git writes as a backslash escape in quoted paths
+C_ESCAPES = {
+    0x07: b"a",
+    0x08: b"b",
+    0x09: b"t",
+    0x0A: b"n",
+    0x0B: b"v",
+    0x0C: b"f",
+    0x0D: b"r",
+    ord('"'): b'"',
+    ord("\\"): b"\\",
+}
+
+
+@dataclasses.dataclass(slots=True)
+class PatchRecord:
+    """
+    A single file from `git diff`, shaped like the parts of `git.diff.Diff` the prompt builder uses.
+
+    Args:
+        a_path: Path before the change, None for added files
+        b_path: Path after the change, None for removed files
+        change_type: The git status letter (A, C, D, M, R, T, U)
+        a_blob_id: Full object id of the old blob
+        b_blob_id: Full object id of the new blob
+        similarity: Rename/copy similarity score in percent, if any
+        diff: The hunks of the patch (headers stripped), like `git.diff.Diff.diff`
+        additions: Number of added lines in the whole patch
+        deletions: Number of removed lines in the whole patch
+        truncated: Whether `diff` was cut off at `MAX_PATCH_SIZE`
+    """
+
+    a_path: str | None
+    b_path: str | None
+    change_type: str
+    a_blob_id: str
+    b_blob_id: str
+    similarity: int | None = None
+    diff: bytes = b""
+    additions: int = 0
+    deletions: int = 0
+    truncated: bool = False
+
+    @property
+    def new_file(self) -> bool:
+        return self.change_type == "A"
+
+    @property
+    def deleted_file(self) -> bool:
+        return self.change_type == "D"
+
+    @property
+    def renamed_file(self) -> bool:
+        return self.change_type == "R"
+
+    @property
+    def copied_file(self) -> bool:
+        return self.change_type == "C"
+
+
+def iter_staged_diffs(project_root: pathlib.Path) -> Iterator[PatchRecord]:
+    """
+    Stream the staged changes of the repository at `project_root`, one file at a time.
+    """
+    return iter_diffs(project_root, "--cached")
+
+
+def iter_diffs(project_root: pathlib.Path, *diff_args: str) -> Iterator[PatchRecord]:
+    """
+    Stream `git diff <diff_args>` as `PatchRecord`s.
+
+    Args:
+        project_root: Root of the git repository to run in
+        diff_args: Extra arguments for `git diff`, e.g. "--cached" or two revisions
+
+    Raises:
+        SystemError: If git exits with a non-zero status
+    """
+    cmd = [
+        "git",
+        "-c",
+        "core.quotePath=false",
+        "diff",
+        *diff_args,
+        "--raw",
+        "--patch",
+        "-z",
+        "-M",
+        "-C",
+        "--no-abbrev",
+        "--no-color",
+        "--no-ext-diff",
+        "--src-prefix=a/",
+        "--dst-prefix=b/",
+    ]
+    process = subprocess.Popen(cmd, cwd=project_root, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        yield from parse_diff_stream(process.stdout)
+        error = process.stderr.read().decode("utf-8", errors="replace").strip()
+        if process.wait() != 0:
+            raise SystemError(error)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def parse_diff_stream(stream: IO[bytes]) -> Iterator[PatchRecord]:
+    """
+    Parse the output of `git diff --raw --patch -z` incrementally.
+
+    Each patch is matched to its raw entry by the paths in its header. A typechange (e.g. a file
+    replaced by a symlink) has a single raw entry but two patches, a deletion and an addition,
+    which both end up in the same record. At most `MAX_PATCH_SIZE` bytes of any one patch are
+    kept, so memory use is bounded by that rather than by the size of the changeset.
+
+    Raises:
+        ValueError: If the output can't be parsed, or a patch doesn't belong to any raw entry
+    """
+    records = _parse_raw_section(stream)
+    if not records:
+        return
+    pending = {_patch_header(record): record for record in records}
+    if len(pending) != len(records):
+        raise ValueError("git diff listed the same paths more than once")
+    # records are only held in `pending` from here on, so each one (and its patch) can be let go
+    # of once it has been yielded
+    del records
+
+    current = None
+    current_header = None
+    body: list[bytes] = []
+    body_size = 0
+    in_hunks = False
+    at_line_start = True
+    while chunk := stream.readline(READ_CHUNK_SIZE):
+        starts_line = at_line_start
+        at_line_start = chunk.endswith(b"\n")
+        if not starts_line:
+            # the rest of a line longer than READ_CHUNK_SIZE
+            if current is not None and body_size + len(chunk) <= MAX_PATCH_SIZE and not current.truncated:
+                body.append(chunk)
+                body_size += len(chunk)
+            elif current is not None:
+                current.truncated = True
+            continue
+
+        if chunk.startswith((PATCH_HEADER, UNMERGED_HEADER)):
+            in_hunks = False
+            header = chunk.rstrip(b"\n")
+            if header == current_header:
+                # the second half of a typechange
+                continue
+            if current is not None:
+                current.diff = b"".join(body)
+                yield current
+            if (current := pending.pop(header, None)) is None:
+                raise ValueError(f"Patch without a matching raw entry: {header!r}")
+            current_header = header
+            body = []
+            body_size = 0
+            continue
+
+        if not (in_hunks or chunk.startswith((HUNK_MARKER, BINARY_MARKER))):
+            continue
+        if current is None:
+            raise ValueError(f"Patch content before any header: {chunk[:100]!r}")
+
+        in_hunks = in_hunks or chunk.startswith(HUNK_MARKER)
+        if chunk.startswith(b"+"):
+            current.additions += 1
+        elif chunk.startswith(b"-"):
+            current.deletions += 1
+
+        if not current.truncated and body_size + len(chunk) <= MAX_PATCH_SIZE:
+            body.append(chunk)
+            body_size += len(chunk)
+        else:
+            current.truncated = True
+
+    if current is not None:
+        current.diff = b"".join(body)
+        yield current
+
+    # entries git printed no patch for (there shouldn't be any) still get a record
+    yield from pending.values()
+
+
+def _parse_raw_section(stream: IO[bytes]) -> list[PatchRecord]:
+    records = []
+    while (token := _read_token(stream)) is not None:
+        if token == b"":
+            # an empty token is the separator between the raw and patch sections
+            break
+
+        # :<old mode> <new mode> <old sha> <new sha> <status><score>
+        _, _, a_blob_id, b_blob_id, status = token.decode("ascii").lstrip(":").split(" ")
+        change_type = status[0]
+        first_path = _read_path(stream)
+        second_path = _read_path(stream) if change_type in ("R", "C") else first_path
+
+        records.append(
+            PatchRecord(
+                a_path=None if change_type == "A" else first_path,
+                b_path=None if change_type == "D" else second_path,
+                change_type=change_type,
+                a_blob_id=a_blob_id,
+                b_blob_id=b_blob_id,
+                similarity=int(status[1:]) if status[1:] else None,
+            )
+        )
+    return records
+
+
+def _read_path(stream: IO[bytes]) -> str:
+    if (token := _read_token(stream)) is None:
+        raise ValueError("git diff output ended in the middle of a raw entry")
+    return token.decode("utf-8", errors="surrogateescape")
+
+
+def _patch_header(record: PatchRecord) -> bytes:
+    """
+    The line git starts `record`'s patch with, without the newline.
+    """
+    a_path = record.a_path if record.a_path is not None else record.b_path
+    b_path = record.b_path if record.b_path is not None else record.a_path
+    if record.change_type == "U":
+        return UNMERGED_HEADER + a_path.encode("utf-8", errors="surrogateescape")
+    return PATCH_HEADER + _quote_path("a/" + a_path) + b" " + _quote_path("b/" + b_path)
+
+
+def _quote_path(path: str) -> bytes:
+    """
+    Quote a path the way git does in patch headers with `core.quotePath=false`.
+    """
+    raw = path.encode("utf-8", errors="surrogateescape")
+    if not any(byte < 0x20 or byte in b'"\\\x7f' for byte in raw):
+        return raw
+    quoted = bytearray(b'"')
+    for byte in raw:
+        if byte in C_ESCAPES:
+            quoted += b"\\" + C_ESCAPES[byte]
+        elif byte < 0x20 or byte == 0x7F:
+            quoted += b"\\%03o" % byte
+        else:
+            quoted.append(byte)
+    quoted += b'"'
+    return bytes(quoted)
+
+
+def _read_token(stream: IO[bytes]) -> bytes | None:
+    """
+    Read up to (and drop) the next NUL byte, or None at end of stream.
+    """
+    chunks = []
+    while True:
+        buffered = stream.peek(1)
+        if not buffered:
+            return b"".join(chunks) if chunks else None
+        end = buffered.find(b"\0")
+        if end >= 0:
+            chunks.append(stream.read(end + 1)[:-1])
+            return b"".join(chunks)
+        chunks.append(stream.read(len(buffered)))
@@ -0,0 +1,289 @@
+"""
+A `prepare-commit-msg` hook that fills in the message for a plain `git commit`.
+
+A hook that blocks `git commit` until the model answers is worse than no hook, so the hook runs
+under a strict deadline. It uses the quickest source that's available, in this order:
+
+1. a message `watch` generated ahead of time for exactly the staged changes
+2. a running daemon, whose model client is already warm
+3. generating in-process
+
+If no message is ready when the deadline passes, the commit goes ahead with git's own empty
+template. Every run appends a line to `LOG_FILE` with how long each phase took, so a deadline
+that's too tight for the repository shows up there.
+"""
+
+import contextlib
+import dataclasses
+import datetime
+import io
+import os
+import pathlib
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from typing import TextIO
+
+from . import ai, context
+
+HOOK_NAME = "prepare-commit-msg"
+# marks hooks written by `install`, so an unrelated hook is never overwritten or removed
+HOOK_MARKER = "# installed by diffweave-ai"
+DEFAULT_DEADLINE_SECONDS = 5.0
+LOG_FILE = ai.CONFIG_DIRECTORY / "hook.log"
+# git passes no source for a plain `git commit`, and "template" for one with commit.template set.
+# Messages given with -m/-F, merges, squashes and amends are left alone
+GENERATED_SOURCES = ("", "template")
+
+
+@dataclasses.dataclass
+class HookResult:
+    """
+    What a hook run did.
+
+    Args:
+        outcome: "pregenerated", "daemon", "generated", "skipped", "empty", "timeout" or "error"
+        phases: Each phase that finished, with how long it took in seconds
+        elapsed: Seconds from the start of the run to the message being written, or to the deadline
+        detail: The phase the deadline passed in, or the error
+    """
+
+    outcome: str
+    phases: list[tuple[str, float]] = dataclasses.field(default_factory=list)
+    elapsed: float = 0.0
+    detail: str = ""
+
+    @property
+    def timed_out(self) -> bool:
+        return self.outcome == "timeout"
+
+    def describe(self) -> str:
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases)
+        detail = f" {self.detail}" if self.detail else ""
+        return f"{self.outcome}{detail} in {self.elapsed:.2f}s ({phases or 'no phases'})"
+
+
+class _Timings:
+    def __init__(self):
+        self.phases: list[tuple[str, float]] = []
+        self.current = "startup"
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        self.current = name
+        started = time.perf_counter()
+        yield
+        self.phases.append((name, time.perf_counter() - started))
+
+
+class _ThreadOutput(io.TextIOBase):
+    """
+    Stands in for `sys.stdout`, keeping what one thread writes in a buffer of its own.
+    """
+
+    def __init__(self, original: TextIO, thread: threading.Thread):
+        self.original = original
+        self.thread = thread
+        self.captured = io.StringIO()
+
+    def write(self, text: str) -> int:
+        if threading.current_thread() is self.thread:
+            return self.captured.write(text)
+        return self.original.write(text)
+
+    def flush(self):
+        self.original.flush()
+
+
+def hook_path(project_root: pathlib.Path) -> pathlib.Path:
+    """
+    Where git looks for the hook, respecting `core.hooksPath`.
+    """
+    process = subprocess.run(
+        ["git", "rev-parse", "--git-path", f"hooks/{HOOK_NAME}"],
+        cwd=project_root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return (project_root / process.stdout.strip()).resolve()
+
+
+def install(
+    project_root: pathlib.Path,
+    deadline: float = DEFAULT_DEADLINE_SECONDS,
+    simple: bool = False,
+    force: bool = False,
+) -> pathlib.Path:
+    """
+    Install the hook into a repository.
+
+    The hook runs this interpreter, so it keeps working from a virtual environment that isn't
+    on the `PATH` when git runs hooks.
+
+    Args:
+        project_root: The repository's working tree
+        deadline: Seconds the hook may take before the commit goes ahead without a message
+        simple: Use natural-language style instead of Conventional Commits
+        force: Replace a hook that wasn't installed by diffweave-ai
+
+    Returns:
+        The path of the installed hook
+
+    Raises:
+        FileExistsError: If another hook is installed and `force` isn't set
+    """
+    path = hook_path(project_root)
+    if path.exists() and HOOK_MARKER not in path.read_text(errors="replace") and not force:
+        raise FileExistsError(f"{path} already exists and wasn't installed by diffweave-ai")
+
+    command = [sys.executable, "-m", "diffweave.cli", "hook", "run", "--deadline", str(deadline)]
+    if simple:
+        command.append("--simple")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # never fail the commit, whatever happens to the hook
+    path.write_text(f'#!/bin/sh\n{HOOK_MARKER}\n{shlex.join(command)} "$@" || true\n')
+    path.chmod(0o755)
+    return path
+
+
+def uninstall(project_root: pathlib.Path) -> bool:
+    """
+    Remove the hook, if it was installed by diffweave-ai.
+
+    Returns:
+        Whether a hook was removed
+    """
+    path = hook_path(project_root)
+    if not path.exists() or HOOK_MARKER not in path.read_text(errors="replace"):
+        return False
+    path.unlink()
+    return True
+
+
+def run(
+    message_file: pathlib.Path,
+    source: str = "",
+    deadline: float = DEFAULT_DEADLINE_SECONDS,
+    simple: bool = False,
+) -> HookResult:
+    """
+    Write a generated message into `message_file`, unless the deadline passes first.
+
+    The message goes above whatever git put in the file, so the commented-out status stays
+    below it. Generation runs on a background thread, which is abandoned if the deadline
+    passes: the caller should then exit without waiting for it.
+
+    Args:
+        message_file: The commit message file git passed to the hook
+        source: The message's source git passed to the hook, empty for a plain `git commit`
+        deadline: Seconds to wait for a message
+        simple: Use natural-language style instead of Conventional Commits
+
+    Returns:
+        What the run did, also appended to `LOG_FILE`
+    """
+    started = time.perf_counter()
+    if source not in GENERATED_SOURCES:
+        return _log(HookResult("skipped", detail=f"({source} commit)"))
+
+    timings = _Timings()
+    outcome: dict[str, object] = {}
+
+    def work():
+        try:
+            outcome["result"] = _generate(timings, "simple" if simple else "prompt")
+        except BaseException as e:  # noqa: BLE001
+            outcome["error"] = e
+
+    # a daemon thread, so one that's abandoned at the deadline can't keep the hook running
+    thread = threading.Thread(target=work, daemon=True)
+    # everything generation prints would end up in the middle of `git commit`'s output
+    output = _ThreadOutput(sys.stdout, thread)
+    sys.stdout = output
+    thread.start()
+    thread.join(deadline)
+    elapsed = time.perf_counter() - started
+    if not thread.is_alive():
+        sys.stdout = output.original
+    # otherwise it stays in place, so whatever the abandoned thread prints later is still kept out of git's output
+
+    if thread.is_alive():
+        result = HookResult("timeout", list(timings.phases), elapsed, f"during {timings.current}")
+    elif "error" in outcome:
+        result = HookResult("error", list(timings.phases), elapsed, repr(outcome["error"]))
+    else:
+        source_name, msg = outcome["result"]
+        if msg:
+            message_file.write_text(f"{msg}\n{message_file.read_text()}")
+        result = HookResult(source_name if msg else "empty", list(timings.phases), elapsed)
+    return _log(result)
+
+
+def _generate(timings: _Timings, prompt_name: str) -> tuple[str, str | None]:
+    """
+    Generate a message from the quickest source available.
+
+    Returns:
+        Where the message came from, and the message, or None if nothing is staged
+    """
+    with timings.phase("config"):
+        model_name = ai.load_config().get("model_name")
+        if model_name is None:
+            raise OSError("No model configured yet")
+
+    with timings.phase("imports"):
+        from . import cache, daemon, repo, speculate, utils
+
+    with timings.phase("lookup"):
+        current_repo = repo.get_repo()
+        key = speculate.staged_key(current_repo, model_name, prompt_name, context.AUTO)
+        store = cache.ResponseCache(ai.SPECULATIVE_DIRECTORY)
+        if key is not None and (msg := store.get(key)) is not None:
+            return "pregenerated", msg
+
+    with timings.phase("status"):
+        repo_status, _ = utils.run_command(["git", "status"], show_output=False, silent=True)
+
+    if daemon.is_running():
+        with timings.phase("daemon"):
+            index_file = os.environ.get("GIT_INDEX_FILE")
+            reply = daemon.request(
+                {
+                    "command": "commit",
+                    "cwd": os.getcwd(),
+                    "prompt": prompt_name,
+                    "repo_status": repo_status,
+                    # `git commit -a` and `git commit <paths>` stage into a temporary index
+                    "index_file": os.path.abspath(index_file) if index_file else None,
+                }
+            )
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        msg = reply.get("message")
+        source_name = "daemon"
+    else:
+        with timings.phase("client"):
+            llm = ai.LLM(prompt=prompt_name)
+        with timings.phase("diffs"):
+            diffs = repo.generate_diffs_with_context(current_repo, llm=llm)
+        if diffs == "":
+            return "empty", None
+        with timings.phase("generate"):
+            msg = llm.run(llm.query_model(ai.initial_conversation(f"{repo_status}\n\n{diffs}", "")))
+        source_name = "generated"
+
+    # an aborted commit that's retried with the same staged changes gets the message straight away
+    if key is not None and msg:
+        store.put(key, msg)
+    return source_name, msg
+
+
+def _log(result: HookResult) -> HookResult:
+    LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with LOG_FILE.open("a") as log:
+        log.write(f"{datetime.datetime.now().isoformat(timespec='seconds')} {os.getcwd()} {result.describe()}\n")
+    return result
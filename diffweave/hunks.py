@@ -0,0 +1,139 @@
+"""
+Hunk-aware shrinking of unified diffs.
+
+Instead of replacing an oversized diff wholesale, `reduce_diff` keeps every hunk header with its
+changed-line counts, keeps the most significant hunks in full, and collapses the rest to
+one-line stubs, so a diff of any size can be brought under a target size.
+"""
+
+import dataclasses
+import re
+
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+\d+(?:,\d+)? @@")
+
+
+@dataclasses.dataclass
+class Hunk:
+    header: str
+    lines: list[str]
+    additions: int = 0
+    deletions: int = 0
+
+    @property
+    def lines_changed(self) -> int:
+        return self.additions + self.deletions
+
+    @property
+    def num_lines(self) -> int:
+        # "\ No newline at end of file" is a marker, not a line of either version
+        return sum(1 for line in self.lines if not line.startswith("\\"))
+
+    def render(self) -> str:
+        return self.header + "".join(self.lines)
+
+    def render_stub(self) -> str:
+        return f"{self.header}... {self.num_lines} lines (+{self.additions} -{self.deletions}) omitted ...\n"
+
+    def render_head(self, max_size: int) -> str | None:
+        """
+        Render as many leading lines of the hunk as fit in `max_size`, or None if none do.
+        """
+        remaining_lines = self.num_lines
+        size = len(self.header)
+        kept = []
+        for line in self.lines:
+            note = f"... {remaining_lines} more lines omitted ...\n"
+            if size + len(line) + len(note) > max_size:
+                break
+            kept.append(line)
+            size += len(line)
+            if not line.startswith("\\"):
+                remaining_lines -= 1
+        if not kept:
+            return None
+        return self.header + "".join(kept) + f"... {remaining_lines} more lines omitted ...\n"
+
+
+def parse_hunks(diff_text: str) -> tuple[str, list[Hunk]]:
+    """
+    Split a diff into whatever precedes the first hunk, and its hunks.
+    """
+    preamble = []
+    hunks: list[Hunk] = []
+    for line in diff_text.splitlines(keepends=True):
+        if HUNK_HEADER.match(line):
+            hunks.append(Hunk(header=line if line.endswith("\n") else line + "\n", lines=[]))
+        elif not hunks:
+            preamble.append(line)
+        else:
+            hunks[-1].lines.append(line)
+            if line.startswith("+"):
+                hunks[-1].additions += 1
+            elif line.startswith("-"):
+                hunks[-1].deletions += 1
+    return "".join(preamble), hunks
+
+
+def reduce_diff(diff_text: str, max_size: int) -> str:
+    """
+    Shrink a diff to at most `max_size` characters, degrading gracefully.
+
+    Every hunk starts out as a stub (its header plus changed-line counts). Hunks are then
+    restored in full in order of how many lines they change, and leftover space goes to the
+    leading lines of the most significant hunks that didn't fit. If even the stubs don't fit,
+    trailing hunks are folded into a single "more hunks omitted" line.
+
+    Args:
+        diff_text: The unified diff (hunks only, or with a short preamble)
+        max_size: Maximum number of characters in the result
+
+    Returns:
+        The diff itself if it already fits, otherwise a reduced version
+    """
+    if len(diff_text) <= max_size:
+        return diff_text
+
+    preamble, hunks = parse_hunks(diff_text)
+    if not hunks:
+        return diff_text[:max_size]
+
+    renders = [hunk.render_stub() for hunk in hunks]
+    remaining = max_size - len(preamble) - sum(len(r) for r in renders)
+
+    if remaining < 0:
+        return preamble + _fold_stubs(hunks, renders, max_size - len(preamble))
+
+    ranked = sorted(range(len(hunks)), key=lambda i: (-hunks[i].lines_changed, i))
+    collapsed = []
+    for i in ranked:
+        full = hunks[i].render()
+        extra = len(full) - len(renders[i])
+        if extra <= remaining:
+            renders[i] = full
+            remaining -= extra
+        else:
+            collapsed.append(i)
+
+    for i in collapsed:
+        head = hunks[i].render_head(remaining + len(renders[i]))
+        if head is not None and len(head) > len(renders[i]):
+            remaining -= len(head) - len(renders[i])
+            renders[i] = head
+
+    return preamble + "".join(renders)
+
+
+def _fold_stubs(hunks: list[Hunk], stubs: list[str], max_size: int) -> str:
+    kept = []
+    size = 0
+    for i in range(len(hunks)):
+        rest = hunks[i:]
+        note = (
+            f"... {len(rest)} more hunks (+{sum(h.additions for h in rest)} -{sum(h.deletions for h in rest)}) "
+            "omitted ...\n"
+        )
+        if size + len(stubs[i]) + len(note) > max_size:
+            return "".join(kept) + note
+        kept.append(stubs[i])
+        size += len(stubs[i])
+    return "".join(kept)
@@ -0,0 +1,152 @@
+"""
+Ignore rules for files that shouldn't be sent to the model.
+
+Patterns use gitignore syntax and come from a `.diffweaveignore` file at the repository root
+and the `ignore` / `summarize` lists in `~/.config/diffweave/config.yaml`. Each pattern list is
+compiled once into a single regular expression, so matching a path costs one regex call per
+directory level no matter how many patterns there are.
+"""
+
+import pathlib
+import re
+
+from . import ai
+
+IGNORE_FILE_NAME = ".diffweaveignore"
+
+
+class IgnoreRules:
+    """
+    A compiled set of gitignore-style patterns.
+
+    As in gitignore, later patterns take precedence over earlier ones, `!pattern` re-includes
+    a path, a trailing `/` only matches directories, and a path inside an ignored directory is
+    always ignored.
+    """
+
+    def __init__(self, patterns: list[str]):
+        self.patterns = [p for p in (_clean_pattern(line) for line in patterns) if p is not None]
+        # later patterns win, and the regex engine takes the first alternative that matches,
+        # so alternatives are added last pattern first
+        indexed = list(enumerate(self.patterns))
+        self._any_regex = _compile(indexed)
+        self._file_regex = _compile([(i, p) for i, p in indexed if not p.endswith("/")])
+        self._negated = {f"p{i}" for i, p in enumerate(self.patterns) if p.startswith("!")}
+        self._dir_cache: dict[str, bool] = {}
+
+    @classmethod
+    def from_file(cls, path: pathlib.Path, extra_patterns: list[str] | None = None) -> "IgnoreRules":
+        """
+        Load patterns from a gitignore-style file (if it exists), followed by `extra_patterns`.
+        """
+        patterns = path.read_text().splitlines() if path.is_file() else []
+        return cls(patterns + list(extra_patterns or []))
+
+    def __bool__(self) -> bool:
+        return bool(self.patterns)
+
+    def matches(self, path: str) -> bool:
+        """
+        Whether `path` (relative to the repository root, `/` separated) is ignored.
+        """
+        if not self.patterns:
+            return False
+
+        parts = path.strip("/").split("/")
+        for depth in range(1, len(parts)):
+            if self._dir_matches("/".join(parts[:depth])):
+                return True
+        return self._last_match_ignores(self._file_regex, path.strip("/"))
+
+    def _dir_matches(self, directory: str) -> bool:
+        if directory not in self._dir_cache:
+            self._dir_cache[directory] = self._last_match_ignores(self._any_regex, directory)
+        return self._dir_cache[directory]
+
+    def _last_match_ignores(self, regex: re.Pattern | None, path: str) -> bool:
+        if regex is None or (match := regex.fullmatch(path)) is None:
+            return False
+        return match.lastgroup not in self._negated
+
+
+def _clean_pattern(line: str) -> str | None:
+    line = line.rstrip("\n")
+    # trailing spaces are ignored unless escaped
+    stripped = line.rstrip(" ")
+    if stripped.endswith("\\") and len(stripped) < len(line):
+        stripped += " "
+    if not stripped or stripped.startswith("#"):
+        return None
+    return stripped
+
+
+def _compile(indexed_patterns: list[tuple[int, str]]) -> re.Pattern | None:
+    if not indexed_patterns:
+        return None
+
+    # group names keep the index into the full pattern list, so negations can be looked up
+    alternatives = [f"(?P<p{i}>{_translate(p)})" for i, p in reversed(indexed_patterns)]
+    return re.compile("|".join(alternatives), flags=re.DOTALL)
+
+
+def _translate(pattern: str) -> str:
+    """
+    Translate a single gitignore pattern into a regular expression body.
+    """
+    if pattern.startswith(("!", "\\!", "\\#")):
+        pattern = pattern[1:]
+    pattern = pattern.rstrip("/")
+
+    # a slash anywhere but the end anchors the pattern to the repository root
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+
+    regex = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**/", i):
+            regex.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            regex.append("/.*")
+            i += 3
+        elif pattern.startswith("**", i):
+            regex.append(".*")
+            i += 2
+        elif char == "*":
+            regex.append("[^/]*")
+            i += 1
+        elif char == "?":
+            regex.append("[^/]")
+            i += 1
+        elif char == "[" and (end := pattern.find("]", i + 2)) != -1:
+            body = pattern[i + 1 : end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            regex.append(f"[{body}]")
+            i = end + 1
+        elif char == "\\" and i + 1 < len(pattern):
+            regex.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            regex.append(re.escape(char))
+            i += 1
+
+    body = "".join(regex)
+    return body if anchored else f"(?:.*/)?{body}"
+
+
+def load_rules(project_root: pathlib.Path) -> tuple[IgnoreRules, IgnoreRules]:
+    """
+    Compile the ignore rules for the repository at `project_root`.
+
+    Returns:
+        Rules for files dropped from the prompt entirely (`.diffweaveignore` plus the config's
+        `ignore` list), and rules for files reduced to a one-line summary (the config's
+        `summarize` list)
+    """
+    config = ai.load_config()
+    dropped = IgnoreRules.from_file(project_root / IGNORE_FILE_NAME, config.get("ignore", []))
+    summarized = IgnoreRules(config.get("summarize", []))
+    return dropped, summarized
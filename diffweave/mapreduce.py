@@ -0,0 +1,173 @@
+"""
+Map-reduce summarization for changesets too big for a single prompt.
+
+Instead of cutting most files down to one-line summaries, the changed files are packed into
+groups that each fit the token budget, and every group is summarized by the model (the map
+step), a few requests at a time. The summaries then stand in for the diffs in the prompt that
+writes the final message (the reduce step), so every file's changes are seen by the model once.
+"""
+
+import asyncio
+from collections.abc import Iterable, Iterator, Sized
+
+import rich
+import rich.console
+import rich.padding
+import rich.text
+
+from . import ai, prompt
+
+# map requests in flight at once, so a huge changeset doesn't flood the endpoint
+MAP_CONCURRENCY = 4
+# system prompts for summarizing a group of changed files, and a single commit on a branch
+SUMMARY_PROMPT = "summarize"
+COMMIT_SUMMARY_PROMPT = "summarize_commit"
+
+
+def group_file_diffs(file_diffs: list[prompt.FileDiff], group_budget: int) -> list[list[prompt.FileDiff]]:
+    """
+    Pack files, in order, into groups whose rendered diffs fit `group_budget` tokens.
+
+    A file too big to fit any group gets a group of its own, and is cut down to size when the
+    group's prompt is built.
+    """
+    return list(iter_groups(file_diffs, group_budget))
+
+
+def iter_groups(file_diffs: Iterable[prompt.FileDiff], group_budget: int) -> Iterator[list[prompt.FileDiff]]:
+    """
+    Like `group_file_diffs`, but yields each group as soon as it's full, so files that were
+    streamed in can be summarized and let go of before the rest are read.
+    """
+    group: list[prompt.FileDiff] = []
+    group_tokens = 0
+    for file_diff in file_diffs:
+        tokens = prompt.estimate_tokens(prompt.render_file(prompt.deduplicate(file_diff), include_contents=False))
+        if group and group_tokens + tokens > group_budget:
+            yield group
+            group = []
+            group_tokens = 0
+        group.append(file_diff)
+        group_tokens += tokens
+    if group:
+        yield group
+
+
+def summarize_changes(
+    llm: ai.LLM,
+    file_diffs: Iterable[prompt.FileDiff],
+    token_budget: int = prompt.DEFAULT_TOKEN_BUDGET,
+    concurrency: int = MAP_CONCURRENCY,
+) -> str:
+    """
+    Summarize a changeset group by group, for use in place of its diffs.
+
+    Files are consumed as they arrive: each group is rendered into its prompt as soon as it's
+    full and its files are let go of, so at most `concurrency` group prompts are held at once
+    however large the changeset is.
+
+    Args:
+        llm: The model to summarize with
+        file_diffs: Every changed file, e.g. streamed as each one is read
+        token_budget: Token budget of each group's prompt
+        concurrency: Number of groups summarized at once
+
+    Returns:
+        The summary of every group, labeled with the files it covers
+    """
+    descriptions: list[str] = []
+    num_files = 0
+
+    def group_prompts() -> Iterator[str]:
+        nonlocal num_files
+        for group in iter_groups(file_diffs, token_budget):
+            num_files += len(group)
+            descriptions.append(_describe_group(group))
+            yield prompt.build_prompt(group, token_budget)[0]
+
+    summaries = summarize_prompts(llm, group_prompts(), concurrency, "group(s) of changed files")
+
+    sections = [
+        f"Summary of changes to {description}:\n{summary}\n" for description, summary in zip(descriptions, summaries)
+    ]
+    return (
+        f"This changeset is too large to show in full ({num_files:,} files), "
+        f"so it was summarized in {len(descriptions):,} groups of files.\n\n" + prompt.FILE_SEPARATOR.join(sections)
+    )
+
+
+def summarize_prompts(
+    llm: ai.LLM,
+    prompts: Iterable[str],
+    concurrency: int = MAP_CONCURRENCY,
+    description: str = "part(s)",
+    system_prompt_name: str = SUMMARY_PROMPT,
+) -> list[str]:
+    """
+    Summarize each prompt with a summarizing system prompt, `concurrency` requests at a time.
+
+    Prompts are only taken from `prompts` once a request slot is free, so a generator that builds
+    them lazily never has more than `concurrency` of them alive.
+
+    Args:
+        llm: The model to summarize with
+        prompts: One prompt per part of the change
+        concurrency: Number of requests in flight at once
+        description: What the prompts describe, for progress messages
+        system_prompt_name: Which bundled system prompt to summarize with, e.g. `COMMIT_SUMMARY_PROMPT`
+
+    Returns:
+        One summary per prompt, in the same order
+    """
+    if isinstance(prompts, Sized) and not prompts:
+        return []
+    return llm.run(_summarize_prompts(llm, prompts, concurrency, description, system_prompt_name))
+
+
+async def _summarize_prompts(
+    llm: ai.LLM, prompts: Iterable[str], concurrency: int, description: str, system_prompt_name: str
+) -> list[str]:
+    console = rich.console.Console()
+    system_prompt = ai.load_system_prompt(system_prompt_name)
+    semaphore = asyncio.Semaphore(concurrency)
+    total = f"{len(prompts):,}" if isinstance(prompts, Sized) else "?"
+    parts = iter(prompts)
+    tasks: list[asyncio.Task[str]] = []
+    done = 0
+
+    async def summarize(part: str) -> str:
+        nonlocal done
+        try:
+            summary = await llm.query_model([part], system_prompt=system_prompt)
+        finally:
+            semaphore.release()
+        done += 1
+        status.update(f"Summarizing {description}... ({done:,}/{total})")
+        return summary
+
+    with console.status(f"Summarizing {description}... (0/{total})") as status:
+        try:
+            while True:
+                await semaphore.acquire()
+                # building the next prompt may mean reading files, which shouldn't hold up requests in flight
+                part = await asyncio.to_thread(next, parts, None)
+                if part is None:
+                    semaphore.release()
+                    break
+                tasks.append(asyncio.create_task(summarize(part)))
+            summaries = await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    console.print(
+        rich.padding.Padding(rich.text.Text(f"Summarized {len(tasks):,} {description}", style="dim"), (0, 0, 0, 2))
+    )
+    return summaries
+
+
+def _describe_group(group: list[prompt.FileDiff]) -> str:
+    additions = sum(file_diff.additions for file_diff in group)
+    deletions = sum(file_diff.deletions for file_diff in group)
+    paths = ", ".join(f"./{file_diff.path}" for file_diff in group)
+    return f"{paths} (+{additions} -{deletions} lines)"
@@ -0,0 +1,228 @@
+"""
+A cheap planning pass over the changeset, run before any patch is built.
+
+`git diff --numstat` reports the added and removed line counts of every changed file without
+generating patches or reading blobs. From those counts we estimate how big the prompt would
+get and pick a strategy up front, so only the data that strategy needs is ever materialized:
+
+- "full": every diff plus the whole changed files
+- "scoped": every diff plus the functions and classes around each change
+- "summarized": diffs only, and files that can't fit are summarized from their line counts
+  without their patch or contents ever being read
+- "map-reduce": the changeset is too big for one prompt; the model summarizes files in groups
+  first, and the message is written from those summaries (see `mapreduce`)
+"""
+
+import dataclasses
+import pathlib
+import subprocess
+
+import rich
+import rich.console
+import rich.padding
+import rich.text
+
+from . import context, prompt
+
+FULL = "full"
+SCOPED = "scoped"
+SUMMARIZED = "summarized"
+MAP_REDUCE = "map-reduce"
+
+# a changed line, with its share of hunk headers and surrounding context lines
+TOKENS_PER_CHANGED_LINE = 12
+# file headings and separators
+TOKENS_PER_FILE = 30
+# whole files are typically several times bigger than their diffs, scoped context about as big
+FULL_CONTEXT_MULTIPLIER = 4
+SCOPED_CONTEXT_MULTIPLIER = 2
+# changesets more than this many times the token budget are summarized in a map-reduce pass, if one is available
+MAP_REDUCE_THRESHOLD = 3
+# with at least this much budget left, a file too big to fit is still read and cut down hunk by hunk
+MIN_PARTIAL_TOKENS = 500
+
+
+@dataclasses.dataclass
+class FileStat:
+    """
+    Changed line counts for a single file, from `git diff --numstat`.
+
+    Args:
+        path: Path of the file after the change
+        old_path: Path before the change, for renamed and copied files
+        additions: Number of added lines, 0 for binary files
+        deletions: Number of removed lines, 0 for binary files
+        binary: Whether git considers the file binary
+        summary_only: Whether the file only ever gets a one-line summary, e.g. a lockfile or a
+            path matched by the `summarize` rules, however many lines changed
+    """
+
+    path: str
+    old_path: str | None = None
+    additions: int = 0
+    deletions: int = 0
+    binary: bool = False
+    summary_only: bool = False
+
+    @property
+    def lines_changed(self) -> int:
+        return self.additions + self.deletions
+
+    @property
+    def estimated_tokens(self) -> int:
+        if self.summary_only:
+            return TOKENS_PER_FILE
+        return TOKENS_PER_FILE + self.lines_changed * TOKENS_PER_CHANGED_LINE
+
+
+@dataclasses.dataclass
+class DiffPlan:
+    """
+    How the prompt for a changeset will be built.
+
+    Args:
+        strategy: One of `FULL`, `SCOPED`, `SUMMARIZED` or `MAP_REDUCE`
+        context_mode: The `context` mode the strategy builds file diffs with
+        token_budget: The token budget the plan was made for
+        files: Number of changed files
+        additions: Total added lines
+        deletions: Total removed lines
+        estimated_tokens: Estimated size of every diff in the changeset, without file contents
+        summarize_paths: Files that will only get a one-line summary, and whose data is never read
+    """
+
+    strategy: str
+    context_mode: str
+    token_budget: int
+    files: int = 0
+    additions: int = 0
+    deletions: int = 0
+    estimated_tokens: int = 0
+    summarize_paths: set[str] = dataclasses.field(default_factory=set)
+
+
+def measure(project_root: pathlib.Path, *diff_args: str) -> list[FileStat]:
+    """
+    Count changed lines per file with a single `git diff --numstat` call.
+
+    Args:
+        project_root: Root of the git repository to run in
+        diff_args: Extra arguments for `git diff`, e.g. "--cached" or two revisions
+
+    Raises:
+        SystemError: If git exits with a non-zero status
+    """
+    process = subprocess.run(
+        ["git", "-c", "core.quotePath=false", "diff", *diff_args, "--numstat", "-z", "-M", "-C", "--no-color"],
+        cwd=project_root,
+        capture_output=True,
+        check=False,
+    )
+    if process.returncode != 0:
+        raise SystemError(process.stderr.decode("utf-8", errors="replace").strip())
+    return parse_numstat(process.stdout)
+
+
+def parse_numstat(output: bytes) -> list[FileStat]:
+    """
+    Parse `git diff --numstat -z` output.
+
+    Each entry is "<added>\\t<removed>\\t<path>\\0", or "<added>\\t<removed>\\t\\0<old path>\\0<new path>\\0"
+    for renames and copies. Binary files have "-" for both counts.
+    """
+    tokens = output.split(b"\0")
+    stats = []
+    i = 0
+    while i < len(tokens) and tokens[i]:
+        added, removed, path = tokens[i].split(b"\t", 2)
+        old_path = None
+        if not path:
+            old_path = tokens[i + 1].decode("utf-8", errors="surrogateescape")
+            path = tokens[i + 2]
+            i += 2
+        i += 1
+        binary = added == b"-"
+        stats.append(
+            FileStat(
+                path=path.decode("utf-8", errors="surrogateescape"),
+                old_path=old_path,
+                additions=0 if binary else int(added),
+                deletions=0 if binary else int(removed),
+                binary=binary,
+            )
+        )
+    return stats
+
+
+def choose_plan(
+    stats: list[FileStat], token_budget: int = prompt.DEFAULT_TOKEN_BUDGET, map_reduce: bool = False
+) -> DiffPlan:
+    """
+    Pick the cheapest strategy that still shows as much of the changeset as the budget allows.
+
+    Args:
+        stats: Changed line counts of every file that goes into the prompt
+        token_budget: Total number of tokens the prompt may use
+        map_reduce: Whether the caller can summarize files with the model first; if not, huge
+            changesets are summarized from their line counts instead
+    """
+    estimated = sum(stat.estimated_tokens for stat in stats)
+    plan = DiffPlan(
+        strategy=FULL,
+        context_mode=context.FULL,
+        token_budget=token_budget,
+        files=len(stats),
+        additions=sum(stat.additions for stat in stats),
+        deletions=sum(stat.deletions for stat in stats),
+        estimated_tokens=estimated,
+    )
+
+    if estimated * FULL_CONTEXT_MULTIPLIER <= token_budget:
+        return plan
+    if estimated * SCOPED_CONTEXT_MULTIPLIER <= token_budget:
+        plan.strategy, plan.context_mode = SCOPED, context.SCOPED
+        return plan
+
+    plan.context_mode = context.DIFF_ONLY
+    if map_reduce and estimated > token_budget * MAP_REDUCE_THRESHOLD:
+        # every diff is read, and the model sees all of them across the map requests
+        plan.strategy = MAP_REDUCE
+        return plan
+    plan.strategy = SUMMARIZED
+
+    # files are fitted smallest first, so one huge file can't crowd out every other diff. The first
+    # that doesn't fit gets what's left over, and the rest never get read at all
+    remaining = token_budget
+    for stat in sorted(stats, key=lambda s: s.estimated_tokens):
+        if stat.summary_only or stat.estimated_tokens <= remaining:
+            remaining -= stat.estimated_tokens
+        elif remaining >= MIN_PARTIAL_TOKENS:
+            remaining = 0
+        else:
+            plan.summarize_paths.add(stat.path)
+    return plan
+
+
+def print_plan(plan: DiffPlan):
+    console = rich.console.Console()
+    console.print(
+        rich.text.Text(
+            f"Plan: {plan.strategy} ({plan.files:,} file(s), +{plan.additions:,} -{plan.deletions:,} lines, "
+            f"~{plan.estimated_tokens:,} diff tokens for a {plan.token_budget:,} token budget)",
+            style="dim",
+        )
+    )
+    if plan.strategy == MAP_REDUCE:
+        console.print(
+            rich.padding.Padding(
+                rich.text.Text("Files are summarized by the model in groups before writing the message", style="dim"),
+                (0, 0, 0, 2),
+            )
+        )
+    if plan.summarize_paths:
+        console.print(
+            rich.padding.Padding(
+                rich.text.Text(f"{len(plan.summarize_paths):,} file(s) summarized from line counts only", style="dim"),
+                (0, 0, 0, 2),
+            )
+        )
@@ -0,0 +1,304 @@
+"""
+Prompt assembly for staged and branch diffs.
+
+Every changed file is described by a `FileDiff` record. `build_prompt` renders those records
+into a single prompt that always fits inside a total token budget, spending the budget on the
+most heavily changed files first.
+"""
+
+import dataclasses
+from collections.abc import Iterable
+
+from . import hunks
+
+# roughly 4 chars per token
+CHARS_PER_TOKEN = 4
+# total budget for the diff portion of the prompt, shared across every file
+DEFAULT_TOKEN_BUDGET = 60_000
+
+FILE_SEPARATOR = "============\n"
+# diffs aren't cut down any smaller than this, below it the summary says just as much
+MIN_REDUCED_DIFF_SIZE = 400
+# contents are left out once the diff already shows this much of the new file
+DIFF_COVERAGE_RATIO = 0.8
+# removed files only show this many of their old lines
+REMOVED_PREVIEW_LINES = 20
+
+FILE_REMOVED = "<FILE REMOVED>"
+FILE_TOO_LARGE = "<FILE TOO LARGE TO SHOW>"
+
+
+@dataclasses.dataclass
+class FileDiff:
+    """
+    A single changed file, as fed to the prompt builder.
+
+    Args:
+        path: Path of the file relative to the repository root
+        change_type: One of "added", "modified", "removed", "renamed" or "copied"
+        diff: The patch text for this file, or None if no diff should be shown
+        contents: The current contents of the file, or None if they should not be shown
+        additions: Number of added lines in the full (untruncated) diff
+        deletions: Number of removed lines in the full (untruncated) diff
+        summary: A one-line description shown instead of the contents and diff, e.g. for lockfiles
+        scoped: Whether `contents` only holds the code enclosing each change rather than the whole file
+        old_path: For renamed and copied files, the path the file was renamed or copied from
+        similarity: For renamed and copied files, how similar the old and new versions are, in percent
+    """
+
+    path: str
+    change_type: str = "modified"
+    diff: str | None = None
+    contents: str | None = None
+    additions: int = 0
+    deletions: int = 0
+    summary: str | None = None
+    scoped: bool = False
+    old_path: str | None = None
+    similarity: int | None = None
+
+    @property
+    def lines_changed(self) -> int:
+        return self.additions + self.deletions
+
+
+@dataclasses.dataclass
+class BudgetReport:
+    """
+    What `build_prompt` did with each file to make the prompt fit.
+
+    Args:
+        token_budget: The total token budget the prompt had to fit in
+        tokens_used: The estimated number of tokens in the rendered prompt
+        full: Files shown with both their contents and their diff
+        diff_only: Files whose contents were left out, but whose diff was shown
+        reduced: Files whose diff was cut down hunk by hunk to fit
+        summarized: Files reduced to a one-line summary of their changed line counts
+        dropped: Files left out of the prompt entirely
+    """
+
+    token_budget: int
+    tokens_used: int = 0
+    full: list[str] = dataclasses.field(default_factory=list)
+    diff_only: list[str] = dataclasses.field(default_factory=list)
+    reduced: list[str] = dataclasses.field(default_factory=list)
+    summarized: list[str] = dataclasses.field(default_factory=list)
+    dropped: list[str] = dataclasses.field(default_factory=list)
+
+    @property
+    def truncated(self) -> bool:
+        return bool(self.reduced or self.summarized or self.dropped)
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _piece_cost(text: str) -> int:
+    # one extra token covers the newline each rendered file is joined with
+    return estimate_tokens(text) + 1
+
+
+def count_changed_lines(diff_text: str) -> tuple[int, int]:
+    """
+    Count added and removed lines in a unified diff.
+
+    Only lines inside hunks are counted, so the `--- a/...` and `+++ b/...` file headers are
+    skipped while a removed `-- comment` or an added `++ x` line inside a hunk still counts.
+
+    Returns:
+        A tuple of (additions, deletions)
+    """
+    additions = 0
+    deletions = 0
+    in_hunks = False
+    for line in diff_text.splitlines():
+        if line.startswith("diff "):
+            # the headers of the next file in a multi-file diff
+            in_hunks = False
+        elif hunks.HUNK_HEADER.match(line):
+            in_hunks = True
+        elif not in_hunks:
+            continue
+        elif line.startswith("+"):
+            additions += 1
+        elif line.startswith("-"):
+            deletions += 1
+    return additions, deletions
+
+
+def _heading(file_diff: FileDiff) -> str:
+    if file_diff.change_type == "added":
+        return f"Newly added File: ./{file_diff.path}"
+    if file_diff.change_type == "removed":
+        return f"Removed File: ./{file_diff.path}"
+    if file_diff.change_type in ("renamed", "copied") and file_diff.old_path is not None:
+        heading = f"{file_diff.change_type.capitalize()} File: ./{file_diff.old_path} -> ./{file_diff.path}"
+        if file_diff.similarity is not None:
+            heading += f" ({file_diff.similarity}% similar)"
+        return heading
+    return f"Modified File: ./{file_diff.path}"
+
+
+def render_file(file_diff: FileDiff, include_contents: bool = True, include_diff: bool = True) -> str:
+    sections = [FILE_SEPARATOR, f"{_heading(file_diff)}\n"]
+    if file_diff.summary is not None:
+        sections.append(f"----- Summary -----\n{file_diff.summary}\n")
+    if include_contents and file_diff.contents is not None:
+        label = "Enclosing Code" if file_diff.scoped else "Contents"
+        sections.append(f"----- {label} -----\n{file_diff.contents}\n\n")
+    if include_diff and file_diff.diff is not None:
+        sections.append(f"----- Diff from HEAD -----\n{file_diff.diff}")
+    sections.append(FILE_SEPARATOR)
+    return "".join(sections)
+
+
+def render_summary(file_diff: FileDiff) -> str:
+    # files with nothing but a heading (pure renames) or a summary are already as small as they get
+    if file_diff.summary is not None or (file_diff.diff is None and file_diff.contents is None):
+        return render_file(file_diff)
+    return (
+        FILE_SEPARATOR + f"{_heading(file_diff)}\n"
+        "----- Summary -----\n"
+        f"{file_diff.change_type}, +{file_diff.additions} -{file_diff.deletions} lines "
+        "(left out to fit the prompt budget)\n" + FILE_SEPARATOR
+    )
+
+
+def deduplicate(file_diff: FileDiff) -> FileDiff:
+    """
+    Make sure no file's text is sent twice.
+
+    - An added file's diff is its contents with a `+` on every line, so only the contents are kept.
+    - When the diff already shows most of the new file (e.g. a rewrite), the contents are dropped.
+    - A removed file keeps only the first `REMOVED_PREVIEW_LINES` of its old lines, instead of a
+      `<FILE REMOVED>` marker followed by the whole file as a minus-diff.
+    """
+    if file_diff.diff is None or file_diff.summary is not None:
+        return file_diff
+
+    if file_diff.change_type == "removed":
+        return dataclasses.replace(file_diff, contents=None, diff=_removed_preview(file_diff))
+
+    if file_diff.contents in (None, FILE_REMOVED, FILE_TOO_LARGE):
+        return file_diff
+
+    num_lines = len(file_diff.contents.splitlines())
+    if file_diff.change_type == "added" and file_diff.deletions == 0 and file_diff.additions == num_lines:
+        return dataclasses.replace(file_diff, diff=None)
+    if _new_side_lines(file_diff.diff) >= DIFF_COVERAGE_RATIO * num_lines:
+        return dataclasses.replace(file_diff, contents=None, scoped=False)
+    return file_diff
+
+
+def _new_side_lines(diff_text: str) -> int:
+    # context and added lines are the parts of the new file a diff already shows
+    _, file_hunks = hunks.parse_hunks(diff_text)
+    return sum(1 for hunk in file_hunks for line in hunk.lines if not line.startswith(("-", "\\")))
+
+
+def _removed_preview(file_diff: FileDiff) -> str:
+    preamble, file_hunks = hunks.parse_hunks(file_diff.diff)
+    removed = [line for hunk in file_hunks for line in hunk.lines if line.startswith("-")]
+    if len(removed) <= REMOVED_PREVIEW_LINES:
+        return file_diff.diff
+    header = file_hunks[0].header if file_hunks else ""
+    omitted = file_diff.deletions - REMOVED_PREVIEW_LINES
+    return preamble + header + "".join(removed[:REMOVED_PREVIEW_LINES]) + f"... {omitted} more lines removed ...\n"
+
+
+def build_prompt(file_diffs: Iterable[FileDiff], token_budget: int = DEFAULT_TOKEN_BUDGET) -> tuple[str, BudgetReport]:
+    """
+    Render changed files into a single prompt that fits inside `token_budget`.
+
+    Files are ranked by how many lines they changed. Every file first gets a one-line summary,
+    then the budget is spent in rank order on full diffs. Diffs that don't fit whole are cut
+    down hunk by hunk into the space that is left, and whatever remains after that goes to the
+    file contents surrounding the diffs. If even the summaries do not fit, the least changed files
+    are dropped. Files are rendered in their original order regardless of rank, and each file
+    goes through `deduplicate` as it arrives so none of its text is paid for, or held, twice.
+
+    Args:
+        file_diffs: The changed files, in the order they should appear in the prompt; may be a
+            generator, which is consumed once
+        token_budget: Total number of tokens the rendered prompt may use
+
+    Returns:
+        The rendered prompt and a report of what was summarized or dropped
+    """
+    report = BudgetReport(token_budget=token_budget)
+    file_diffs = [deduplicate(file_diff) for file_diff in file_diffs]
+
+    ranked = sorted(range(len(file_diffs)), key=lambda i: (-file_diffs[i].lines_changed, i))
+
+    # every file starts out as a summary; the least changed are dropped if even that is too much
+    renders: dict[int, str] = {}
+    remaining = token_budget
+    for i in ranked:
+        summary = render_summary(file_diffs[i])
+        cost = _piece_cost(summary)
+        if cost <= remaining:
+            renders[i] = summary
+            remaining -= cost
+
+    # files that are only ever summarized (lockfiles, binaries, ...) are already shown in full
+    levels: dict[int, str] = {
+        i: "full" if file_diffs[i].diff is None and file_diffs[i].contents is None else "summarized" for i in renders
+    }
+
+    # then upgrade to the full diff, most changed files first
+    for i in ranked:
+        if i not in renders or file_diffs[i].diff is None:
+            continue
+        upgraded = render_file(file_diffs[i], include_contents=False)
+        extra = _piece_cost(upgraded) - _piece_cost(renders[i])
+        if extra <= remaining:
+            renders[i] = upgraded
+            levels[i] = "diff_only"
+            remaining -= extra
+
+    # diffs too big to show whole get whatever space is left, keeping their largest hunks
+    for i in ranked:
+        if i not in renders or levels[i] != "summarized" or file_diffs[i].diff is None:
+            continue
+        available = remaining + _piece_cost(renders[i])
+        overhead = _piece_cost(render_file(dataclasses.replace(file_diffs[i], diff=""), include_contents=False))
+        max_size = (available - overhead) * CHARS_PER_TOKEN
+        if max_size < MIN_REDUCED_DIFF_SIZE:
+            continue
+        reduced = dataclasses.replace(file_diffs[i], diff=hunks.reduce_diff(file_diffs[i].diff, max_size))
+        upgraded = render_file(reduced, include_contents=False)
+        extra = _piece_cost(upgraded) - _piece_cost(renders[i])
+        if extra <= remaining:
+            renders[i] = upgraded
+            levels[i] = "reduced"
+            remaining -= extra
+
+    # and finally add the file contents around each diff
+    for i in ranked:
+        if i not in renders or file_diffs[i].contents is None:
+            continue
+        if levels[i] in ("summarized", "reduced") and file_diffs[i].diff is not None:
+            continue
+        upgraded = render_file(file_diffs[i])
+        extra = _piece_cost(upgraded) - _piece_cost(renders[i])
+        if extra <= remaining:
+            renders[i] = upgraded
+            levels[i] = "full"
+            remaining -= extra
+
+    for i, file_diff in enumerate(file_diffs):
+        if i not in renders:
+            report.dropped.append(file_diff.path)
+        elif levels[i] == "full":
+            report.full.append(file_diff.path)
+        elif levels[i] == "diff_only":
+            report.diff_only.append(file_diff.path)
+        elif levels[i] == "reduced":
+            report.reduced.append(file_diff.path)
+        else:
+            report.summarized.append(file_diff.path)
+
+    rendered = "\n".join(renders[i] for i in sorted(renders))
+    report.tokens_used = estimate_tokens(rendered)
+    return rendered, report
@@ -1,14 +1,27 @@
 import sys  # noqa
+import dataclasses
+import functools
 import pathlib
 import re
+from collections.abc import Callable, Collection, Iterable, Iterator
 
 import git
 import rich
 import rich.console
 import rich.padding
 import rich.text
-import beaupy
 
+from . import ai
+from . import blobs
+from . import cache
+from . import classify
+from . import context
+from . import diffstream
+from . import hunks
+from . import ignore
+from . import mapreduce
+from . import plan
+from . import prompt
 from . import utils
 
 
@@ -17,6 +30,13 @@ from . import utils
 # this means that we'll need to set this to ~20k per "item"
 # where item means here both file_contents and the diff result which are checked separately
 MAX_DIFF_ITEM_SIZE = 40_000
+# workers used to read and decode changed files while assembling the prompt; 1 assembles them one
+# after another, which neither a thread nor a process pool beat in benchmarks/bench_diff_assembly.py
+DIFF_ASSEMBLY_WORKERS = 1
+# patch bytes read ahead of the prompt builder, so memory follows the largest patches rather than the changeset
+MAX_PATCH_BYTES_IN_FLIGHT = 2 * diffstream.MAX_PATCH_SIZE
+# token budget for the diff of a single commit when summarizing a branch commit by commit
+COMMIT_TOKEN_BUDGET = 15_000
 GITHUB_REMOTE_PATTERN = re.compile(
     r"^(?:\w+://)?(?:[\w\d-]+@)?([\w\.]+)(:\d*)?(.+?)(?:\.git)?/?$",
     flags=re.IGNORECASE,
@@ -59,106 +79,606 @@ def get_repo_url(repo: git.Repo) -> str | None:
         return None
 
 
-def generate_diffs_with_context(current_repo: git.Repo) -> str:
+def generate_diffs_with_context(
+    current_repo: git.Repo,
+    token_budget: int = prompt.DEFAULT_TOKEN_BUDGET,
+    context_mode: str = context.AUTO,
+    verbose: bool = False,
+    llm: ai.LLM | None = None,
+    workers: int = DIFF_ASSEMBLY_WORKERS,
+    processes: bool = False,
+) -> str:
+    """
+    Describe the staged changes for the prompt, within `token_budget`.
+
+    Args:
+        current_repo: The repository to describe
+        token_budget: Total number of tokens the description may use
+        context_mode: A `context` mode, or `context.AUTO` to pick one from the size of the change
+        verbose: Print the plan for the prompt
+        llm: If given, changesets too large for one prompt are summarized with it group by group
+            (see `mapreduce`) rather than cut down to line counts
+        workers: Threads or processes used to read and decode changed files, in git's order either way
+        processes: Use worker processes rather than threads, so that context extraction, which
+            holds the GIL, can run on more than one core
+
+    Returns:
+        The rendered diffs, or the summaries standing in for them
+    """
     console = rich.console.Console()
 
     console.print("Generating diffs for staged files...", style="bold")
 
     project_root = pathlib.Path(current_repo.working_dir)
 
-    diffs: git.diff.DiffIndex[git.diff.Diff]
+    if not current_repo.head.is_valid():
+        return generate_diffs_with_fresh_repo(project_root, token_budget=token_budget)
+
+    diff_plan = make_plan(project_root, ["--cached"], token_budget, context_mode, verbose, map_reduce=llm is not None)
+    return _generate_streamed_diffs(
+        project_root,
+        ["--cached"],
+        # passing find_renames stops GitPython appending its own -M, which would switch copy detection back off
+        lambda: current_repo.head.commit.diff(
+            git.IndexFile.Index, create_patch=True, find_renames=True, find_copies=True
+        ),
+        token_budget=token_budget,
+        context_mode=diff_plan.context_mode,
+        summarize_paths=diff_plan.summarize_paths,
+        summarize_with=llm if diff_plan.strategy == plan.MAP_REDUCE else None,
+        workers=workers,
+        processes=processes,
+    )
+
+
+def _generate_streamed_diffs(
+    project_root: pathlib.Path,
+    diff_args: list[str],
+    fallback_diffs: Callable[[], git.DiffIndex],
+    **kwargs,
+) -> str:
+    """
+    Stream `git diff <diff_args>` into `generate_diffs_with_valid_prior_commit`, one file at a time.
+
+    Only one file's patch is held at a time, and at most `diffstream.MAX_PATCH_SIZE` of it.
+    If the git CLI can't be streamed from, GitPython's diffs from `fallback_diffs` are used instead.
+    """
     try:
-        diffs = current_repo.head.commit.diff(git.IndexFile.Index, create_patch=True)
-        diff_overview = generate_diffs_with_valid_prior_commit(project_root, diffs)
-    except ValueError:
-        diff_overview = generate_diffs_with_fresh_repo(project_root)
+        diffs = diffstream.iter_diffs(project_root, *diff_args)
+        return generate_diffs_with_valid_prior_commit(project_root, diffs, **kwargs)
+    except (OSError, SystemError, ValueError) as e:
+        console = rich.console.Console()
+        console.print(rich.text.Text(f"Streaming git diff failed ({e}), falling back to GitPython", style="yellow"))
+        return generate_diffs_with_valid_prior_commit(project_root, fallback_diffs(), **kwargs)
+
+
+def make_plan(
+    project_root: pathlib.Path,
+    diff_args: list[str],
+    token_budget: int = prompt.DEFAULT_TOKEN_BUDGET,
+    context_mode: str = context.AUTO,
+    verbose: bool = False,
+    map_reduce: bool = False,
+) -> plan.DiffPlan:
+    """
+    Measure the changeset with `git diff --numstat` and decide how to build its prompt.
 
-    return diff_overview
+    Args:
+        project_root: Root of the git repository
+        diff_args: What to diff, e.g. ["--cached"] or [base, "HEAD"]
+        token_budget: Total number of tokens the prompt may use
+        context_mode: A `context` mode to use regardless of the plan, or `context.AUTO`
+        verbose: Print the chosen plan
+        map_reduce: Whether huge changesets can be summarized by the model (see `plan.choose_plan`)
 
+    Returns:
+        The plan; if the changeset can't be measured, a plan that shows every diff with scoped context
+    """
+    try:
+        stats = plan.measure(project_root, *diff_args)
+    except (OSError, SystemError):
+        diff_plan = plan.DiffPlan(strategy=plan.SCOPED, context_mode=context.SCOPED, token_budget=token_budget)
+    else:
+        # the same rules that apply when the prompt is built, so ignored files, lockfiles and generated
+        # code don't take up budget that they'll never use
+        dropped_rules, summarized_rules = ignore.load_rules(project_root)
+        stats = [stat for stat in stats if not dropped_rules.matches(stat.path)]
+        for stat in stats:
+            stat.summary_only = summarized_rules.matches(stat.path) or classify.classify_path(stat.path) is not None
+        diff_plan = plan.choose_plan(stats, token_budget, map_reduce)
+
+    if context_mode != context.AUTO:
+        diff_plan.context_mode = context_mode
+    if verbose:
+        plan.print_plan(diff_plan)
+    return diff_plan
+
+
+def generate_diffs_with_valid_prior_commit(
+    project_root: pathlib.Path,
+    diffs: Iterable[git.diff.Diff | diffstream.PatchRecord],
+    token_budget: int = prompt.DEFAULT_TOKEN_BUDGET,
+    context_mode: str = context.DEFAULT_CONTEXT_MODE,
+    summarize_paths: Collection[str] = (),
+    summarize_with: ai.LLM | None = None,
+    workers: int = DIFF_ASSEMBLY_WORKERS,
+    processes: bool = False,
+) -> str:
+    """
+    Read and render every changed file in `diffs` into a prompt that fits `token_budget`.
+
+    Args:
+        project_root: Root of the git repository
+        diffs: The changed files, streamed or from GitPython
+        token_budget: Total number of tokens the prompt may use
+        context_mode: How much of each changed file to show, see `context`
+        summarize_paths: Files to summarize from their line counts without reading them
+        summarize_with: A model to summarize the files with group by group, in place of their
+            diffs, when they can't all fit in one prompt
+        workers: Threads or processes used to read and decode changed files, in git's order either way
+        processes: Use worker processes rather than threads, so that context extraction, which
+            holds the GIL, can run on more than one core
 
-def generate_diffs_with_valid_prior_commit(project_root: pathlib.Path, diffs: git.DiffIndex[git.diff.Diff]) -> str:
+    Returns:
+        The rendered diffs, or the summaries standing in for them
+    """
     console = rich.console.Console()
+    dropped_rules, summarized_rules = ignore.load_rules(project_root)
+    num_ignored = 0
+    num_planned_summaries = 0
+
+    def jobs():
+        nonlocal num_ignored, num_planned_summaries
+        batch = []
+        batch_size = 0
+        for diff_item in diffs:
+            file_was_removed = diff_item.b_path is None
+            path = _diff_path(diff_item, file_was_removed)
+            diff_file = project_root / path
+
+            # ignore rules only look at the path, so this happens before any file I/O
+            skip_file = dropped_rules.matches(path)
+
+            if skip_file:
+                num_ignored += 1
+                continue
+
+            job = _FileJob(diff_item, diff_file, file_was_removed)
+            if summarized_rules.matches(path):
+                job.summary_reason = "summarized by config"
+            elif path in summarize_paths:
+                job.summary_reason = "summarized to fit the prompt budget"
+                num_planned_summaries += 1
+            batch.append(job)
+            batch_size += _patch_size(job)
+            if len(batch) >= blobs.BATCH_SIZE or batch_size >= MAX_PATCH_BYTES_IN_FLIGHT:
+                yield from _with_blob_contents(reader, batch)
+                batch = []
+                batch_size = 0
+        yield from _with_blob_contents(reader, batch)
+
+    def file_diffs() -> Iterator[prompt.FileDiff]:
+        assembled = utils.ordered_map(
+            functools.partial(_assemble, project_root, context_mode),
+            jobs(),
+            workers=workers,
+            weight=_patch_size,
+            max_weight=MAX_PATCH_BYTES_IN_FLIGHT,
+            processes=processes,
+        )
+        for diff_file, file_diff, error in assembled:
+            # printed for every file, so this skips the layout work of `print`, which costs more than
+            # assembling the file does for diff-only context
+            console.out(f"  Analyzing file: {diff_file}", style="dim", highlight=False)
+            if error is not None:
+                console.print(rich.text.Text(f"Error reading {diff_file}: {error}", style="bold red"))
+                continue
+            yield file_diff
+
+    # records go straight to the prompt builder or the map step as they're read, rather than
+    # being collected for the whole changeset first
+    with blobs.BlobReader(project_root) as reader:
+        if summarize_with is not None:
+            diff_overview = mapreduce.summarize_changes(summarize_with, file_diffs(), token_budget)
+        else:
+            diff_overview, report = prompt.build_prompt(file_diffs(), token_budget)
 
-    diff_items = []
-    for diff_item in diffs:
-        file_was_removed = False
-        try:
-            diff_file = project_root / diff_item.b_path.strip()
-        except AttributeError:
-            # then the file doesn't exist, and we need to look at the one from the a_path
-            file_was_removed = True
-            diff_file = project_root / diff_item.a_path.strip()
+    print_ignored_files(num_ignored)
+    if summarize_with is None:
+        print_budget_report(report, num_planned_summaries)
 
-        skip_file = False
+    return diff_overview
 
-        if skip_file:
-            continue
 
-        console.print(rich.padding.Padding(rich.text.Text(f"Analyzing file: {diff_file}", style="dim"), (0, 0, 0, 2)))
-        try:
-            if file_was_removed:
-                file_contents = "<FILE REMOVED>"
-            else:
-                file_contents = diff_file.read_text()
-
-            if len(file_contents) >= MAX_DIFF_ITEM_SIZE:
-                file_contents = "<FILE TOO LARGE TO SHOW>"
-
-            # decode and strip out line counts
-            file_diff_text = diff_item.diff.decode("utf-8")
-            if len(file_diff_text) >= MAX_DIFF_ITEM_SIZE:
-                file_diff_text = "<DIFF TOO LARGE TO SHOW>"
-
-            diff_items.append(
-                "============\n"
-                f"Modified File: ./{diff_file.relative_to(project_root)}\n"
-                "----- Contents -----\n"
-                f"{file_contents}\n\n"
-                "----- Diff from HEAD -----\n"
-                f"{file_diff_text}"
-                "============\n"
-            )
-        except Exception as e:
-            console.print(rich.text.Text(f"Error reading {diff_file}: {e}", style="bold red"))
-            continue
+@dataclasses.dataclass
+class _FileJob:
+    diff_item: git.diff.Diff | diffstream.PatchRecord | None
+    diff_file: pathlib.Path
+    file_was_removed: bool
+    # set for files that only get a one-line summary, and whose contents are never read
+    summary_reason: str | None = None
+    old_size: int | None = None
+    new_size: int | None = None
+    new_contents: bytes | None = None
+    # the start of the new version, for files too large to read whole
+    new_head: bytes | None = None
 
-    diff_overview = "\n".join(diff_items)
 
-    return diff_overview
+def _assemble(
+    project_root: pathlib.Path, context_mode: str, job: _FileJob
+) -> tuple[pathlib.Path, prompt.FileDiff | None, Exception | None]:
+    try:
+        return job.diff_file, _assemble_file_diff(project_root, job, context_mode), None
+    except Exception as e:
+        return job.diff_file, None, e
+
+
+def _patch_size(job: _FileJob) -> int:
+    return len(job.diff_item.diff) if job.diff_item is not None else 0
 
 
-def generate_diffs_with_fresh_repo(project_root: pathlib.Path) -> str:
-    stdout, stderr = utils.run_cmd("git diff --name-only --cached", show_output=False)
-    diff_items = []
-    for staged_file_raw in stdout.splitlines():
+def _with_blob_contents(reader: blobs.BlobReader, batch: list[_FileJob]) -> Iterator[_FileJob]:
+    """
+    Pull blob sizes, and the new version of every file in `batch`, through the blob reader in one go.
+
+    Sizes are looked up first, and blobs too large to show are never read.
+    """
+    batch_to_read = [job for job in batch if job.summary_reason is None]
+    old_lookups = [(job, name) for job in batch_to_read if (name := _old_object_name(job.diff_item)) is not None]
+    new_lookups = [
+        (job, name)
+        for job in batch_to_read
+        if not job.file_was_removed and (name := _new_object_name(job.diff_item)) is not None
+    ]
+
+    sizes = reader.sizes(name for _, name in old_lookups + new_lookups)
+    for (job, _), size in zip(old_lookups, sizes[: len(old_lookups)]):
+        job.old_size = size
+    for (job, _), size in zip(new_lookups, sizes[len(old_lookups) :]):
+        job.new_size = size
+
+    readable = [
+        (job, name) for job, name in new_lookups if job.new_size is not None and job.new_size < MAX_DIFF_ITEM_SIZE
+    ]
+    for (job, _), contents in zip(readable, reader.read_many(name for _, name in readable)):
+        job.new_contents = contents
+    # only the start of larger files is needed, to classify them
+    too_large = [
+        (job, name) for job, name in new_lookups if job.new_size is not None and job.new_size >= MAX_DIFF_ITEM_SIZE
+    ]
+    for (job, _), head in zip(too_large, reader.read_heads((name for _, name in too_large), classify.SNIFF_SIZE)):
+        job.new_head = head
+
+    yield from batch
+
+
+def _diff_path(diff_item: git.diff.Diff | diffstream.PatchRecord, file_was_removed: bool) -> str:
+    # git already gives paths relative to the repository root, with forward slashes. A removed file
+    # doesn't exist any more, so it's the one from the a_path
+    return diff_item.a_path if file_was_removed else diff_item.b_path
+
+
+def _old_object_name(diff_item: git.diff.Diff | diffstream.PatchRecord) -> str | None:
+    return _object_name(getattr(diff_item, "a_blob_id", None), getattr(diff_item, "a_blob", None))
+
+
+def _new_object_name(diff_item: git.diff.Diff | diffstream.PatchRecord) -> str | None:
+    return _object_name(getattr(diff_item, "b_blob_id", None), getattr(diff_item, "b_blob", None))
+
+
+def _object_name(blob_id: str | None, blob: git.Blob | None) -> str | None:
+    # streamed records carry the blob id directly, GitPython diffs carry a blob object
+    if blob_id:
+        return None if set(blob_id) == {"0"} else blob_id
+    if blob is not None:
+        return blob.hexsha
+    return None
+
+
+def _sniff(job: _FileJob) -> bytes:
+    if job.new_contents is not None:
+        return job.new_contents[: classify.SNIFF_SIZE]
+    if job.new_head is not None:
+        return job.new_head
+    # not in the object database, e.g. GitPython diffs against the working tree
+    if not job.file_was_removed and job.diff_file.is_file():
+        return blobs.read_file_head(job.diff_file, classify.SNIFF_SIZE)
+    return b""
+
+
+def _assemble_file_diff(
+    project_root: pathlib.Path, job: _FileJob, context_mode: str = context.DEFAULT_CONTEXT_MODE
+) -> prompt.FileDiff:
+    diff_item = job.diff_item
+    path = _diff_path(diff_item, job.file_was_removed)
+
+    old_path = similarity = None
+    if job.file_was_removed:
+        change_type = "removed"
+    elif diff_item.new_file:
+        change_type = "added"
+    elif diff_item.copied_file or diff_item.renamed_file:
+        change_type = "copied" if diff_item.copied_file else "renamed"
+        old_path = diff_item.a_path
+        # GitPython doesn't parse the similarity score out of patches
+        similarity = getattr(diff_item, "similarity", None)
+    else:
+        change_type = "modified"
+
+    if isinstance(diff_item, diffstream.PatchRecord):
+        # streamed patches are counted as they're read, and may have been cut short
+        additions, deletions = diff_item.additions, diff_item.deletions
+        patch_too_large = diff_item.truncated or len(diff_item.diff) >= MAX_DIFF_ITEM_SIZE
+    else:
+        additions, deletions = prompt.count_changed_lines(diff_item.diff.decode("utf-8", errors="replace"))
+        patch_too_large = len(diff_item.diff) >= MAX_DIFF_ITEM_SIZE
+
+    file_info = {
+        "path": path,
+        "change_type": change_type,
+        "additions": additions,
+        "deletions": deletions,
+        "old_path": old_path,
+        "similarity": similarity,
+    }
+
+    if job.summary_reason is not None:
+        summary = f"{job.summary_reason}: {change_type}, +{additions} -{deletions} lines"
+        return prompt.FileDiff(**file_info, summary=summary)
+
+    if not job.file_was_removed and job.new_size is None:
+        # not in the object database (or no blob id to look it up by), check the working tree
+        job.new_size, job.new_contents = blobs.load_file(job.diff_file, MAX_DIFF_ITEM_SIZE)
+
+    # binaries, lockfiles and generated code get a one-line summary instead
+    if kind := classify.classify_file(path, _sniff(job), diff_item.diff[: classify.SNIFF_SIZE]):
+        summary = classify.summarize(
+            kind, change_type, diff_item.diff, job.old_size, job.new_size, additions, deletions
+        )
+        return prompt.FileDiff(**file_info, summary=summary)
+
+    if job.file_was_removed:
+        file_contents = prompt.FILE_REMOVED
+    elif job.new_contents is None or job.new_size >= MAX_DIFF_ITEM_SIZE:
+        file_contents = prompt.FILE_TOO_LARGE
+    else:
+        file_contents = job.new_contents.decode("utf-8")
+
+    if patch_too_large:
+        # keep every hunk header and the biggest hunks rather than dropping the diff outright
+        file_diff_text = hunks.reduce_diff(diff_item.diff.decode("utf-8", errors="replace"), MAX_DIFF_ITEM_SIZE)
+        if getattr(diff_item, "truncated", False):
+            file_diff_text += f"... rest of the patch not read, +{additions} -{deletions} lines in total ...\n"
+    else:
+        file_diff_text = diff_item.diff.decode("utf-8")
+
+    scoped = False
+    if old_path is not None:
+        # a moved or copied file is described by where it came from and the delta, never in full
+        file_contents = None
+        file_diff_text = file_diff_text or None
+    elif context_mode == context.DIFF_ONLY:
+        file_contents = None
+    elif context_mode == context.SCOPED and not job.file_was_removed and job.new_contents is not None:
+        full_contents = file_contents
+        file_contents = context.extract_context(path, full_contents, diff_item.diff.decode("utf-8", errors="replace"))
+        scoped = file_contents is not None and file_contents != full_contents
+
+    return prompt.FileDiff(**file_info, diff=file_diff_text, contents=file_contents, scoped=scoped)
+
+
+def generate_diffs_with_fresh_repo(project_root: pathlib.Path, token_budget: int = prompt.DEFAULT_TOKEN_BUDGET) -> str:
+    # with no prior commit there are no diffs, only new files, so they're always shown in full
+    # object ids rather than `:<path>` names, which can't be sent to `git cat-file` for paths with newlines
+    stdout, stderr = utils.run_command(["git", "ls-files", "--stage", "-z"], show_output=False)
+    object_names = {}
+    for entry in stdout.split("\0"):
+        if entry:
+            # "<mode> <object id> <stage>\t<path>", with a stage per side of a conflict
+            info, _, staged_path = entry.partition("\t")
+            object_names.setdefault(staged_path, info.split(" ")[1])
+    staged_paths = list(object_names)
+
+    dropped_rules, summarized_rules = ignore.load_rules(project_root)
+    kept_paths = [p for p in staged_paths if not dropped_rules.matches(p)]
+    print_ignored_files(len(staged_paths) - len(kept_paths))
+    staged_paths = kept_paths
+
+    paths_to_read = [p for p in staged_paths if not summarized_rules.matches(p)]
+    with blobs.BlobReader(project_root) as reader:
+        staged_sizes = dict(zip(paths_to_read, reader.sizes(object_names[p] for p in paths_to_read)))
+        readable = [p for p, size in staged_sizes.items() if size is not None and size < MAX_DIFF_ITEM_SIZE]
+        staged_blobs = dict(zip(readable, reader.read_many(object_names[p] for p in readable)))
+        too_large = [p for p, size in staged_sizes.items() if size is not None and size >= MAX_DIFF_ITEM_SIZE]
+        staged_heads = dict(
+            zip(too_large, reader.read_heads((object_names[p] for p in too_large), classify.SNIFF_SIZE))
+        )
+
+    file_diffs = []
+    for staged_file_raw in staged_paths:
         staged_file = project_root / staged_file_raw
-        staged_file_contents = staged_file.read_text()
-        diff_items.append(
-            "============\n"
-            f"Newly added File: ./{staged_file.relative_to(project_root)}\n"
-            "----- Contents -----\n"
-            f"{staged_file_contents}\n\n"
-            "============\n"
+        path = staged_file.relative_to(project_root).as_posix()
+        if staged_file_raw not in staged_sizes:
+            file_diffs.append(prompt.FileDiff(path=path, change_type="added", summary="summarized by config: added"))
+            continue
+
+        job = _FileJob(
+            None,
+            staged_file,
+            False,
+            new_size=staged_sizes[staged_file_raw],
+            new_contents=staged_blobs.get(staged_file_raw),
+            new_head=staged_heads.get(staged_file_raw),
         )
+        if job.new_size is None:
+            job.new_size, job.new_contents = blobs.load_file(staged_file, MAX_DIFF_ITEM_SIZE)
+
+        if kind := classify.classify_file(path, _sniff(job)):
+            summary = classify.summarize(kind, "added", new_size=job.new_size)
+            file_diffs.append(prompt.FileDiff(path=path, change_type="added", summary=summary))
+            continue
 
-    diff_overview = "\n".join(diff_items)
+        if job.new_contents is None:
+            staged_file_contents = prompt.FILE_TOO_LARGE
+            num_lines = 0
+        else:
+            # only the first `classify.SNIFF_SIZE` bytes were checked for being text, so there may be
+            # stray non-UTF-8 bytes further in
+            staged_file_contents = job.new_contents.decode("utf-8", errors="replace")
+            num_lines = len(staged_file_contents.splitlines())
+        file_diffs.append(
+            prompt.FileDiff(
+                path=path,
+                change_type="added",
+                contents=staged_file_contents,
+                additions=num_lines,
+            )
+        )
+
+    diff_overview, report = prompt.build_prompt(file_diffs, token_budget)
+    print_budget_report(report)
     return diff_overview
 
 
-def generate_diffs_for_pull_request(current_repo: git.Repo, branch: str) -> tuple[str, str]:
-    latest_commit = current_repo.head.commit.tree
+def generate_diffs_for_pull_request(
+    current_repo: git.Repo,
+    branch: str,
+    token_budget: int = prompt.DEFAULT_TOKEN_BUDGET,
+    context_mode: str = context.AUTO,
+    verbose: bool = False,
+    llm: ai.LLM | None = None,
+) -> tuple[str, str]:
+    commit_summary, _ = utils.run_command(
+        ["git", "log", "--right-only", "--cherry-pick", "--format=raw", f"{branch}...HEAD"]
+    )
 
-    commit_summary, _ = utils.run_cmd(f"git log --right-only --cherry-pick --format='raw' {branch}...HEAD")
+    project_root = pathlib.Path(current_repo.working_dir)
+    diff_plan = make_plan(
+        project_root, [branch, "HEAD"], token_budget, context_mode, verbose, map_reduce=llm is not None
+    )
+
+    # streamed file by file, so peak memory follows the largest file rather than the whole branch
+    diff_overview = _generate_streamed_diffs(
+        project_root,
+        [branch, "HEAD"],
+        lambda: current_repo.commit(branch).diff(
+            current_repo.head.commit.tree, create_patch=True, find_renames=True, find_copies=True
+        ),
+        token_budget=token_budget,
+        context_mode=diff_plan.context_mode,
+        summarize_paths=diff_plan.summarize_paths,
+        summarize_with=llm if diff_plan.strategy == plan.MAP_REDUCE else None,
+    )
+
+    return commit_summary, diff_overview
 
-    other_branch = current_repo.commit(branch)
 
-    diff_index = other_branch.diff(latest_commit, create_patch=True)
+def summarize_commits_for_pull_request(
+    current_repo: git.Repo,
+    branch: str,
+    llm: ai.LLM,
+    token_budget: int = COMMIT_TOKEN_BUDGET,
+    use_cache: bool = True,
+) -> str:
+    """
+    Summarize every commit on the current branch that isn't on `branch`, one commit at a time.
 
+    A commit's SHA pins down its contents, so each summary is cached by model and SHA and only
+    commits added since the last run are ever sent to the model. Merge commits are skipped,
+    since their diffs mostly repeat changes from the other side of the merge.
+
+    Args:
+        current_repo: The repository, with the branch to describe checked out
+        branch: Base branch the pull request will be merged into
+        llm: The model to summarize with
+        token_budget: Token budget for each commit's diff
+        use_cache: Reuse summaries of commits summarized before
+
+    Returns:
+        The summaries of every commit, oldest first, each under its short SHA and subject line
+    """
+    console = rich.console.Console()
     project_root = pathlib.Path(current_repo.working_dir)
+    stdout, _ = utils.run_command(
+        ["git", "rev-list", "--reverse", "--right-only", "--cherry-pick", "--no-merges", f"{branch}...HEAD"],
+        show_output=False,
+    )
+    commits = [current_repo.commit(sha) for sha in stdout.split()]
+
+    summary_cache = cache.ResponseCache(ai.COMMIT_SUMMARY_DIRECTORY)
+    keys = {
+        commit.hexsha: cache.response_key(llm.model_name, mapreduce.COMMIT_SUMMARY_PROMPT, commit.hexsha)
+        for commit in commits
+    }
+    summaries = {
+        commit.hexsha: summary
+        for commit in commits
+        if use_cache and (summary := summary_cache.get(keys[commit.hexsha])) is not None
+    }
+    new_commits = [commit for commit in commits if commit.hexsha not in summaries]
+    console.print(
+        rich.text.Text(
+            f"{len(commits):,} commit(s) on this branch, {len(new_commits):,} not summarized yet", style="dim"
+        )
+    )
+
+    commit_prompts = [_commit_prompt(project_root, commit, token_budget) for commit in new_commits]
+    new_summaries = mapreduce.summarize_prompts(
+        llm, commit_prompts, description="commit(s)", system_prompt_name=mapreduce.COMMIT_SUMMARY_PROMPT
+    )
+    for commit, summary in zip(new_commits, new_summaries):
+        summaries[commit.hexsha] = summary
+        summary_cache.put(keys[commit.hexsha], summary)
+
+    sections = [f"Commit {commit.hexsha[:10]}: {commit.summary}\n{summaries[commit.hexsha]}\n" for commit in commits]
+    return (
+        f"Summaries of the {len(commits):,} commit(s) on this branch, oldest first:\n\n"
+        + prompt.FILE_SEPARATOR.join(sections)
+    )
+
+
+def _commit_prompt(project_root: pathlib.Path, commit: git.Commit, token_budget: int) -> str:
+    if commit.parents:
+        diffs = commit.parents[0].diff(commit, create_patch=True, find_renames=True, find_copies=True)
+    else:
+        diffs = commit.diff(git.NULL_TREE, create_patch=True, R=True)
+    diff_overview = generate_diffs_with_valid_prior_commit(
+        project_root, diffs, token_budget=token_budget, context_mode=context.DIFF_ONLY
+    )
+    return f"Commit message:\n{commit.message}\n\n{diff_overview}"
+
+
+def print_ignored_files(num_ignored: int):
+    if num_ignored:
+        console = rich.console.Console()
+        console.print(
+            rich.text.Text(f"Skipped {num_ignored:,} file(s) matching {ignore.IGNORE_FILE_NAME} rules", style="dim")
+        )
 
-    diff_overview = generate_diffs_with_valid_prior_commit(project_root, diff_index)
 
-    return commit_summary, diff_overview
+def print_budget_report(report: prompt.BudgetReport, num_planned_summaries: int = 0):
+    """
+    Tell the user which files were cut down to make the prompt fit its token budget.
+
+    Args:
+        report: What the prompt builder did
+        num_planned_summaries: Files the planning pass already decided to summarize
+    """
+    if not report.truncated and not num_planned_summaries:
+        return
+
+    console = rich.console.Console()
+    console.print(
+        rich.text.Text(
+            f"Prompt trimmed to fit {report.token_budget:,} tokens: "
+            f"{len(report.reduced):,} diff(s) shortened, "
+            f"{len(report.summarized) + num_planned_summaries:,} file(s) summarized, "
+            f"{len(report.dropped):,} file(s) dropped",
+            style="yellow",
+        )
+    )
+    for path in report.dropped:
+        console.print(rich.padding.Padding(rich.text.Text(f"Dropped: {path}", style="dim"), (0, 0, 0, 2)))
 
 
 def get_untracked_and_modified_files(current_repo: git.Repo) -> list[pathlib.Path]:
@@ -194,13 +714,15 @@ def add_files(current_repo: git.Repo, interactive: bool = True):
     formatted_paths = "\n".join(str(p.relative_to(git_repo_root)) for p in unstaged_files)
 
     try:
-        utils.run_cmd("tree --fromfile", input=formatted_paths)
+        utils.run_command(["tree", "--fromfile"], input=formatted_paths)
     except SystemError:
         pass
 
     if unstaged_files:
         console.print(f"Adding unstaged files to the commit... ({num_staged_files:,} already staged)")
         if interactive:
+            import beaupy
+
             beaupy.Config.raise_on_interrupt = True
             selections = beaupy.select_multiple(
                 [str(f.relative_to(git_repo_root)) for f in unstaged_files],
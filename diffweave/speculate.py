@@ -0,0 +1,186 @@
+"""
+Speculative commit messages, generated while you're still staging.
+
+The slowest part of committing is waiting for the model after `git add`. `diffweave-ai watch`
+watches the repository's index, and once it stops changing generates a message for the staged
+changes in the background. The message is stored under the hash of the staged tree, as given by
+`git write-tree`, together with the commit it would be made on top of and the settings it was
+generated with. A later run with exactly the same staged changes finds it and uses it instead of
+waiting for the model again.
+"""
+
+import pathlib
+import time
+from typing import TYPE_CHECKING
+
+import rich
+import rich.console
+import rich.padding
+import rich.text
+
+from . import ai, cache, context, utils
+
+if TYPE_CHECKING:
+    import git
+
+# how long the index must stay unchanged before a message is generated, so a run of `git add`s only costs one
+SETTLE_SECONDS = 2.0
+POLL_INTERVAL_SECONDS = 0.5
+
+
+def staged_key(current_repo: "git.Repo", model_name: str, prompt_name: str, context_mode: str) -> str | None:
+    """
+    The key a message for the currently staged changes is stored under.
+
+    Returns:
+        The key, or None if the index can't be written as a tree, e.g. during a merge with conflicts
+    """
+    import git
+
+    try:
+        tree = current_repo.git.write_tree()
+    except git.GitCommandError:
+        return None
+    try:
+        parent = current_repo.head.commit.hexsha
+    except ValueError:
+        # no commits yet
+        parent = ""
+    return cache.response_key("staged", parent, tree, model_name, prompt_name, context_mode)
+
+
+def lookup(
+    current_repo: "git.Repo", model_name: str, prompt_name: str = "prompt", context_mode: str = context.AUTO
+) -> str | None:
+    """
+    Find a message generated ahead of time for exactly the currently staged changes.
+
+    Args:
+        current_repo: The repository
+        model_name: The model the message must have been generated with
+        prompt_name: The system prompt it must have been generated with, e.g. "prompt" or "simple"
+        context_mode: The `--context` mode it must have been generated with
+
+    Returns:
+        The message, or None if there is none
+    """
+    key = staged_key(current_repo, model_name, prompt_name, context_mode)
+    if key is None:
+        return None
+    return cache.ResponseCache(ai.SPECULATIVE_DIRECTORY).get(key)
+
+
+def pregenerate(
+    current_repo: "git.Repo", llm: ai.LLM, prompt_name: str = "prompt", context_mode: str = context.AUTO
+) -> str | None:
+    """
+    Generate and store a message for the currently staged changes, unless one is stored already.
+
+    Args:
+        current_repo: The repository
+        llm: The model to generate with, built with the `prompt_name` system prompt
+        prompt_name: The system prompt's name, part of the key
+        context_mode: A `context` mode, or `context.AUTO`
+
+    Returns:
+        The stored message, or None if nothing is staged or the index changed while generating
+    """
+    from . import repo
+
+    key = staged_key(current_repo, llm.model_name, prompt_name, context_mode)
+    if key is None:
+        return None
+    store = cache.ResponseCache(ai.SPECULATIVE_DIRECTORY)
+    if (msg := store.get(key)) is not None:
+        return msg
+
+    repo_status, _ = utils.run_command(["git", "status"], show_output=False, silent=True)
+    diffs = repo.generate_diffs_with_context(current_repo, context_mode=context_mode, llm=llm)
+    if diffs == "":
+        return None
+    msg = llm.run(llm.query_model(ai.initial_conversation(f"{repo_status}\n\n{diffs}", "")))
+
+    # the diffs may have been read after more changes were staged, in which case they don't match the key
+    if staged_key(current_repo, llm.model_name, prompt_name, context_mode) != key:
+        return None
+    store.put(key, msg)
+    return msg
+
+
+def watch(
+    current_repo: "git.Repo",
+    llm: ai.LLM,
+    prompt_name: str = "prompt",
+    context_mode: str = context.AUTO,
+    settle: float = SETTLE_SECONDS,
+    poll_interval: float = POLL_INTERVAL_SECONDS,
+):
+    """
+    Pre-generate a message for the staged changes every time the index settles, until interrupted.
+
+    Errors while generating are printed and don't stop the watch.
+    """
+    console = rich.console.Console()
+    index_path = pathlib.Path(current_repo.git_dir) / "index"
+    console.print(rich.text.Text(f"Watching {index_path} for staged changes, Ctrl-C to stop", style="dim"))
+
+    stamp = _index_stamp(index_path)
+    while True:
+        # `git status` and `git write-tree` can refresh the index themselves, which shows up as one
+        # more change that only needs the stored message looked up
+        if lookup(current_repo, llm.model_name, prompt_name, context_mode) is None:
+            started = time.monotonic()
+            try:
+                msg = pregenerate(current_repo, llm, prompt_name, context_mode)
+            except Exception as e:  # noqa: BLE001
+                # a failed request to the model or a git hiccup shouldn't end the watch
+                console.print(
+                    rich.padding.Padding(
+                        rich.text.Text(f"Failed, retrying on the next change: {e!r}", style="yellow"),
+                        (0, 0, 0, 2),
+                    )
+                )
+                msg = None
+            if msg is not None:
+                console.print(
+                    rich.padding.Padding(
+                        rich.text.Text(
+                            f"Ready in {time.monotonic() - started:.1f}s: {msg.splitlines()[0] if msg else ''}",
+                            style="green",
+                        ),
+                        (0, 0, 0, 2),
+                    )
+                )
+        stamp = wait_for_change(index_path, stamp, settle, poll_interval)
+
+
+def wait_for_change(
+    index_path: pathlib.Path,
+    stamp: tuple[int, int] | None,
+    settle: float = SETTLE_SECONDS,
+    poll_interval: float = POLL_INTERVAL_SECONDS,
+) -> tuple[int, int] | None:
+    """
+    Block until the index differs from `stamp` and then stays unchanged for `settle` seconds.
+
+    Returns:
+        The new stamp of the index
+    """
+    while (current := _index_stamp(index_path)) == stamp:
+        time.sleep(poll_interval)
+
+    settled_at = time.monotonic()
+    while time.monotonic() - settled_at < settle:
+        time.sleep(poll_interval)
+        if (latest := _index_stamp(index_path)) != current:
+            current = latest
+            settled_at = time.monotonic()
+    return current
+
+
+def _index_stamp(index_path: pathlib.Path) -> tuple[int, int] | None:
+    try:
+        stat = index_path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
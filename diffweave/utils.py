@@ -1,12 +1,108 @@
+import collections
+import concurrent.futures
+import multiprocessing
+import shlex
 import subprocess
+import threading
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from typing import TYPE_CHECKING, TypeVar
 
-import rich
-import rich.panel
-import rich.console
-import rich.highlighter
-import rich.syntax
-import rich.text
-import rich.padding
+if TYPE_CHECKING:
+    import rich.console
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# longest command output shown in full; the rest is counted but not printed
+MAX_DISPLAY_LINES = 200
+# highlighting output with pygments takes longer than the command itself past this many characters
+HIGHLIGHT_LIMIT_CHARS = 20_000
+
+
+def run_command(
+    argv: Sequence[str],
+    show_output: bool = True,
+    silent: bool = False,
+    stream: bool = False,
+    input: str | None = None,
+    max_display_lines: int = MAX_DISPLAY_LINES,
+    highlight_limit: int = HIGHLIGHT_LIMIT_CHARS,
+    **popen_kwargs,
+) -> tuple[str, str]:
+    """
+    Run a command without a shell and handle its output.
+
+    Arguments are passed to the program as they are, so nothing needs quoting. Like `run_cmd`,
+    the command is echoed and its output shown, but at most `max_display_lines` lines of it, and
+    without syntax highlighting once it's bigger than `highlight_limit` characters. With
+    `stream`, each line is shown as soon as the command writes it instead of once it exits,
+    for slow commands like `git push` with hooks.
+
+    Args:
+        argv: The program and its arguments
+        show_output: If True, display the command's stdout and stderr
+        silent: If True, don't display the command being executed
+        stream: Show output line by line as it arrives
+        input: Text written to the command's stdin
+        max_display_lines: Most lines of output to display; the full output is always returned
+        highlight_limit: Largest output, in characters, that is syntax highlighted
+        **popen_kwargs: Passed on to `subprocess.Popen`, e.g. `cwd` or `env`
+
+    Returns:
+        The stdout and stderr of the command, stripped
+
+    Raises:
+        SystemError: If the command can't be started or returns a non-zero exit code
+    """
+    import rich.console
+    import rich.text
+
+    console = rich.console.Console()
+
+    if not silent:
+        console.print(
+            rich.console.Group(rich.text.Text("$>", end=" "), rich.text.Text(shlex.join(argv), style="bold green"))
+        )
+
+    try:
+        process = subprocess.Popen(
+            argv,
+            stdin=subprocess.PIPE if input is not None else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            **popen_kwargs,
+        )
+    except OSError as e:
+        error = f"{argv[0]}: {e.strerror}"
+        _print_output(console, error, max_display_lines, highlight_limit)
+        console.print(rich.text.Text("Unexpected error occurred while running the command.", style="bold red"))
+        raise SystemError(error) from e
+
+    streamed = stream and show_output
+    if streamed:
+        output, error = _stream_output(process, input, console, max_display_lines)
+    else:
+        output, error = process.communicate(input)
+    output = output.strip()
+    error = error.strip()
+
+    if process.returncode != 0:
+        if not streamed:
+            _print_output(console, error, max_display_lines, highlight_limit)
+        console.print(rich.text.Text("Unexpected error occurred while running the command.", style="bold red"))
+        raise SystemError(error)
+
+    if show_output:
+        if not streamed:
+            _print_output(console, output, max_display_lines, highlight_limit)
+            _print_output(console, error, max_display_lines, highlight_limit)
+    elif not silent:
+        _print_truncated(console)
+
+    return output, error
 
 
 def run_cmd(
@@ -20,7 +116,8 @@ def run_cmd(
 
     This function runs a shell command and provides rich formatting for the command
     and its output. It can optionally display or hide the command's output and
-    can run silently without showing the command being executed.
+    can run silently without showing the command being executed. Prefer `run_command`,
+    which doesn't go through a shell, unless the command needs one.
 
     Args:
         cmd: The shell command to execute as a string
@@ -33,6 +130,9 @@ def run_cmd(
     Raises:
         SystemExit: If the command returns a non-zero exit code
     """
+    import rich.console
+    import rich.text
+
     console = rich.console.Console()
 
     kwargs = {
@@ -52,18 +152,164 @@ def run_cmd(
         console.print(rich.console.Group(rich.text.Text("$>", end=" "), rich.text.Text(f"{cmd}", style="bold green")))
 
     if process.returncode != 0:
-        console.print(rich.padding.Padding(rich.syntax.Syntax(error, "bash"), (0, 0, 0, 2)))
+        _print_output(console, error)
         console.print(rich.text.Text("Unexpected error occurred while running the command.", style="bold red"))
         raise SystemError(error)
 
     if show_output:
-        if output:
-            console.print(rich.padding.Padding(rich.syntax.Syntax(output, "bash"), (0, 0, 0, 2)))
-        if error:
-            console.print(rich.padding.Padding(rich.syntax.Syntax(error, "bash"), (0, 0, 0, 2)))
+        _print_output(console, output)
+        _print_output(console, error)
     elif not silent:
+        _print_truncated(console)
+
+    return output, error
+
+
+def _print_output(
+    console: "rich.console.Console",
+    text: str,
+    max_lines: int = MAX_DISPLAY_LINES,
+    highlight_limit: int = HIGHLIGHT_LIMIT_CHARS,
+):
+    import rich.padding
+    import rich.text
+
+    if not text:
+        return
+    lines = text.splitlines()
+    shown = "\n".join(lines[:max_lines])
+    if len(shown) <= highlight_limit:
+        # rich.syntax pulls in pygments, so it's only loaded once there's output worth highlighting
+        import rich.syntax
+
+        renderable = rich.syntax.Syntax(shown, "bash")
+    else:
+        renderable = rich.text.Text(shown)
+    console.print(rich.padding.Padding(renderable, (0, 0, 0, 2)))
+    _print_hidden_lines(console, len(lines) - max_lines)
+
+
+def _stream_output(
+    process: subprocess.Popen, input: str | None, console: "rich.console.Console", max_lines: int
+) -> tuple[str, str]:
+    """
+    Show a running command's stdout and stderr line by line until it exits.
+
+    Both pipes are read on their own thread, so neither can fill up and stall the command.
+
+    Returns:
+        The command's whole stdout and stderr
+    """
+    import rich.padding
+    import rich.text
+
+    lock = threading.Lock()
+    shown = 0
+    hidden = 0
+
+    def show(line: str):
+        nonlocal shown, hidden
+        with lock:
+            if shown < max_lines:
+                console.print(rich.padding.Padding(rich.text.Text(line.rstrip("\n")), (0, 0, 0, 2)))
+                shown += 1
+            else:
+                hidden += 1
+
+    def read(pipe, lines: list[str]):
+        for line in pipe:
+            lines.append(line)
+            show(line)
+
+    def write():
+        try:
+            process.stdin.write(input)
+            process.stdin.close()
+        except BrokenPipeError:
+            # the command exited without reading all of its input
+            pass
+
+    stdout_lines: list[str] = []
+    stderr_lines: list[str] = []
+    threads = [threading.Thread(target=read, args=(process.stderr, stderr_lines), daemon=True)]
+    if input is not None:
+        threads.append(threading.Thread(target=write, daemon=True))
+    for thread in threads:
+        thread.start()
+    read(process.stdout, stdout_lines)
+    for thread in threads:
+        thread.join()
+    process.wait()
+
+    _print_hidden_lines(console, hidden)
+    return "".join(stdout_lines), "".join(stderr_lines)
+
+
+def _print_hidden_lines(console: "rich.console.Console", hidden: int):
+    import rich.padding
+    import rich.text
+
+    if hidden > 0:
         console.print(
-            rich.padding.Padding(rich.text.Text("result truncated", style="lightgrey"), (0, 0, 0, 2), style="dim")
+            rich.padding.Padding(rich.text.Text(f"... {hidden:,} more line(s) not shown", style="dim"), (0, 0, 0, 2))
         )
 
-    return output, error
+
+def _print_truncated(console: "rich.console.Console"):
+    import rich.padding
+    import rich.text
+
+    console.print(
+        rich.padding.Padding(rich.text.Text("result truncated", style="lightgrey"), (0, 0, 0, 2), style="dim")
+    )
+
+
+def ordered_map(  # noqa: UP047 - type parameter syntax needs Python 3.12
+    func: Callable[[T], R],
+    items: Iterable[T],
+    workers: int = 1,
+    weight: Callable[[T], int] | None = None,
+    max_weight: int | None = None,
+    processes: bool = False,
+) -> Iterator[R]:
+    """
+    Lazily map `func` over `items` on a thread or process pool, yielding results in input order.
+
+    Unlike `Executor.map`, at most a few results per worker are in flight at once, so `items`
+    can be a large generator without being pulled into memory all at once.
+
+    Args:
+        func: The function to apply to each item
+        items: The items to map over
+        workers: Number of threads or processes to use, 1 runs everything in the calling thread
+        weight: The size of an item, e.g. in bytes
+        max_weight: Stop reading ahead once the items in flight weigh this much in total
+        processes: Use worker processes rather than threads, for work that holds the GIL; `func`
+            must then be importable from a module, and the items and results picklable
+    """
+    if workers <= 1:
+        yield from map(func, items)
+        return
+
+    window = workers * 4
+    if processes:
+        # forking a process that already runs threads (e.g. a blob reader's) can deadlock the child
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+    else:
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    with pool:
+        pending = collections.deque()
+        in_flight = 0
+        for item in items:
+            item_weight = weight(item) if weight is not None else 0
+            pending.append((pool.submit(func, item), item_weight))
+            in_flight += item_weight
+            del item
+            while pending and (len(pending) >= window or (max_weight is not None and in_flight >= max_weight)):
+                future, item_weight = pending.popleft()
+                in_flight -= item_weight
+                yield future.result()
+        while pending:
+            yield pending.popleft()[0].result()
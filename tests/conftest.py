@@ -4,11 +4,19 @@ import pathlib
 import random
 import string
 import shutil
+import threading
+import time
 import uuid
+from unittest.mock import AsyncMock
 
 import yaml
 import pytest
 import git
+from openai.types.chat import ChatCompletionChunk
+from openai.types.chat.chat_completion_chunk import Choice, ChoiceDelta
+from openai.types.completion_usage import CompletionUsage
+
+from diffweave import daemon
 
 
 @pytest.fixture(autouse=True)
@@ -17,10 +25,73 @@ def patch_openai(request, monkeypatch, mocker):
         yield
         return
     mock_openai = mocker.MagicMock()
-    monkeypatch.setattr("openai.OpenAI", mock_openai)
+    mock_openai.return_value.chat.completions.create = AsyncMock(
+        side_effect=lambda **_: _completion_stream("feat: mocked commit message")
+    )
+    mock_openai.return_value.close = AsyncMock()
+    monkeypatch.setattr("openai.AsyncOpenAI", mock_openai)
     yield
 
 
+@pytest.fixture(autouse=True)
+def isolated_cache(monkeypatch, tmp_path):
+    cache_directory = tmp_path / "response_cache"
+    monkeypatch.setattr("diffweave.ai.CACHE_DIRECTORY", cache_directory)
+    monkeypatch.setattr("diffweave.ai.COMMIT_SUMMARY_DIRECTORY", tmp_path / "commit_summaries")
+    monkeypatch.setattr("diffweave.ai.SPECULATIVE_DIRECTORY", tmp_path / "speculative")
+    monkeypatch.setattr("diffweave.daemon.SOCKET_PATH", tmp_path / "daemon.sock")
+    monkeypatch.setattr("diffweave.hook.LOG_FILE", tmp_path / "hook.log")
+    return cache_directory
+
+
+@pytest.fixture()
+def daemon_socket():
+    """
+    A daemon serving requests from a background thread, on the isolated socket path.
+    """
+    thread = threading.Thread(target=daemon.serve, kwargs={"idle_timeout": 30})
+    thread.start()
+    deadline = time.monotonic() + 5
+    while not daemon.is_running():
+        assert time.monotonic() < deadline, "daemon did not start"
+        time.sleep(0.01)
+    yield daemon.SOCKET_PATH
+    if daemon.is_running():
+        daemon.request({"command": "stop"})
+    thread.join(timeout=5)
+
+
+@pytest.fixture()
+def completion_stream():
+    """
+    Build a fake streamed chat completion, as returned by `AsyncOpenAI.chat.completions.create(stream=True)`.
+    """
+    return _completion_stream
+
+
+async def _completion_stream(content: str, chunk_size: int = 8, usage: CompletionUsage | None = None):
+    created = int(datetime.datetime.now().timestamp())
+    for start in range(0, len(content), chunk_size):
+        yield ChatCompletionChunk(
+            id="asdf",
+            created=created,
+            model="model",
+            object="chat.completion.chunk",
+            choices=[Choice(index=0, delta=ChoiceDelta(content=content[start : start + chunk_size], role="assistant"))],
+        )
+    yield ChatCompletionChunk(
+        id="asdf",
+        created=created,
+        model="model",
+        object="chat.completion.chunk",
+        choices=[Choice(index=0, finish_reason="stop", delta=ChoiceDelta())],
+    )
+    if usage is not None:
+        yield ChatCompletionChunk(
+            id="asdf", created=created, model="model", object="chat.completion.chunk", choices=[], usage=usage
+        )
+
+
 @pytest.fixture(scope="function")
 def new_repo():
     dirname = uuid.uuid4().hex
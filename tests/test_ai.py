@@ -1,13 +1,13 @@
 from pathlib import Path
+import asyncio
 import datetime
+import itertools
 import json
 from unittest.mock import AsyncMock
 
 import pytest
 import yaml
-from openai.types.chat import ChatCompletion, ChatCompletionMessage
-from openai.types.chat.chat_completion import Choice, CompletionUsage
-
+from openai.types.completion_usage import CompletionUsage, PromptTokensDetails
 
 import diffweave
 
@@ -49,40 +49,58 @@ def fake_config(monkeypatch, config_file):
 
 
 @pytest.mark.asyncio
-async def test_querying(fake_config, mocker):
+async def test_querying(fake_config, mocker, completion_stream):
     response_content = "this is a git commit message"
 
     MockClient = mocker.Mock()
-    MockClient.return_value.chat.completions.create.return_value = _build_completion_from_message(response_content)
-    mocker.patch("openai.OpenAI", MockClient)
+    MockClient.return_value.chat.completions.create = AsyncMock(
+        side_effect=lambda **_: completion_stream(response_content)
+    )
+    mocker.patch("openai.AsyncOpenAI", MockClient)
     conn = diffweave.ai.LLM()
 
     assert await conn.query_model(["some_query"]) == response_content
+    assert MockClient.return_value.chat.completions.create.call_args.kwargs["stream"] is True
+    assert "stream_options" not in MockClient.return_value.chat.completions.create.call_args.kwargs
 
 
 @pytest.mark.asyncio
-async def test_query_with_backtick_response(fake_config, mocker):
+async def test_query_with_backtick_response(fake_config, mocker, completion_stream):
     response_content = "this is a git commit message"
     backtick_response = f"```\n{response_content}\n```"
 
     MockClient = mocker.Mock()
-    MockClient.return_value.chat.completions.create.return_value = _build_completion_from_message(backtick_response)
-    mocker.patch("openai.OpenAI", MockClient)
+    MockClient.return_value.chat.completions.create = AsyncMock(
+        side_effect=lambda **_: completion_stream(backtick_response)
+    )
+    mocker.patch("openai.AsyncOpenAI", MockClient)
     conn = diffweave.ai.LLM()
 
     assert await conn.query_model(["some_query"]) == response_content
 
 
-def _build_completion_from_message(content: str) -> ChatCompletion:
-    return ChatCompletion(
-        id="asdf",
-        created=int(datetime.datetime.now().timestamp()),
-        model="model",
-        object="chat.completion",
-        choices=[
-            Choice(index=0, finish_reason="stop", message=ChatCompletionMessage(content=content, role="assistant"))
-        ],
+@pytest.mark.asyncio
+async def test_query_streams_tokens(fake_config, mocker, completion_stream):
+    MockClient = mocker.Mock()
+    MockClient.return_value.chat.completions.create = AsyncMock(
+        side_effect=lambda **_: completion_stream("```\nfeat: stream tokens\n```", chunk_size=3)
     )
+    mocker.patch("openai.AsyncOpenAI", MockClient)
+    conn = diffweave.ai.LLM()
+
+    tokens = []
+    assert await conn.query_model(["some_query"], on_token=tokens.append) == "feat: stream tokens"
+    assert len(tokens) > 5
+    assert "".join(tokens) == "```\nfeat: stream tokens\n```"
+
+
+def test_iterate_streams_into_console(fake_config, mocker, capsys, completion_stream):
+    MockClient = mocker.Mock()
+    MockClient.return_value.chat.completions.create = AsyncMock(side_effect=lambda **_: completion_stream("fix: a bug"))
+    mocker.patch("openai.AsyncOpenAI", MockClient)
+    llm = diffweave.ai.LLM()
+    assert llm.iterate_on_commit_message("status", "context", return_first=True) == "fix: a bug"
+    assert "fix: a bug" in capsys.readouterr().out
 
 
 def test_configuring_databricks_model(config_file: Path, monkeypatch):
@@ -139,6 +157,23 @@ def test_iterate_with_feedback(fake_config, mocker):
     assert result == "feat: add feature"
 
 
+def test_iterate_builds_prompt_only_when_needed(fake_config, mocker):
+    query_model = AsyncMock(return_value="feat: refined feature")
+    mocker.patch.object(diffweave.ai.LLM, "query_model", new=query_model)
+    build_prompt = mocker.Mock(return_value="status")
+    llm = diffweave.ai.LLM()
+
+    # a message generated ahead of time that's accepted as it is never needs the diffs
+    msg = llm.iterate_on_commit_message(build_prompt, "", return_first=True, first_message="feat: early")
+    assert msg == "feat: early"
+    build_prompt.assert_not_called()
+
+    mocker.patch("rich.console.Console.input", side_effect=["too vague", ""])
+    assert llm.iterate_on_commit_message(build_prompt, "", first_message="feat: early") == "feat: refined feature"
+    build_prompt.assert_called_once()
+    assert query_model.await_args.args[0][0] == "status"
+
+
 def test_iterate_verbose_prints_prompt(fake_config, mocker, capsys):
     mocker.patch.object(
         diffweave.ai.LLM,
@@ -203,3 +238,161 @@ def test_load_databricks_token_missing_file(monkeypatch, tmp_path):
     monkeypatch.setattr("pathlib.Path.home", staticmethod(lambda: tmp_path))
     result = diffweave.ai.load_databricks_token_from_cache("my-account")
     assert result is None
+
+
+def test_candidates_pick_one_and_cancel_the_rest(fake_config, mocker):
+    cancelled = []
+    temperatures = []
+
+    async def query_model(self, prompt, on_token=None, temperature=None, sample=0):
+        temperatures.append(temperature)
+        if temperature == 1.0:
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.append(temperature)
+                raise
+        return f"feat: candidate at {temperature}"
+
+    mocker.patch.object(diffweave.ai.LLM, "query_model", new=query_model)
+    select = mocker.patch("beaupy.select", return_value=0)
+    llm = diffweave.ai.LLM()
+
+    result = llm.iterate_on_commit_message("status", "context", candidates=3)
+    assert result == "feat: candidate at None"
+    assert temperatures == [None, 0.7, 1.0]
+    assert cancelled == [1.0]
+    options = select.call_args.args[0]
+    assert options[-2:] == ["Wait for 1 more candidate(s)", "None of these, provide feedback"]
+
+
+def test_candidates_first_finished_wins(fake_config, mocker):
+    async def query_model(self, prompt, on_token=None, temperature=None, sample=0):
+        await asyncio.sleep(0 if temperature == 0.7 else 60)
+        return f"fix: candidate at {temperature}"
+
+    mocker.patch.object(diffweave.ai.LLM, "query_model", new=query_model)
+    select = mocker.patch("beaupy.select")
+    llm = diffweave.ai.LLM()
+
+    assert llm.iterate_on_commit_message("status", "", return_first=True, candidates=2) == "fix: candidate at 0.7"
+    select.assert_not_called()
+
+
+def test_candidates_rejected_with_feedback(fake_config, mocker):
+    async def query_model(self, prompt, on_token=None, temperature=None, sample=0):
+        return "docs: improved" if len(prompt) > 2 else f"docs: first try at {temperature}"
+
+    mocker.patch.object(diffweave.ai.LLM, "query_model", new=query_model)
+    mocker.patch("beaupy.select", side_effect=[2, 0])
+    mocker.patch("rich.console.Console.input", return_value="mention the README")
+    llm = diffweave.ai.LLM()
+
+    assert llm.iterate_on_commit_message("status", "", candidates=2) == "docs: improved"
+
+
+def test_identical_candidates_are_shown_once(fake_config, mocker):
+    samples = []
+
+    async def query_model(self, prompt, on_token=None, temperature=None, sample=0):
+        samples.append((temperature, sample))
+        return f"feat: candidate at {temperature}"
+
+    mocker.patch.object(diffweave.ai.LLM, "query_model", new=query_model)
+    select = mocker.patch("beaupy.select", return_value=0)
+    llm = diffweave.ai.LLM()
+
+    assert llm.iterate_on_commit_message("status", "", candidates=4) == "feat: candidate at None"
+    # the fourth candidate starts the temperatures over, as a separate sample
+    assert samples == [(None, 0), (0.7, 0), (1.0, 0), (None, 1)]
+    assert len([o for o in select.call_args.args[0] if o.startswith("Candidate")]) == 3
+
+
+@pytest.mark.asyncio
+async def test_samples_are_cached_separately(fake_config, mocker, completion_stream):
+    MockClient = mocker.Mock()
+    replies = iter(["feat: first sample", "feat: second sample"])
+    create = MockClient.return_value.chat.completions.create = AsyncMock(
+        side_effect=lambda **_: completion_stream(next(replies))
+    )
+    mocker.patch("openai.AsyncOpenAI", MockClient)
+
+    assert await diffweave.ai.LLM().query_model(["diff"]) == "feat: first sample"
+    assert await diffweave.ai.LLM().query_model(["diff"], sample=1) == "feat: second sample"
+    assert await diffweave.ai.LLM().query_model(["diff"], sample=1) == "feat: second sample"
+    assert create.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_identical_queries_are_cached(fake_config, mocker, completion_stream):
+    MockClient = mocker.Mock()
+    create = MockClient.return_value.chat.completions.create = AsyncMock(
+        side_effect=lambda **_: completion_stream("feat: cached message")
+    )
+    mocker.patch("openai.AsyncOpenAI", MockClient)
+
+    assert await diffweave.ai.LLM().query_model(["diff", "context"]) == "feat: cached message"
+    tokens = []
+    assert await diffweave.ai.LLM().query_model(["diff", "context"], on_token=tokens.append) == "feat: cached message"
+    assert tokens == ["feat: cached message"]
+    assert create.call_count == 1
+
+    await diffweave.ai.LLM().query_model(["diff", "other context"])
+    await diffweave.ai.LLM(use_cache=False).query_model(["diff", "context"])
+    assert create.call_count == 3
+
+
+def test_prompt_grows_linearly_with_feedback_rounds(fake_config, mocker):
+    prompt_sizes = []
+
+    async def query_model(self, prompt, on_token=None, temperature=None):
+        prompt_sizes.append(sum(len(t if isinstance(t, str) else t["content"]) for t in prompt))
+        return f"fix: attempt {len(prompt_sizes)}"
+
+    mocker.patch.object(diffweave.ai.LLM, "query_model", new=query_model)
+    mocker.patch("rich.console.Console.input", side_effect=["needs more detail"] * 6 + [""])
+    llm = diffweave.ai.LLM()
+    assert llm.iterate_on_commit_message("status " * 100, "context") == "fix: attempt 7"
+
+    # every round adds one attempt and one piece of feedback, never copies of earlier rounds
+    growth = {after - before for before, after in itertools.pairwise(prompt_sizes)}
+    assert len(prompt_sizes) == 7
+    assert len(growth) == 1
+    assert growth.pop() < 200
+
+
+def test_feedback_rounds_keep_a_stable_prefix(fake_config, mocker, completion_stream):
+    MockClient = mocker.Mock()
+    create = MockClient.return_value.chat.completions.create = AsyncMock(
+        side_effect=lambda **_: completion_stream(f"fix: attempt {create.call_count}")
+    )
+    mocker.patch("openai.AsyncOpenAI", MockClient)
+    mocker.patch("rich.console.Console.input", side_effect=["shorter", "mention the tests", ""])
+    llm = diffweave.ai.LLM()
+    llm.iterate_on_commit_message("status\n\ndiffs", "context")
+
+    requests = [call.kwargs["messages"] for call in create.call_args_list]
+    assert len(requests) == 3
+    assert requests[0][0] == {"role": "system", "content": llm.system_prompt}
+    for previous, current in itertools.pairwise(requests):
+        assert json.dumps(current[: len(previous)]) == json.dumps(previous)
+        assert [m["role"] for m in current[len(previous) :]] == ["assistant", "user"]
+
+
+def test_verbose_reports_cached_tokens(fake_config, mocker, capsys, completion_stream):
+    usage = CompletionUsage(
+        prompt_tokens=2_000,
+        completion_tokens=25,
+        total_tokens=2_025,
+        prompt_tokens_details=PromptTokensDetails(cached_tokens=1_536),
+    )
+    MockClient = mocker.Mock()
+    create = MockClient.return_value.chat.completions.create = AsyncMock(
+        side_effect=lambda **_: completion_stream("feat: usage", usage=usage)
+    )
+    mocker.patch("openai.AsyncOpenAI", MockClient)
+    llm = diffweave.ai.LLM(verbose=True)
+    assert llm.iterate_on_commit_message("status", "context", return_first=True) == "feat: usage"
+
+    assert create.call_args.kwargs["stream_options"] == {"include_usage": True}
+    assert "Tokens: 2,000 prompt, 1,536 of them cached (77%), 25 completion" in capsys.readouterr().out
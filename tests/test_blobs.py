@@ -0,0 +1,110 @@
+from pathlib import Path
+
+import git
+
+import diffweave
+from diffweave.blobs import BATCH_SIZE, BlobReader
+
+
+def test_reading_staged_blobs(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    new_repo.index.add(["README.md"])
+    Path("README.md").write_text("unstaged edit")
+
+    with BlobReader(root_dir) as reader:
+        assert reader.read(":README.md") == b"lorem ipsum"
+        assert reader.read(":does-not-exist.md") is None
+
+
+def test_reading_many_blobs(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    paths = []
+    for i in range(BATCH_SIZE * 3 + 5):
+        (root_dir / f"file {i}.txt").write_text(f"contents {i}\n" * i)
+        paths.append(f"file {i}.txt")
+    new_repo.index.add(paths)
+
+    with BlobReader(root_dir) as reader:
+        contents = reader.read_many(f":{p}" for p in paths)
+    assert contents == [f"contents {i}\n".encode() * i for i in range(len(paths))]
+
+
+def test_prompt_uses_staged_contents(new_repo: git.Repo):
+    new_repo.index.add(["README.md"])
+    new_repo.index.commit("Initial commit")
+    Path("README.md").write_text("staged version")
+    new_repo.index.add(["README.md"])
+    Path("README.md").write_text("working tree version")
+
+    diffs = diffweave.repo.generate_diffs_with_context(new_repo)
+    assert "staged version" in diffs
+    assert "working tree version" not in diffs
+
+
+def test_fresh_repo_uses_staged_contents(new_repo: git.Repo):
+    new_repo.index.add(["README.md"])
+    Path("README.md").write_text("working tree version")
+
+    diffs = diffweave.repo.generate_diffs_with_context(new_repo)
+    assert "lorem ipsum" in diffs
+    assert "working tree version" not in diffs
+
+
+def test_fresh_repo_keeps_paths_with_newlines(new_repo: git.Repo):
+    Path("new\nline.txt").write_text("staged with a newline in its name")
+    new_repo.git.add(A=True)
+
+    diffs = diffweave.repo.generate_diffs_with_context(new_repo)
+    assert "staged with a newline in its name" in diffs
+    assert "lorem ipsum" in diffs
+
+
+def test_fresh_repo_keeps_files_with_stray_non_utf8_bytes(new_repo: git.Repo):
+    # plain ASCII for longer than the sniffed head, then a Latin-1 "é"
+    Path("notes.txt").write_bytes(b"plain text\n" * 1_000 + b"caf\xe9\n")
+    new_repo.git.add(A=True)
+
+    diffs = diffweave.repo.generate_diffs_with_context(new_repo)
+    assert "caf\ufffd" in diffs
+    assert "lorem ipsum" in diffs
+
+
+def test_reading_sizes_without_contents(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    new_repo.index.add(["README.md", "main.py"])
+    with BlobReader(root_dir) as reader:
+        assert reader.sizes([":README.md", ":main.py", ":missing"]) == [11, 20, None]
+
+
+def test_read_file_head(tmp_path):
+    small = tmp_path / "small.txt"
+    small.write_bytes(b"0123456789")
+    assert diffweave.blobs.read_file_head(small, 4) == b"0123"
+
+    empty = tmp_path / "empty.txt"
+    empty.write_bytes(b"")
+    assert diffweave.blobs.read_file_head(empty, 4) == b""
+
+
+def test_reading_blob_heads(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    (root_dir / "large.txt").write_bytes(b"x" * (3 * diffweave.blobs.DISCARD_CHUNK_SIZE + 1))
+    new_repo.index.add(["README.md", "large.txt"])
+
+    with BlobReader(root_dir) as reader:
+        assert reader.read_heads([":large.txt", ":missing", ":README.md"], 5) == [b"xxxxx", None, b"lorem"]
+        # the rest of each object was drained, so the next read lines up
+        assert reader.read(":README.md") == b"lorem ipsum"
+
+
+def test_large_files_are_classified_from_staged_contents(new_repo: git.Repo):
+    new_repo.index.add(["README.md"])
+    new_repo.index.commit("Initial commit")
+    large = Path("data.js")
+    large.write_text("// @generated by the build\n" + "const a = 1;\n" * 5_000)
+    new_repo.index.add(["data.js"])
+    # only the working tree is marked as generated
+    large.write_text("const b = 2;\n" * 5_000)
+
+    diffs = diffweave.repo.generate_diffs_with_context(new_repo)
+    assert "generated: added" in diffs
@@ -0,0 +1,59 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from diffweave.cache import ResponseCache, response_key
+
+
+def test_round_trip(tmp_path):
+    cache = ResponseCache(tmp_path / "cache")
+    key = response_key("model", "system prompt", "diff")
+    assert cache.get(key) is None
+    cache.put(key, "feat: add a cache")
+    assert cache.get(key) == "feat: add a cache"
+    assert response_key("model", "system prompt", "diff") == key
+    assert response_key("model", "system promptdiff", "") != key
+
+
+def test_least_recently_used_evicted_first(tmp_path):
+    cache = ResponseCache(tmp_path)
+    for i, key in enumerate("abc"):
+        cache.put(key, key * 100)
+        os.utime(tmp_path / f"{key}.txt", (time.time() - 100 + i, time.time() - 100 + i))
+
+    # reading "a" makes "b" the least recently used entry
+    assert cache.get("a") == "a" * 100
+    cache.max_bytes = 250
+    cache.put("d", "d" * 100)
+    assert cache.get("b") is None
+    assert cache.get("c") is None
+    assert cache.get("a") is not None
+    assert cache.get("d") is not None
+
+
+def test_expired_entries_are_dropped(tmp_path):
+    cache = ResponseCache(tmp_path, max_age=60)
+    cache.put("old", "stale message")
+    cache.put("new", "fresh message")
+    an_hour_ago = time.time() - 3600
+    os.utime(tmp_path / "old.txt", (an_hour_ago, an_hour_ago))
+    assert cache.get("old") is None
+    assert not (tmp_path / "old.txt").exists()
+    assert cache.get("new") == "fresh message"
+
+
+def test_concurrent_writers(tmp_path):
+    cache = ResponseCache(tmp_path, max_bytes=50_000)
+
+    def write(i: int):
+        cache.put(str(i % 10), f"message {i % 10} " * 500)
+        return cache.get(str(i % 10))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(write, range(200)))
+
+    # readers see either nothing (evicted) or a complete entry, never a partial one
+    assert all(r is None or r == f"message {i % 10} " * 500 for i, r in enumerate(results))
+    assert not list(tmp_path.glob("*.tmp"))
+    assert cache.clear() <= 10
+    assert cache.get("0") is None
@@ -0,0 +1,81 @@
+from pathlib import Path
+
+import git
+
+import diffweave
+from diffweave.classify import BINARY, GENERATED, LOCKFILE, classify_file, classify_path, format_size, summarize
+
+
+def test_lockfiles_by_name():
+    assert classify_file("uv.lock", b"version = 1\n") == LOCKFILE
+    assert classify_file("frontend/package-lock.json", b"{}") == LOCKFILE
+    assert classify_file("src/lock.py", b"import threading\n") is None
+    assert classify_path("frontend/yarn.lock") == LOCKFILE
+    assert classify_path("static/app.min.js") == GENERATED
+    assert classify_path("src/lock.py") is None
+
+
+def test_binary_detection():
+    assert classify_file("logo.png", b"\x89PNG\r\n\x1a\n\0\0\0\rIHDR") == BINARY
+    assert classify_file("data.bin", b"\xff\xfe\xfa" * 100) == BINARY
+    assert classify_file("removed.png", b"", patch=b"Binary files a/removed.png and /dev/null differ\n") == BINARY
+    # a multi-byte character cut in half by the sniff window is still text
+    assert classify_file("notes.md", "héllo wörld ü".encode()[:-1]) is None
+
+
+def test_generated_detection():
+    assert classify_file("api_pb2.py", b"# -*- coding: utf-8 -*-\n") == GENERATED
+    assert classify_file("bundle.js", b"!function(e){" + b"var a=1;" * 500 + b"}") == GENERATED
+    assert classify_file("schema.go", b"// Code generated by sqlc. DO NOT EDIT.\npackage db\n") == GENERATED
+    assert classify_file("api.ts", b"/**\n * @generated by openapi-typescript\n */\n") == GENERATED
+    assert classify_file("Model.cs", b"// <auto-generated />\nnamespace App;\n") == GENERATED
+    assert classify_file("main.py", b'print("hello world")\n' * 50) is None
+
+
+def test_hand_written_files_are_not_generated():
+    # the markers only count at the start of a comment, not wherever they're mentioned
+    assert classify_file("CONTRIBUTING.md", b"Files marked DO NOT EDIT are auto-generated, see make gen.\n") is None
+    assert classify_file("gen.py", b'"""Adds an @generated header."""\n# DO NOT EDIT the list below by hand\n') is None
+    assert classify_file("test_gen.py", b'def test():\n    check(b"// Code generated by x. DO NOT EDIT.")\n') is None
+    # long lines are normal outside of minifiable file types
+    assert classify_file("README.md", (b"A paragraph written on a single line. " * 40 + b"\n\n") * 4) is None
+    assert classify_file("fixtures.jsonl", (b'{"text": "' + b"x" * 1_500 + b'"}\n') * 4) is None
+    assert classify_file("data.csv", b"id," + b",".join(b"col%d" % i for i in range(400)) + b"\n") is None
+
+
+def test_lockfile_summary_counts_packages():
+    patch = (
+        b"@@ -10,7 +10,7 @@\n"
+        b' name = "requests"\n'
+        b'-version = "2.31.0"\n'
+        b'+version = "2.32.3"\n'
+        b"@@ -40,6 +40,12 @@\n"
+        b'+name = "idna"\n'
+        b'+version = "3.7"\n'
+    )
+    assert summarize(LOCKFILE, "modified", patch) == "lockfile: 1 packages bumped, 1 added"
+
+
+def test_binary_summary_sizes():
+    assert summarize(BINARY, "modified", old_size=2_300_000, new_size=2_400_000) == "binary: 2.3 MB -> 2.4 MB"
+    assert summarize(BINARY, "added", new_size=512) == "binary: added, 512 B"
+    assert format_size(None) == "unknown size"
+
+
+def test_classified_files_are_summarized_in_prompt(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    (root_dir / "uv.lock").write_text('[[package]]\nname = "requests"\nversion = "2.31.0"\n')
+    (root_dir / "logo.png").write_bytes(b"\x89PNG\r\n\x1a\n" + b"\0" * 2_000)
+    new_repo.index.add(["README.md", "uv.lock", "logo.png"])
+    new_repo.index.commit("Initial commit")
+
+    (root_dir / "uv.lock").write_text('[[package]]\nname = "requests"\nversion = "2.32.3"\n')
+    (root_dir / "logo.png").write_bytes(b"\x89PNG\r\n\x1a\n" + b"\0" * 3_000)
+    (root_dir / "app.min.js").write_text("!function(){" + "var a=1;" * 500 + "}();")
+    new_repo.index.add(["uv.lock", "logo.png", "app.min.js"])
+
+    diffs = diffweave.repo.generate_diffs_with_context(new_repo)
+    assert "lockfile: 1 packages bumped" in diffs
+    assert "binary: 2.0 KB -> 3.0 KB" in diffs
+    assert "generated: added" in diffs
+    assert "var a=1;" not in diffs
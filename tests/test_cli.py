@@ -1,6 +1,9 @@
 from pathlib import Path
+import subprocess
+import sys
 
 import git
+import openai
 import yaml
 import pytest
 
@@ -52,11 +55,11 @@ def test_commit(capsys, new_repo: git.Repo, valid_config: Path):
 
 def test_commit_non_interactive(capsys, new_repo: git.Repo, valid_config: Path, mocker):
     new_repo.index.add(["README.md", "main.py", "test/__init__.py"])
-    mock_run_cmd = mocker.patch("diffweave.cli.run_cmd", return_value=("output", ""))
+    mock_run_command = mocker.patch("diffweave.cli.run_command", return_value=("output", ""))
     app("--non-interactive", result_action="return_value")
-    calls = [str(c) for c in mock_run_cmd.call_args_list]
-    assert any("git commit" in c for c in calls)
-    assert any("git push" in c for c in calls)
+    commands = [c.args[0] for c in mock_run_command.call_args_list]
+    assert any(argv[:2] == ["git", "commit"] for argv in commands)
+    assert ["git", "push"] in commands
 
 
 def test_pr_command(capsys, new_repo: git.Repo, valid_config: Path, mocker):
@@ -70,6 +73,19 @@ def test_pr_command(capsys, new_repo: git.Repo, valid_config: Path, mocker):
     assert "Generated PR description" in capsys.readouterr().out
 
 
+def test_pr_incremental(capsys, new_repo: git.Repo, valid_config: Path, mocker):
+    new_repo.index.add(["README.md"])
+    new_repo.index.commit("Initial commit")
+    new_repo.index.add(["main.py"])
+    new_repo.index.commit("Second commit")
+    mocker.patch("rich.console.Console.input", new=lambda self, *args, **kwargs: "")
+    mocker.patch("copykitten.copy")
+    app(["pr", "--branch", "HEAD~1", "--incremental"], result_action="return_value")
+    output = capsys.readouterr().out
+    assert "1 commit(s) on this branch, 1 not summarized yet" in output
+    assert "Generated PR description" in output
+
+
 def test_set_databricks_browser_model(capsys, config_file: Path, monkeypatch):
     monkeypatch.setattr("diffweave.ai.CONFIG_FILE", config_file)
     app(
@@ -81,3 +97,38 @@ def test_set_databricks_browser_model(capsys, config_file: Path, monkeypatch):
     assert data["type"] == "databricks"
     assert data["model_name"] == "databricks-llama"
     assert data["account"] == "my-account"
+
+
+def test_dry_run_then_commit_reuses_response(capsys, new_repo: git.Repo, valid_config: Path, mocker, isolated_cache):
+    new_repo.index.add(["README.md", "main.py"])
+    mocker.patch("diffweave.cli.run_command", return_value=("status", ""))
+    app("--dry-run", result_action="return_value")
+    app("--non-interactive", result_action="return_value")
+    assert openai.AsyncOpenAI.return_value.chat.completions.create.call_count == 1
+
+    app("cache clear", result_action="return_value")
+    assert "Removed 1 cached response(s)" in capsys.readouterr().out
+    assert not list(isolated_cache.iterdir())
+
+
+# imported by commands that need them, but never just to print help
+HEAVY_DEPENDENCIES = {"openai", "git", "beaupy", "copykitten", "yaml", "dateutil", "httpx"}
+
+
+@pytest.mark.parametrize(
+    "argv", [["--help"], ["pr", "--help"], ["set-token-model", "--help"], ["daemon", "start", "--help"]]
+)
+def test_help_imports_no_heavy_dependencies(argv):
+    # run in a fresh interpreter, since this one has imported everything already
+    script = f"""
+import contextlib, io, sys
+from diffweave import app
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        app({argv!r})
+    except SystemExit:
+        pass
+print(sorted(m for m in sys.modules if m.split(".")[0] in {sorted(HEAVY_DEPENDENCIES)!r}))
+"""
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
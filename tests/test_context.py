@@ -0,0 +1,88 @@
+from pathlib import Path
+
+import git
+
+import diffweave
+from diffweave.context import changed_line_ranges, extract_context
+
+PYTHON_SOURCE = "".join(
+    [
+        "import os\n",
+        "\n",
+        *(f"def helper_{i}():\n    a = {i}\n    b = a * 2\n    return b\n\n\n" for i in range(20)),
+        "class Thing:\n",
+        "    @property\n",
+        "    def value(self):\n",
+        "        return 1\n",
+    ]
+)
+
+JS_SOURCE = "".join(
+    f"export function handler{i}(event) {{\n  const x = {i};\n  return x + 1;\n}}\n\n" for i in range(30)
+)
+
+
+def _diff_at(line: int, text: str = "+changed\n") -> str:
+    return f"@@ -{line},1 +{line},2 @@\n context\n{text}"
+
+
+def test_changed_line_ranges():
+    diff = "@@ -1,3 +1,4 @@\n keep\n-old\n+new\n+newer\n keep\n@@ -20,2 +21,1 @@\n keep\n-gone\n"
+    assert changed_line_ranges(diff) == [(2, 3), (22, 22)]
+
+
+def test_python_function_is_extracted():
+    # helper_6 spans lines 39-42
+    excerpt = extract_context("module.py", PYTHON_SOURCE, _diff_at(40))
+    assert excerpt.startswith("(lines 39-42)\ndef helper_6():")
+    assert "helper_5" not in excerpt
+    assert "helper_7" not in excerpt
+
+
+def test_python_decorators_are_included():
+    lines = PYTHON_SOURCE.splitlines()
+    value_line = lines.index("        return 1") + 1
+    excerpt = extract_context("module.py", PYTHON_SOURCE, _diff_at(value_line - 1))
+    assert "@property" in excerpt
+    assert "class Thing" not in excerpt
+
+
+def test_other_languages_use_indentation():
+    excerpt = extract_context("handlers.js", JS_SOURCE, _diff_at(11))
+    assert "export function handler2(event) {" in excerpt
+    assert excerpt.rstrip().endswith("}")
+    assert "handler1(" not in excerpt
+    assert "handler3(" not in excerpt
+
+
+def test_falls_back_to_line_window():
+    source = "".join(f"value_{i} = {i}\n" for i in range(200))
+    excerpt = extract_context("settings.py", source, _diff_at(100))
+    assert excerpt.startswith("(lines 86-116)")
+
+
+def test_whole_file_when_most_of_it_changed():
+    source = "def f():\n    return 1\n"
+    assert extract_context("small.py", source, _diff_at(1)) == source
+
+
+def test_context_modes(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    source = "".join(
+        f"def helper_{i}():\n" + "".join(f"    a_{j} = {i * j}\n" for j in range(20)) + "\n\n" for i in range(20)
+    )
+    (root_dir / "module.py").write_text(source)
+    diffweave.run_cmd("git add -A")
+    new_repo.index.commit("Initial commit")
+    (root_dir / "module.py").write_text(source.replace("a_10 = 60\n", "a_10 = 600\n"))
+    diffweave.run_cmd("git add -A")
+
+    full = diffweave.repo.generate_diffs_with_context(new_repo, context_mode="full")
+    scoped = diffweave.repo.generate_diffs_with_context(new_repo, context_mode="scoped")
+    diff_only = diffweave.repo.generate_diffs_with_context(new_repo, context_mode="diff-only")
+
+    assert "----- Contents -----" in full and "helper_19" in full
+    assert "----- Enclosing Code -----" in scoped and "def helper_6" in scoped
+    assert "helper_19" not in scoped
+    assert "-----" in diff_only and "Contents" not in diff_only and "Enclosing Code" not in diff_only
+    assert len(diff_only) < len(scoped) < len(full)
@@ -0,0 +1,108 @@
+import os
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+import git
+import openai
+import pytest
+import yaml
+
+from diffweave import app, daemon
+
+
+def test_not_running(tmp_path):
+    assert not daemon.is_running(tmp_path / "missing.sock")
+    with pytest.raises(ConnectionError):
+        daemon.request({"command": "status"}, socket_path=tmp_path / "missing.sock")
+
+
+def test_status_and_stop(daemon_socket: Path):
+    status = daemon.request({"command": "status"})
+    assert status["models"] == []
+    assert status["requests"] == 1
+    assert daemon_socket.stat().st_mode & 0o777 == 0o600
+
+    assert daemon.request({"command": "stop"}) == {"stopped": True}
+    deadline = time.monotonic() + 5
+    while daemon_socket.exists():
+        assert time.monotonic() < deadline, "daemon did not stop"
+        time.sleep(0.01)
+
+
+def test_idle_timeout(tmp_path):
+    socket_path = tmp_path / "daemon.sock"
+    thread = threading.Thread(target=daemon.serve, kwargs={"idle_timeout": 0.1, "socket_path": socket_path})
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert not socket_path.exists()
+
+
+def test_commit_streams_and_keeps_model_warm(daemon_socket: Path, new_repo: git.Repo, valid_config: Path):
+    new_repo.index.add(["README.md", "main.py"])
+    payload = {"command": "commit", "cwd": str(Path.cwd()), "repo_status": "status", "use_cache": False}
+
+    tokens = []
+    reply = daemon.request(payload, on_token=tokens.append)
+    assert reply == {"message": "feat: mocked commit message", "model": "gpt-4o"}
+    assert len(tokens) > 1
+    assert "".join(tokens) == reply["message"]
+
+    daemon.request(payload)
+    assert openai.AsyncOpenAI.call_count == 1
+    assert openai.AsyncOpenAI.return_value.chat.completions.create.call_count == 2
+
+    # a new configuration takes effect without restarting the daemon
+    valid_config.write_text(yaml.safe_dump({**yaml.safe_load(valid_config.read_text()), "model_name": "gpt-5"}))
+    assert daemon.request(payload)["model"] == "gpt-5"
+    assert openai.AsyncOpenAI.call_count == 2
+
+
+def test_commit_nothing_staged(daemon_socket: Path, new_repo: git.Repo, valid_config: Path):
+    reply = daemon.request({"command": "commit", "cwd": str(Path.cwd()), "repo_status": "status"})
+    assert reply == {"empty": True}
+
+
+def test_commit_from_another_index(daemon_socket: Path, new_repo: git.Repo, valid_config: Path, tmp_path):
+    # what `git commit -a` does before running the commit hooks
+    index_file = tmp_path / "next-index"
+    subprocess.run(["git", "add", "README.md"], env={**os.environ, "GIT_INDEX_FILE": str(index_file)}, check=True)
+    cwd = Path.cwd()
+    payload = {"command": "commit", "cwd": str(cwd), "repo_status": "status"}
+
+    assert daemon.request(payload) == {"empty": True}
+    os.chdir(tmp_path)
+    assert "message" in daemon.request({**payload, "index_file": str(index_file)})
+    assert "GIT_INDEX_FILE" not in os.environ
+    # the daemon runs in this process here, so its requests must leave the working directory alone
+    assert Path.cwd() == tmp_path
+
+
+def test_errors_are_replied(daemon_socket: Path, tmp_path):
+    reply = daemon.request({"command": "commit", "cwd": str(tmp_path / "missing"), "repo_status": ""})
+    assert "error" in reply
+    assert daemon.request({"command": "status"})["requests"] == 2
+
+
+def test_cli_commit_with_daemon(capsys, daemon_socket: Path, new_repo: git.Repo, valid_config: Path, mocker):
+    new_repo.index.add(["README.md", "main.py"])
+    mock_run_command = mocker.patch("diffweave.cli.run_command", return_value=("output", ""))
+    app(["--non-interactive", "--daemon"], result_action="return_value")
+
+    stdout = capsys.readouterr().out
+    assert "(daemon)" in stdout
+    assert "Generated commit message" in stdout
+    commands = [c.args[0] for c in mock_run_command.call_args_list]
+    assert ["git", "commit", "-m", "feat: mocked commit message"] in commands
+    assert ["git", "push"] in commands
+
+
+def test_cli_falls_back_without_daemon(capsys, new_repo: git.Repo, valid_config: Path):
+    new_repo.index.add(["README.md", "main.py"])
+    app(["--dry-run", "--daemon"], result_action="return_value")
+
+    stdout = capsys.readouterr().out
+    assert "No daemon running" in stdout
+    assert "Generated commit message" in stdout
@@ -0,0 +1,170 @@
+import io
+import os
+import tracemalloc
+from pathlib import Path
+
+import git
+import pytest
+
+import diffweave
+from diffweave.diffstream import iter_staged_diffs, parse_diff_stream
+
+
+def _commit_all(repo: git.Repo, message: str = "Initial commit"):
+    diffweave.run_cmd("git add -A")
+    repo.index.commit(message)
+
+
+def test_streaming_staged_changes(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    _commit_all(new_repo)
+
+    (root_dir / "main.py").write_text('print("hello there")\n')
+    (root_dir / "new file.txt").write_text("with a space\n")
+    (root_dir / "ünïcode.md").write_text("fancy\n")
+    os.remove("README.md")
+    diffweave.run_cmd("git add -A")
+
+    records = {(r.a_path, r.b_path): r for r in iter_staged_diffs(root_dir)}
+
+    assert records[("main.py", "main.py")].change_type == "M"
+    assert b'+print("hello there")' in records[("main.py", "main.py")].diff
+    assert records[(None, "new file.txt")].new_file
+    assert records[(None, "ünïcode.md")].diff.startswith(b"@@")
+    assert records[("README.md", None)].deleted_file
+    assert len(records[("README.md", None)].a_blob_id) == 40
+
+
+def test_streaming_renames_and_quoted_paths(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    (root_dir / 'qu"ote.txt').write_text("\n".join(f"line {i}" for i in range(20)))
+    _commit_all(new_repo)
+
+    diffweave.run_cmd("git mv 'qu\"ote.txt' moved.txt")
+    records = list(iter_staged_diffs(root_dir))
+
+    assert len(records) == 1
+    assert records[0].renamed_file
+    assert records[0].a_path == 'qu"ote.txt'
+    assert records[0].b_path == "moved.txt"
+    assert records[0].similarity == 100
+
+
+def test_streaming_matches_gitpython(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    _commit_all(new_repo)
+    (root_dir / "main.py").write_text('print("hello there")\n')
+    (root_dir / "extra.py").write_text("x = 1\n")
+    diffweave.run_cmd("git add -A")
+
+    streamed = diffweave.repo.generate_diffs_with_valid_prior_commit(root_dir, iter_staged_diffs(root_dir))
+    gitpython = diffweave.repo.generate_diffs_with_valid_prior_commit(
+        root_dir, new_repo.head.commit.diff(git.IndexFile.Index, create_patch=True)
+    )
+    assert streamed == gitpython
+
+
+def test_empty_diff_stream():
+    assert list(parse_diff_stream(io.BufferedReader(io.BytesIO(b"")))) == []
+
+
+def test_binary_files_keep_marker():
+    raw = (
+        b":000000 100644 " + b"0" * 40 + b" " + b"a" * 40 + b" A\0image.png\0\0"
+        b"diff --git a/image.png b/image.png\n"
+        b"new file mode 100644\n"
+        b"index 0000000..aaaaaaa\n"
+        b"Binary files /dev/null and b/image.png differ\n"
+    )
+    (record,) = parse_diff_stream(io.BufferedReader(io.BytesIO(raw)))
+    assert record.b_path == "image.png"
+    assert record.diff == b"Binary files /dev/null and b/image.png differ\n"
+
+
+def test_records_are_released_once_yielded():
+    num_files = 20
+    patch = b"@@ -0,0 +1,10000 @@\n" + b"".join(b"+line %05d of a long file\n" % i for i in range(10_000))
+    raw = (
+        b"".join(b":000000 100644 " + b"0" * 40 + b" " + b"a" * 40 + b" A\0file_%d.txt\0" % n for n in range(num_files))
+        + b"\0"
+    )
+    raw += b"".join(b"diff --git a/file_%d.txt b/file_%d.txt\n" % (n, n) + patch for n in range(num_files))
+
+    tracemalloc.start()
+    try:
+        sizes = [len(record.diff) for record in parse_diff_stream(io.BufferedReader(io.BytesIO(raw)))]
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert sizes == [len(patch)] * num_files
+    # patches are let go of as the caller moves on, so the peak is nowhere near every patch at once
+    assert peak < num_files * len(patch) / 2
+
+
+def test_falls_back_to_gitpython(new_repo: git.Repo, mocker):
+    root_dir = Path(new_repo.working_dir)
+    _commit_all(new_repo)
+    (root_dir / "main.py").write_text('print("hello there")\n')
+    diffweave.run_cmd("git add -A")
+
+    mocker.patch("diffweave.diffstream.iter_diffs", side_effect=FileNotFoundError("git"))
+    diffs = diffweave.repo.generate_diffs_with_context(new_repo)
+    assert "hello there" in diffs
+
+    new_repo.index.commit("Say hello there")
+    _, diffs = diffweave.repo.generate_diffs_for_pull_request(new_repo, "HEAD~1")
+    assert "hello there" in diffs
+
+
+def test_streaming_typechange(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    _commit_all(new_repo)
+
+    # a file replaced by a symlink has one raw entry but two patches
+    os.remove("README.md")
+    os.symlink("main.py", "README.md")
+    (root_dir / "main.py").write_text('print("hello there")\n')
+    diffweave.run_cmd("git add -A")
+
+    records = {r.b_path: r for r in iter_staged_diffs(root_dir)}
+    assert records.keys() == {"README.md", "main.py"}
+    assert records["README.md"].change_type == "T"
+    assert b"+main.py" in records["README.md"].diff
+    assert records["README.md"].additions == 1
+    assert b'+print("hello there")' in records["main.py"].diff
+
+    diffs = diffweave.repo.generate_diffs_with_context(new_repo)
+    assert "hello there" in diffs
+
+
+def test_streaming_paths_git_quotes(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    (root_dir / "new\nline.txt").write_text("first\n")
+    (root_dir / "tab\there.txt").write_text("second\n")
+    new_repo.git.add(A=True)
+
+    records = {r.b_path: r for r in iter_staged_diffs(root_dir)}
+    assert b"+first" in records["new\nline.txt"].diff
+    assert b"+second" in records["tab\there.txt"].diff
+
+
+def test_patch_without_raw_entry():
+    raw = (
+        b":000000 100644 " + b"0" * 40 + b" " + b"a" * 40 + b" A\0one.txt\0\0"
+        b"diff --git a/two.txt b/two.txt\n"
+        b"@@ -0,0 +1 @@\n"
+        b"+two\n"
+    )
+    with pytest.raises(ValueError):
+        list(parse_diff_stream(io.BufferedReader(io.BytesIO(raw))))
+
+
+def test_unparseable_stream_falls_back_to_gitpython(new_repo: git.Repo, mocker):
+    root_dir = Path(new_repo.working_dir)
+    _commit_all(new_repo)
+    (root_dir / "main.py").write_text('print("hello there")\n')
+    diffweave.run_cmd("git add -A")
+
+    mocker.patch("diffweave.diffstream.parse_diff_stream", side_effect=ValueError("unexpected patch"))
+    assert "hello there" in diffweave.repo.generate_diffs_with_context(new_repo)
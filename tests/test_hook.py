@@ -0,0 +1,156 @@
+import asyncio
+import os
+import pathlib
+import subprocess
+import threading
+
+import git
+import openai
+import pytest
+
+from diffweave import ai, hook, speculate
+
+TEMPLATE = "\n# Please enter the commit message for your changes.\n"
+
+
+@pytest.fixture()
+def message_file(new_repo: git.Repo) -> pathlib.Path:
+    path = pathlib.Path(new_repo.git_dir) / "COMMIT_EDITMSG"
+    path.write_text(TEMPLATE)
+    return path
+
+
+def test_install_and_uninstall(new_repo: git.Repo):
+    root = pathlib.Path(new_repo.working_dir)
+    path = hook.install(root, deadline=2.5, simple=True)
+    assert path == pathlib.Path(new_repo.git_dir).resolve() / "hooks" / "prepare-commit-msg"
+    script = path.read_text()
+    assert hook.HOOK_MARKER in script
+    assert "--deadline 2.5 --simple" in script
+    assert os.access(path, os.X_OK)
+
+    # reinstalling over our own hook is fine
+    hook.install(root)
+    assert hook.uninstall(root)
+    assert not path.exists()
+    assert not hook.uninstall(root)
+
+
+def test_install_keeps_other_hooks(new_repo: git.Repo):
+    root = pathlib.Path(new_repo.working_dir)
+    path = hook.hook_path(root)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("#!/bin/sh\necho custom\n")
+
+    with pytest.raises(FileExistsError):
+        hook.install(root)
+    assert not hook.uninstall(root)
+    assert path.read_text() == "#!/bin/sh\necho custom\n"
+
+    hook.install(root, force=True)
+    assert hook.HOOK_MARKER in path.read_text()
+
+
+def test_skips_messages_given_on_the_command_line(message_file: pathlib.Path, valid_config: pathlib.Path):
+    result = hook.run(message_file, "message")
+    assert result.outcome == "skipped"
+    assert message_file.read_text() == TEMPLATE
+    assert openai.AsyncOpenAI.call_count == 0
+
+
+def test_generates_message(new_repo: git.Repo, message_file: pathlib.Path, valid_config: pathlib.Path):
+    new_repo.index.add(["README.md", "main.py"])
+    result = hook.run(message_file)
+
+    assert result.outcome == "generated"
+    assert message_file.read_text() == f"feat: mocked commit message\n{TEMPLATE}"
+    phases = [name for name, _ in result.phases]
+    assert phases == ["config", "imports", "lookup", "status", "client", "diffs", "generate"]
+    assert "generated in" in hook.LOG_FILE.read_text()
+
+    # stored, so an aborted and retried commit doesn't wait for the model again
+    message_file.write_text(TEMPLATE)
+    assert hook.run(message_file).outcome == "pregenerated"
+    assert openai.AsyncOpenAI.return_value.chat.completions.create.call_count == 1
+
+
+def test_uses_pregenerated_message(
+    new_repo: git.Repo, message_file: pathlib.Path, valid_config: pathlib.Path, completion_stream
+):
+    new_repo.index.add(["README.md", "main.py"])
+    create = openai.AsyncOpenAI.return_value.chat.completions.create
+    create.side_effect = lambda **_: completion_stream("feat: pregenerated message")
+    speculate.pregenerate(new_repo, ai.LLM())
+
+    result = hook.run(message_file)
+    assert result.outcome == "pregenerated"
+    assert message_file.read_text().startswith("feat: pregenerated message\n")
+    assert "client" not in [name for name, _ in result.phases]
+
+
+def test_deadline(new_repo: git.Repo, message_file: pathlib.Path, valid_config: pathlib.Path):
+    new_repo.index.add(["README.md", "main.py"])
+    release = threading.Event()
+
+    async def slow_model(**_):
+        await asyncio.to_thread(release.wait, 10)
+        raise openai.APITimeoutError(request=None)
+
+    openai.AsyncOpenAI.return_value.chat.completions.create.side_effect = slow_model
+    try:
+        result = hook.run(message_file, deadline=0.5)
+    finally:
+        release.set()
+
+    assert result.timed_out
+    assert result.detail == "during generate"
+    assert result.elapsed < 2
+    assert message_file.read_text() == TEMPLATE
+    assert "timeout during generate" in hook.LOG_FILE.read_text()
+
+
+def test_output_after_the_deadline_stays_out_of_gits_output(
+    capsys, new_repo: git.Repo, message_file: pathlib.Path, valid_config: pathlib.Path
+):
+    new_repo.index.add(["README.md", "main.py"])
+    release = threading.Event()
+    printed = threading.Event()
+
+    async def slow_model(**_):
+        await asyncio.to_thread(release.wait, 10)
+        print("printed by the abandoned generation")
+        printed.set()
+        raise openai.APITimeoutError(request=None)
+
+    openai.AsyncOpenAI.return_value.chat.completions.create.side_effect = slow_model
+    try:
+        assert hook.run(message_file, deadline=0.5).timed_out
+    finally:
+        release.set()
+    assert printed.wait(5)
+
+    print("printed by the hook")
+    stdout = capsys.readouterr().out
+    assert "printed by the hook" in stdout
+    assert "abandoned generation" not in stdout
+    assert "Analyzing file" not in stdout
+
+
+def test_errors_leave_template(message_file: pathlib.Path, config_file: pathlib.Path, monkeypatch):
+    monkeypatch.setattr("diffweave.ai.CONFIG_FILE", config_file)
+    result = hook.run(message_file)
+    assert result.outcome == "error"
+    assert message_file.read_text() == TEMPLATE
+
+
+def test_uses_daemon_with_commit_index(
+    daemon_socket: pathlib.Path, new_repo: git.Repo, message_file: pathlib.Path, valid_config: pathlib.Path, monkeypatch
+):
+    # `git commit -a` stages into a temporary index; the repository's own index has nothing staged
+    index_file = pathlib.Path(new_repo.git_dir) / "index.lock"
+    subprocess.run(["git", "add", "README.md"], env={**os.environ, "GIT_INDEX_FILE": str(index_file)}, check=True)
+    monkeypatch.setenv("GIT_INDEX_FILE", str(index_file))
+
+    result = hook.run(message_file)
+    assert result.outcome == "daemon"
+    assert message_file.read_text().startswith("feat: mocked commit message\n")
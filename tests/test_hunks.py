@@ -0,0 +1,55 @@
+from diffweave.hunks import parse_hunks, reduce_diff
+
+
+def _hunk(start: int, added: int, context: int = 2) -> str:
+    lines = [f" context {start + i}\n" for i in range(context)]
+    lines += [f"+added {start}.{i}\n" for i in range(added)]
+    return f"@@ -{start},{context} +{start},{context + added} @@ def func_{start}():\n" + "".join(lines)
+
+
+def test_small_diffs_are_unchanged():
+    diff = _hunk(1, 3) + _hunk(50, 2)
+    assert reduce_diff(diff, 10_000) == diff
+
+
+def test_parse_hunks():
+    preamble, hunks = parse_hunks("Binary-ish preamble\n" + _hunk(1, 3) + "-removed\n" + _hunk(50, 2))
+    assert preamble == "Binary-ish preamble\n"
+    assert [(h.additions, h.deletions) for h in hunks] == [(3, 1), (2, 0)]
+    assert hunks[1].header.startswith("@@ -50,2 +50,4 @@")
+
+
+def test_every_header_is_kept_and_big_hunks_win():
+    diff = _hunk(1, 5) + _hunk(100, 200) + _hunk(500, 3) + _hunk(900, 4)
+    reduced = reduce_diff(diff, len(_hunk(100, 200)) + 500)
+
+    assert len(reduced) <= len(_hunk(100, 200)) + 500
+    assert reduced.count("@@ -") == 4
+    # the most changed hunk is kept whole
+    assert _hunk(100, 200) in reduced
+    assert "... 7 lines (+5 -0) omitted ..." in reduced or _hunk(1, 5) in reduced
+
+
+def test_no_newline_marker_is_not_counted_as_a_line():
+    diff = "@@ -1 +1 @@\n-old\n\\ No newline at end of file\n+new\n\\ No newline at end of file\n"
+    _, (hunk,) = parse_hunks(diff)
+    assert hunk.render_stub().endswith("... 2 lines (+1 -1) omitted ...\n")
+    head = hunk.header + "-old\n\\ No newline at end of file\n" + "... 1 more lines omitted ...\n"
+    assert hunk.render_head(len(head)) == head
+
+
+def test_leftover_space_goes_to_the_start_of_a_hunk():
+    diff = _hunk(1, 1000)
+    reduced = reduce_diff(diff, 2_000)
+    assert len(reduced) <= 2_000
+    assert reduced.startswith("@@ -1,2 +1,1002 @@")
+    assert "+added 1.0\n" in reduced
+    assert "more lines omitted" in reduced
+
+
+def test_too_many_hunks_are_folded():
+    diff = "".join(_hunk(i * 10, 2) for i in range(200))
+    reduced = reduce_diff(diff, 1_000)
+    assert len(reduced) <= 1_000
+    assert reduced.startswith("@@ -0,2 +0,4 @@")
+    assert "more hunks (+" in reduced
@@ -0,0 +1,85 @@
+from pathlib import Path
+
+import git
+import yaml
+
+import diffweave
+from diffweave.ignore import IgnoreRules
+
+
+def test_gitignore_semantics():
+    rules = IgnoreRules(
+        [
+            "# vendored code",
+            "vendor/",
+            "*.snap",
+            "!keep.snap",
+            "/build",
+            "docs/**/generated",
+            "",
+        ]
+    )
+    assert rules.matches("vendor/lib/module.py")
+    assert rules.matches("src/vendor/lib.py")
+    assert not rules.matches("vendor")  # directory-only pattern, and this is a file
+    assert rules.matches("tests/__snapshots__/test_ui.snap")
+    assert not rules.matches("tests/__snapshots__/keep.snap")
+    assert rules.matches("build/output.txt")
+    assert not rules.matches("src/build/output.txt")
+    assert rules.matches("docs/api/v1/generated/index.md")
+    assert rules.matches("docs/generated/index.md")
+    assert not rules.matches("src/main.py")
+
+
+def test_files_inside_ignored_directories_stay_ignored():
+    rules = IgnoreRules(["fixtures/", "!fixtures/important.json"])
+    assert rules.matches("fixtures/important.json")
+
+
+def test_empty_rules_match_nothing():
+    rules = IgnoreRules(["", "# just a comment"])
+    assert not rules
+    assert not rules.matches("anything.py")
+
+
+def test_character_classes_and_escapes():
+    rules = IgnoreRules(["data[0-9].csv", "\\#notes.txt", "file?.log"])
+    assert rules.matches("data3.csv")
+    assert not rules.matches("dataX.csv")
+    assert rules.matches("#notes.txt")
+    assert rules.matches("file1.log")
+    assert not rules.matches("file10.log")
+
+
+def test_ignored_files_are_never_read(new_repo: git.Repo, mocker, monkeypatch, config_file):
+    monkeypatch.setattr("diffweave.ai.CONFIG_FILE", config_file)
+    config_file.write_text(yaml.safe_dump({"summarize": ["*.snap"]}))
+    root_dir = Path(new_repo.working_dir)
+    (root_dir / ".diffweaveignore").write_text("vendor/\n")
+    new_repo.index.add(["README.md", ".diffweaveignore"])
+    new_repo.index.commit("Initial commit")
+
+    (root_dir / "vendor").mkdir()
+    (root_dir / "vendor" / "lib.py").write_text("VENDORED = True\n")
+    (root_dir / "ui.snap").write_text("snapshot contents\n")
+    (root_dir / "main.py").write_text('print("hello there")\n')
+    new_repo.index.add(["vendor/lib.py", "ui.snap", "main.py"])
+
+    load_file = mocker.spy(diffweave.blobs, "load_file")
+    diffs = diffweave.repo.generate_diffs_with_context(new_repo)
+
+    assert "vendor/lib.py" not in diffs
+    assert "VENDORED" not in diffs
+    assert "summarized by config: added, +1 -0 lines" in diffs
+    assert "snapshot contents" not in diffs
+    assert "hello there" in diffs
+    assert all(call.args[0].name != "lib.py" for call in load_file.call_args_list)
+
+
+def test_configuring_model_keeps_ignore_settings(config_file, monkeypatch):
+    monkeypatch.setattr("diffweave.ai.CONFIG_FILE", config_file)
+    config_file.write_text(yaml.safe_dump({"ignore": ["vendor/"], "model_name": "old"}))
+    diffweave.ai.configure_token_model("new", "https://api.example.com", "token")
+    config = yaml.safe_load(config_file.read_text())
+    assert config["ignore"] == ["vendor/"]
+    assert config["model_name"] == "new"
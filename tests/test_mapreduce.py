@@ -0,0 +1,86 @@
+import asyncio
+from pathlib import Path
+
+import git
+
+import diffweave
+from diffweave import mapreduce
+from diffweave.prompt import FileDiff
+
+
+def _file_diff(i: int, lines: int) -> FileDiff:
+    diff = f"@@ -0,0 +1,{lines} @@\n" + "".join(f"+value_{j} = {j}\n" for j in range(lines))
+    return FileDiff(path=f"module_{i}.py", change_type="added", diff=diff, additions=lines)
+
+
+def test_groups_fit_the_budget():
+    file_diffs = [_file_diff(i, 40) for i in range(10)] + [_file_diff(10, 2_000)] + [_file_diff(11, 5)]
+    groups = mapreduce.group_file_diffs(file_diffs, group_budget=1_000)
+
+    assert [fd.path for group in groups for fd in group] == [fd.path for fd in file_diffs]
+    assert len(groups[0]) > 1
+    # too big for any group, so it gets one of its own
+    assert [fd.path for fd in groups[-2]] == ["module_10.py"]
+
+
+def test_huge_changeset_is_summarized_in_groups(new_repo: git.Repo, valid_config: Path, mocker, capsys):
+    root_dir = Path(new_repo.working_dir)
+    diffweave.run_cmd("git add -A")
+    new_repo.index.commit("Initial commit")
+    for i in range(40):
+        (root_dir / f"module_{i}.py").write_text("".join(f"value_{j} = {j}\n" for j in range(100 + i)))
+    diffweave.run_cmd("git add -A")
+
+    in_flight = 0
+    most_in_flight = 0
+    group_prompts = []
+
+    async def query_model(self, prompt, on_token=None, temperature=None, system_prompt=None):
+        nonlocal in_flight, most_in_flight
+        assert system_prompt == diffweave.ai.load_system_prompt("summarize")
+        in_flight += 1
+        most_in_flight = max(most_in_flight, in_flight)
+        group_prompts.append(prompt[0])
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return f"- summary {len(group_prompts)}"
+
+    mocker.patch.object(diffweave.ai.LLM, "query_model", new=query_model)
+    llm = diffweave.ai.LLM()
+    diffs = diffweave.repo.generate_diffs_with_context(new_repo, token_budget=5_000, verbose=True, llm=llm)
+
+    assert "Plan: map-reduce" in capsys.readouterr().out
+    assert 1 < len(group_prompts) <= 40
+    assert 1 < most_in_flight <= mapreduce.MAP_CONCURRENCY
+    # every file's diff reaches the model in exactly one group
+    for i in range(40):
+        assert sum(f"./module_{i}.py\n" in p for p in group_prompts) == 1
+    assert "summarized in" in diffs
+    assert diffs.count("- summary ") == len(group_prompts)
+    assert "./module_39.py" in diffs
+
+
+def test_prompts_are_built_as_requests_free_up(valid_config: Path, mocker):
+    built = 0
+    answered = 0
+    most_outstanding = 0
+
+    async def query_model(self, prompt, on_token=None, temperature=None, system_prompt=None):
+        nonlocal answered
+        await asyncio.sleep(0.01)
+        answered += 1
+        return f"summary of {prompt[0]}"
+
+    def prompts():
+        nonlocal built, most_outstanding
+        for i in range(20):
+            built += 1
+            most_outstanding = max(most_outstanding, built - answered)
+            yield f"part {i}"
+
+    mocker.patch.object(diffweave.ai.LLM, "query_model", new=query_model)
+    summaries = mapreduce.summarize_prompts(diffweave.ai.LLM(), prompts(), concurrency=3)
+
+    assert summaries == [f"summary of part {i}" for i in range(20)]
+    # a prompt is only built once there's a free slot to send it in, so no more than that are ever held
+    assert most_outstanding <= 3
@@ -0,0 +1,106 @@
+from pathlib import Path
+
+import git
+
+import diffweave
+from diffweave.plan import FileStat, choose_plan, measure, parse_numstat
+
+
+def test_parse_numstat():
+    output = b"3\t1\tmain.py\x00-\t-\timage.png\x000\t0\t\x00old name.py\x00new name.py\x00"
+    stats = parse_numstat(output)
+    assert [(s.path, s.old_path, s.additions, s.deletions, s.binary) for s in stats] == [
+        ("main.py", None, 3, 1, False),
+        ("image.png", None, 0, 0, True),
+        ("new name.py", "old name.py", 0, 0, False),
+    ]
+
+
+def test_strategy_grows_with_the_changeset():
+    budget = 60_000
+
+    def strategy(lines_per_file: int, files: int = 10, map_reduce: bool = True):
+        stats = [FileStat(path=f"f{i}.py", additions=lines_per_file) for i in range(files)]
+        return choose_plan(stats, budget, map_reduce=map_reduce)
+
+    assert strategy(50).strategy == "full"
+    assert strategy(200).strategy == "scoped"
+    plan = strategy(1_000)
+    assert plan.strategy == "summarized"
+    assert 0 < len(plan.summarize_paths) < 10
+
+    plan = strategy(1_000, files=100)
+    assert plan.strategy == "map-reduce"
+    assert plan.context_mode == "diff-only"
+    assert not plan.summarize_paths
+
+    # without a model to summarize with, files are summarized from their line counts instead
+    plan = strategy(1_000, files=100, map_reduce=False)
+    assert plan.strategy == "summarized"
+    assert 0 < len(plan.summarize_paths) < 100
+
+
+def test_summarized_files_are_never_read(new_repo: git.Repo, mocker, capsys):
+    root_dir = Path(new_repo.working_dir)
+    diffweave.run_cmd("git add -A")
+    new_repo.index.commit("Initial commit")
+    for i in range(40):
+        (root_dir / f"module_{i}.py").write_text("".join(f"value_{j} = {j}\n" for j in range(100 + i)))
+    diffweave.run_cmd("git add -A")
+    stats = measure(root_dir, "--cached")
+    assert len(stats) == 40
+    assert stats[0].additions == 100
+
+    write_requests = mocker.spy(diffweave.blobs, "_write_requests")
+    diffs = diffweave.repo.generate_diffs_with_context(new_repo, token_budget=5_000, verbose=True)
+
+    assert "Plan: summarized" in capsys.readouterr().out
+    # the biggest files are the ones left out
+    assert "summarized to fit the prompt budget: added, +139 -0 lines" in diffs
+    assert "summarized to fit the prompt budget: added, +100 -0 lines" not in diffs
+    blobs_read = [
+        name for call in write_requests.call_args_list if call.args[0].args[-1] == "--batch" for name in call.args[1]
+    ]
+    assert 0 < len(blobs_read) < 10
+
+
+def test_small_files_are_fitted_first():
+    stats = [FileStat(path="huge_a.py", additions=10_000), FileStat(path="huge_b.py", additions=10_000)]
+    stats += [FileStat(path=f"f{i}.py", additions=1) for i in range(5)]
+    plan = choose_plan(stats, 60_000)
+    assert plan.strategy == "summarized"
+    # the small files keep their diffs, one huge file is cut down to what's left, the other summarized
+    assert plan.summarize_paths == {"huge_b.py"}
+
+
+def test_summary_only_files_take_no_budget():
+    stats = [FileStat(path="package-lock.json", additions=40_000, deletions=40_000, summary_only=True)]
+    stats += [FileStat(path=f"f{i}.py", additions=1) for i in range(5)]
+    plan = choose_plan(stats, 60_000)
+    assert plan.strategy == "full"
+    assert not plan.summarize_paths
+
+
+def test_lockfiles_and_ignored_files_dont_crowd_out_code(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    for i in range(5):
+        (root_dir / f"module_{i}.py").write_text(f"value = {i}\n")
+    (root_dir / "package-lock.json").write_text("{}\n")
+    (root_dir / "dump.sql").write_text("-- empty\n")
+    (root_dir / ".diffweaveignore").write_text("*.sql\n")
+    diffweave.run_cmd("git add -A")
+    new_repo.index.commit("Initial commit")
+
+    for i in range(5):
+        (root_dir / f"module_{i}.py").write_text(f"value = {i + 1}\n")
+    entries = ",\n".join(f'  "node_modules/pkg-{i}": {{"version": "1.0.{i}"}}' for i in range(8_000))
+    (root_dir / "package-lock.json").write_text(f"{{\n{entries}\n}}\n")
+    (root_dir / "dump.sql").write_text("".join(f"INSERT INTO t VALUES ({i});\n" for i in range(8_000)))
+    diffweave.run_cmd("git add -A")
+
+    diffs = diffweave.repo.generate_diffs_with_context(new_repo, token_budget=20_000)
+    for i in range(5):
+        assert f"+value = {i + 1}" in diffs
+    assert "summarized to fit the prompt budget" not in diffs
+    assert "lockfile:" in diffs
+    assert "INSERT INTO" not in diffs
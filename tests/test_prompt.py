@@ -0,0 +1,106 @@
+import diffweave
+from diffweave.prompt import FileDiff, build_prompt, estimate_tokens
+
+
+def _file(path: str, lines: int, contents_lines: int = 50) -> FileDiff:
+    diff = f"@@ -1,1 +1,{lines} @@\n" + "".join(f"+line {i}\n" for i in range(lines))
+    contents = "".join(f"line {i}\n" for i in range(contents_lines))
+    return FileDiff(path=path, diff=diff, contents=contents, additions=lines)
+
+
+def test_everything_fits():
+    files = [_file("a.py", 5), _file("b.py", 10)]
+    rendered, report = build_prompt(files, token_budget=100_000)
+    assert report.full == ["a.py", "b.py"]
+    assert not report.truncated
+    assert "----- Contents -----" in rendered
+    assert rendered.index("a.py") < rendered.index("b.py")
+
+
+def test_prompt_always_fits_budget():
+    files = [_file(f"file_{i}.py", lines=i * 20, contents_lines=400) for i in range(60)]
+    for budget in [200, 1_000, 5_000, 20_000]:
+        rendered, report = build_prompt(files, token_budget=budget)
+        assert estimate_tokens(rendered) <= budget
+        assert report.tokens_used <= budget
+
+
+def test_most_changed_files_get_the_budget():
+    files = [_file("small.py", 2, 400), _file("huge.py", 200, 400), _file("medium.py", 20, 400)]
+    huge_diff_only = estimate_tokens(diffweave.prompt.render_file(files[1], include_contents=False))
+    rendered, report = build_prompt(files, token_budget=huge_diff_only + 200)
+    assert "huge.py" in report.diff_only
+    assert report.full == []
+    assert "+line 199" in rendered
+
+
+def test_dropped_files_are_reported():
+    files = [_file(f"file_{i}.py", lines=i + 1) for i in range(20)]
+    rendered, report = build_prompt(files, token_budget=150)
+    assert report.dropped
+    # the least changed files go first
+    assert "file_0.py" in report.dropped
+    assert "file_19.py" not in report.dropped
+    for path in report.dropped:
+        assert path not in rendered
+
+
+def test_count_changed_lines():
+    diff = "--- a/x\n+++ b/x\n@@ -1,2 +1,2 @@\n context\n-old\n+new\n+newer\n"
+    assert diffweave.prompt.count_changed_lines(diff) == (2, 1)
+
+
+def test_count_changed_lines_inside_hunks_that_look_like_headers():
+    # a removed SQL comment and an added line starting with "++ " look like file headers
+    diff = "--- a/x.sql\n+++ b/x.sql\n@@ -1,2 +1,2 @@\n select 1;\n--- old note\n+++ counter\n"
+    assert diffweave.prompt.count_changed_lines(diff) == (1, 1)
+
+
+def test_oversized_diff_is_shortened_not_summarized():
+    hunks = "".join(
+        f"@@ -{i * 100},1 +{i * 100},{i + 1} @@\n" + "".join(f"+hunk {i} line {j}\n" for j in range(i + 1))
+        for i in range(40)
+    )
+    files = [FileDiff(path="big.py", diff=hunks, contents="x\n" * 5_000, additions=820)]
+    rendered, report = build_prompt(files, token_budget=1_000)
+    assert report.reduced == ["big.py"]
+    assert report.truncated
+    assert estimate_tokens(rendered) <= 1_000
+    # the biggest hunk survives, and every hunk header is still there
+    assert "+hunk 39 line 39\n" in rendered
+    assert rendered.count("@@ -") == 40
+
+
+def test_added_file_is_sent_once():
+    contents = "".join(f"unique line {i}\n" for i in range(500))
+    diff = "@@ -0,0 +1,500 @@\n" + "".join(f"+unique line {i}\n" for i in range(500))
+    added = FileDiff(path="new.py", change_type="added", diff=diff, contents=contents, additions=500)
+    rendered, _ = build_prompt([added], token_budget=100_000)
+    assert rendered.count("unique line 250\n") == 1
+    assert len(rendered) < len(contents) + 200
+
+
+def test_rewritten_file_drops_contents():
+    contents = "".join(f"new {i}\n" for i in range(100))
+    diff = (
+        "@@ -1,100 +1,100 @@\n"
+        + "".join(f"-old {i}\n" for i in range(100))
+        + "".join(f"+new {i}\n" for i in range(100))
+    )
+    rewritten = FileDiff(path="r.py", diff=diff, contents=contents, additions=100, deletions=100)
+    rendered, _ = build_prompt([rewritten], token_budget=100_000)
+    assert rendered.count("new 50\n") == 1
+    assert "----- Contents -----" not in rendered
+
+
+def test_removed_file_size_is_bounded():
+    for num_lines in [100, 10_000]:
+        diff = f"@@ -1,{num_lines} +0,0 @@\n" + "".join(f"-gone {i}\n" for i in range(num_lines))
+        removed = FileDiff(
+            path="old.py", change_type="removed", diff=diff, contents=diffweave.prompt.FILE_REMOVED, deletions=num_lines
+        )
+        rendered, _ = build_prompt([removed], token_budget=1_000_000)
+        assert "Removed File: ./old.py" in rendered
+        assert diffweave.prompt.FILE_REMOVED not in rendered
+        assert f"{num_lines - 20} more lines removed" in rendered
+        assert len(rendered) < 600
@@ -2,6 +2,9 @@ import os
 from pathlib import Path
 import shutil
 import string
+import subprocess
+import sys
+import tracemalloc
 
 import git
 import pytest
@@ -124,6 +127,79 @@ def test_large_diffs(new_repo: git.Repo):
     assert "TOO LARGE TO SHOW" in diffs
 
 
+def test_large_multiline_file_contents_are_left_out(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    new_repo.index.add(["README.md"])
+    new_repo.index.commit("Initial commit")
+
+    (root_dir / "large_file.txt").write_text((string.ascii_lowercase + "\n") * 20_000)
+    new_repo.index.add(["large_file.txt"])
+    diffs = diffweave.repo.generate_diffs_with_context(new_repo, context_mode="full")
+    assert "TOO LARGE TO SHOW" in diffs
+    # ordinary text, so it keeps its (reduced) diff rather than a generated-file summary
+    assert "generated:" not in diffs
+    assert "+abcdefghijklmnopqrstuvwxyz" in diffs
+
+
+def test_new_file_contents_are_not_duplicated(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    diffweave.run_cmd("git add -A")
+    new_repo.index.commit("Initial commit")
+    contents = "".join(f"value_{i} = {i}\n" for i in range(300))
+    (root_dir / "values.py").write_text(contents)
+    diffweave.run_cmd("git add -A")
+
+    diffs = diffweave.repo.generate_diffs_with_context(new_repo)
+    assert diffs.count("value_150 = 150") == 1
+    assert len(diffs) < len(contents) * 1.2
+
+
+def test_moved_package_is_a_few_lines(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    for i in range(100):
+        path = root_dir / "old_pkg" / f"module_{i}.py"
+        path.parent.mkdir(exist_ok=True)
+        path.write_text("".join(f"value_{j} = {i * j}\n" for j in range(200)))
+    diffweave.run_cmd("git add -A")
+    new_repo.index.commit("Initial commit")
+
+    diffweave.run_cmd("git mv old_pkg new_pkg")
+    module_0 = root_dir / "new_pkg" / "module_0.py"
+    module_0.write_text(module_0.read_text().replace("value_100 = 0\n", "value_100 = 1\n"))
+    diffweave.run_cmd("git add -A")
+
+    diffs = diffweave.repo.generate_diffs_with_context(new_repo, context_mode="full")
+    assert "Renamed File: ./old_pkg/module_7.py -> ./new_pkg/module_7.py (100% similar)" in diffs
+    assert "Renamed File: ./old_pkg/module_0.py -> ./new_pkg/module_0.py (99% similar)" in diffs
+    assert "+value_100 = 1" in diffs
+    assert "value_150" not in diffs
+    assert len(diffs) < 15_000
+
+
+def test_copied_file_shows_only_the_delta(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    original = "".join(f"setting_{j} = {j}\n" for j in range(100))
+    (root_dir / "settings.py").write_text(original)
+    diffweave.run_cmd("git add -A")
+    new_repo.index.commit("Initial commit")
+
+    (root_dir / "settings.py").write_text(original + "extra = True\n")
+    (root_dir / "settings_copy.py").write_text(original.replace("setting_5 = 5", "setting_5 = 55"))
+    diffweave.run_cmd("git add -A")
+
+    for diffs in [
+        diffweave.repo.generate_diffs_with_context(new_repo, context_mode="full"),
+        diffweave.repo.generate_diffs_with_valid_prior_commit(
+            root_dir,
+            new_repo.head.commit.diff(git.IndexFile.Index, create_patch=True, find_renames=True, find_copies=True),
+            context_mode="full",
+        ),
+    ]:
+        assert "Copied File: ./settings.py -> ./settings_copy.py" in diffs
+        assert "+setting_5 = 55" in diffs
+        assert diffs.count("setting_50 = 50") == 1
+
+
 def test_get_repo_url(new_repo: git.Repo):
     url = diffweave.repo.get_repo_url(new_repo)
     assert url is not None
@@ -153,8 +229,50 @@ def test_generate_diffs_for_pull_request(new_repo: git.Repo):
     assert "main.py" in diffs
 
 
+def test_pull_request_commits_are_summarized_once(new_repo: git.Repo, valid_config: Path, mocker):
+    root_dir = Path(new_repo.working_dir)
+    new_repo.index.add(["README.md"])
+    new_repo.index.commit("Initial commit")
+    new_repo.create_head("main")
+    for i in range(3):
+        (root_dir / f"feature_{i}.py").write_text(f"def feature_{i}():\n    return {i}\n")
+        new_repo.index.add([f"feature_{i}.py"])
+        new_repo.index.commit(f"Add feature {i}")
+
+    prompts = []
+
+    async def query_model(self, prompt, on_token=None, temperature=None, system_prompt=None):
+        # commits get their own summarizing prompt, not the one for groups of changed files
+        assert system_prompt == diffweave.ai.load_system_prompt("summarize_commit")
+        prompts.append(prompt[0])
+        return f"- summary of {prompt[0].splitlines()[1]}"
+
+    mocker.patch.object(diffweave.ai.LLM, "query_model", new=query_model)
+    llm = diffweave.ai.LLM()
+
+    summaries = diffweave.repo.summarize_commits_for_pull_request(new_repo, "main", llm)
+    assert len(prompts) == 3
+    assert "feature_1.py" in prompts[1]
+    assert summaries.index("- summary of Add feature 0") < summaries.index("- summary of Add feature 2")
+
+    # nothing new, so nothing is sent again
+    assert diffweave.repo.summarize_commits_for_pull_request(new_repo, "main", llm) == summaries
+    assert len(prompts) == 3
+
+    (root_dir / "main.py").write_text("print('goodbye')\n")
+    new_repo.index.add(["main.py"])
+    new_repo.index.commit("Say goodbye")
+    summaries = diffweave.repo.summarize_commits_for_pull_request(new_repo, "main", llm)
+    assert len(prompts) == 4
+    assert "Say goodbye" in prompts[-1]
+    assert summaries.count("- summary of") == 4
+
+    diffweave.repo.summarize_commits_for_pull_request(new_repo, "main", llm, use_cache=False)
+    assert len(prompts) == 8
+
+
 def test_add_files_tree_not_available(new_repo: git.Repo, mocker):
-    mocker.patch("diffweave.utils.run_cmd", side_effect=SystemError)
+    mocker.patch("diffweave.utils.run_command", side_effect=SystemError)
     diffweave.repo.add_files(new_repo, interactive=False)
     assert len(diffweave.repo.get_untracked_and_modified_files(new_repo)) == 0
 
@@ -201,3 +319,123 @@ def test_github_remote_url_regex():
         path = match.group(3)
         print(path)
         print(f"https://{host}/{path}")
+
+
+def test_generating_diffs_within_token_budget(new_repo: git.Repo, capsys):
+    root_dir = Path(new_repo.working_dir)
+    new_repo.index.add(["README.md"])
+    new_repo.index.commit("Initial commit")
+    for i in range(30):
+        (root_dir / f"module_{i}.py").write_text("\n".join(f"value_{j} = {j}" for j in range(200 + i)))
+    diffweave.run_cmd("git add -A")
+
+    diffs = diffweave.repo.generate_diffs_with_context(new_repo, token_budget=2_000)
+    assert diffweave.prompt.estimate_tokens(diffs) <= 2_000
+    assert "Prompt trimmed" in capsys.readouterr().out
+
+
+def test_parallel_diff_assembly_matches_sequential(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    new_repo.index.add(["README.md"])
+    new_repo.index.commit("Initial commit")
+    for i in range(25):
+        (root_dir / f"module_{i}.py").write_text(f"value = {i}\n")
+    diffweave.run_cmd("git add -A")
+
+    diffs = new_repo.head.commit.diff(git.IndexFile.Index, create_patch=True)
+    sequential = diffweave.repo.generate_diffs_with_valid_prior_commit(root_dir, diffs, workers=1)
+    threads = diffweave.repo.generate_diffs_with_valid_prior_commit(root_dir, diffs, workers=8)
+    processes = diffweave.repo.generate_diffs_with_valid_prior_commit(root_dir, diffs, workers=2, processes=True)
+    assert sequential == threads == processes
+    assert sequential.index("module_10.py") < sequential.index("module_2.py")
+
+
+def test_large_staged_file_heap_is_bounded(new_repo: git.Repo, monkeypatch):
+    monkeypatch.setattr("diffweave.diffstream.MAX_PATCH_SIZE", 100_000)
+    root_dir = Path(new_repo.working_dir)
+    new_repo.index.add(["README.md"])
+    new_repo.index.commit("Initial commit")
+    with (root_dir / "data.csv").open("w") as f:
+        for i in range(300_000):
+            f.write(f"{i},{i * 2},{i * 3}\n")
+    new_repo.index.add(["data.csv"])
+    file_size = (root_dir / "data.csv").stat().st_size
+
+    tracemalloc.start()
+    try:
+        diffs = diffweave.repo.generate_diffs_with_context(new_repo, context_mode="full")
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert "<FILE TOO LARGE TO SHOW>" in diffs
+    assert "more lines omitted" in diffs
+    assert "rest of the patch not read, +300000 -0 lines in total" in diffs
+    assert peak < file_size / 4
+
+
+def test_large_staged_file_rss_is_bounded(new_repo: git.Repo):
+    root_dir = Path(new_repo.working_dir)
+    new_repo.index.add(["README.md"])
+    new_repo.index.commit("Initial commit")
+    with (root_dir / "data.csv").open("w") as f:
+        for i in range(3_000_000):
+            f.write(f"{i},{i * 2},{i * 3}\n")
+    new_repo.index.add(["data.csv"])
+    file_size = (root_dir / "data.csv").stat().st_size
+
+    # run in a fresh interpreter, so only what building the prompt adds to its peak RSS is counted
+    script = """
+import contextlib, io, resource, sys
+import git
+import diffweave
+# ru_maxrss is in KiB on Linux and in bytes on macOS
+scale = 1 if sys.platform == "darwin" else 1024
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+with contextlib.redirect_stdout(io.StringIO()):
+    diffs = diffweave.repo.generate_diffs_with_context(git.Repo("."), context_mode="full")
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+assert "<FILE TOO LARGE TO SHOW>" in diffs
+print(after - before)
+"""
+    # the interpreter starts in the repository, so it's pointed at the diffweave under test
+    env = {**os.environ, "PYTHONPATH": str(Path(diffweave.__file__).parent.parent)}
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True, env=env)
+    # reading the file whole would add more than its size again, as bytes and then as text
+    assert int(result.stdout) < file_size / 2
+
+
+def test_pull_request_memory_is_bounded(new_repo: git.Repo, monkeypatch):
+    monkeypatch.setattr("diffweave.diffstream.MAX_PATCH_SIZE", 100_000)
+    root_dir = Path(new_repo.working_dir)
+    new_repo.index.add(["README.md"])
+    new_repo.index.commit("Initial commit")
+    new_repo.create_head("main")
+    for n in range(3):
+        with (root_dir / f"data_{n}.csv").open("w") as f:
+            for i in range(200_000):
+                f.write(f"{i},{i * 2},{i * 3}\n")
+        new_repo.index.add([f"data_{n}.csv"])
+        new_repo.index.commit(f"Add data {n}")
+    largest_file = (root_dir / "data_0.csv").stat().st_size
+
+    tracemalloc.start()
+    try:
+        _, diffs = diffweave.repo.generate_diffs_for_pull_request(new_repo, "main", context_mode="full")
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert "./data_2.csv" in diffs
+    assert "rest of the patch not read, +200000 -0 lines in total" in diffs
+    # the branch adds three of these, but only a capped piece of each patch is ever held
+    assert peak < largest_file / 2
+
+
+def test_oversized_working_tree_file_is_not_read(tmp_path, mocker):
+    big_file = tmp_path / "big.bin"
+    big_file.write_bytes(b"x" * 100)
+    read_bytes = mocker.spy(Path, "read_bytes")
+    assert diffweave.blobs.load_file(big_file, max_size=50) == (100, None)
+    read_bytes.assert_not_called()
+    assert diffweave.blobs.load_file(big_file, max_size=500) == (100, b"x" * 100)
@@ -1,4 +1,9 @@
+import operator
+
 import pytest
+import rich.console
+import rich.padding
+import rich.syntax
 
 import diffweave
 
@@ -32,3 +37,77 @@ def test_run_cmd_stderr_on_success():
 def test_run_cmd_truncated_output(capsys):
     diffweave.run_cmd("echo hello", show_output=False, silent=False)
     assert "result truncated" in capsys.readouterr().out
+
+
+def test_ordered_map_keeps_order():
+    items = range(100)
+    assert list(diffweave.utils.ordered_map(lambda x: x * 2, items, workers=8)) == [x * 2 for x in items]
+    assert list(diffweave.utils.ordered_map(lambda x: x * 2, iter(items), workers=1)) == [x * 2 for x in items]
+    assert list(diffweave.utils.ordered_map(operator.neg, items, workers=2, processes=True)) == [-x for x in items]
+
+
+def test_ordered_map_bounds_read_ahead_by_weight():
+    pulled = []
+
+    def items():
+        for x in range(100):
+            pulled.append(x)
+            yield x
+
+    results = diffweave.utils.ordered_map(lambda x: x, items(), workers=8, weight=lambda _: 10, max_weight=30)
+    assert next(results) == 0
+    # the window would allow 32 items, but only 30 worth of weight may be in flight
+    assert len(pulled) == 3
+    assert list(results) == list(range(1, 100))
+
+
+def test_run_command_passes_arguments_unquoted():
+    stdout, _ = diffweave.run_command(["printf", "%s|", "it's", "a $HOME; `test`"])
+    assert stdout == "it's|a $HOME; `test`|"
+
+
+def test_run_command_failures():
+    with pytest.raises(SystemError, match="not found|No such file"):
+        diffweave.run_command(["asdkjhfasdjhk"])
+    with pytest.raises(SystemError, match="err"):
+        diffweave.run_command(["sh", "-c", "echo err >&2; exit 3"])
+
+
+def test_run_command_input():
+    stdout, _ = diffweave.run_command(["cat"], input="foo bar", stream=True)
+    assert stdout == "foo bar"
+
+
+def test_run_command_caps_display(capsys):
+    stdout, _ = diffweave.run_command(["seq", "1000"], max_display_lines=10)
+    assert len(stdout.splitlines()) == 1000
+    shown = capsys.readouterr().out
+    assert "990 more line(s) not shown" in shown
+    assert "\n  11\n" not in shown
+
+    diffweave.run_command(["seq", "1000"], max_display_lines=10, stream=True)
+    assert "990 more line(s) not shown" in capsys.readouterr().out
+
+
+def test_run_command_skips_highlighting_large_output(mocker):
+    syntax = mocker.patch("rich.syntax.Syntax", wraps=rich.syntax.Syntax)
+    diffweave.run_command(["seq", "100"], highlight_limit=10)
+    syntax.assert_not_called()
+    diffweave.run_command(["echo", "hi"], highlight_limit=10)
+    syntax.assert_called_once()
+
+
+def test_run_command_streams_lines_as_they_arrive(tmp_path, mocker):
+    # the command only says "streamed" if its first line was displayed while it was still running
+    flag = tmp_path / "shown"
+    original_print = rich.console.Console.print
+
+    def print_and_flag(self, *objects, **kwargs):
+        if any(isinstance(o, rich.padding.Padding) and "first" in str(o.renderable) for o in objects):
+            flag.touch()
+        return original_print(self, *objects, **kwargs)
+
+    mocker.patch.object(rich.console.Console, "print", print_and_flag)
+    script = f"echo first; for i in $(seq 50); do [ -e '{flag}' ] && break; sleep 0.1; done; [ -e '{flag}' ] && echo streamed"
+    stdout, _ = diffweave.run_command(["sh", "-c", script], stream=True)
+    assert stdout.splitlines() == ["first", "streamed"]
@@ -0,0 +1,106 @@
+import pathlib
+import threading
+import time
+
+import git
+import openai
+import pytest
+
+from diffweave import ai, app, repo, speculate
+
+
+def test_staged_key(new_repo: git.Repo):
+    empty = speculate.staged_key(new_repo, "gpt-4o", "prompt", "auto")
+    assert empty is not None
+
+    new_repo.index.add(["README.md"])
+    staged = speculate.staged_key(new_repo, "gpt-4o", "prompt", "auto")
+    assert staged != empty
+    assert speculate.staged_key(new_repo, "gpt-4o", "prompt", "auto") == staged
+    assert speculate.staged_key(new_repo, "gpt-4o", "simple", "auto") != staged
+    assert speculate.staged_key(new_repo, "gpt-5", "prompt", "auto") != staged
+
+    # the same tree on top of another commit is a different change
+    new_repo.index.commit("Initial commit")
+    assert speculate.staged_key(new_repo, "gpt-4o", "prompt", "auto") != staged
+
+
+def test_pregenerate_then_lookup(new_repo: git.Repo, valid_config: pathlib.Path):
+    llm = ai.LLM()
+    new_repo.index.add(["README.md", "main.py"])
+    assert speculate.lookup(new_repo, llm.model_name) is None
+
+    assert speculate.pregenerate(new_repo, llm) == "feat: mocked commit message"
+    assert speculate.lookup(new_repo, llm.model_name) == "feat: mocked commit message"
+    assert speculate.lookup(new_repo, llm.model_name, prompt_name="simple") is None
+
+    # already generated for these staged changes
+    speculate.pregenerate(new_repo, llm)
+    assert openai.AsyncOpenAI.return_value.chat.completions.create.call_count == 1
+
+    new_repo.index.add(["test/__init__.py"])
+    assert speculate.lookup(new_repo, llm.model_name) is None
+
+
+def test_pregenerate_nothing_staged(new_repo: git.Repo, valid_config: pathlib.Path):
+    new_repo.index.add(["README.md"])
+    new_repo.index.commit("Initial commit")
+    assert speculate.pregenerate(new_repo, ai.LLM()) is None
+    assert openai.AsyncOpenAI.return_value.chat.completions.create.call_count == 0
+
+
+def test_wait_for_change(tmp_path):
+    index_path = tmp_path / "index"
+    index_path.write_text("a")
+    stamp = speculate._index_stamp(index_path)
+
+    def stage():
+        for content in ["ab", "abc", "abcd"]:
+            time.sleep(0.05)
+            index_path.write_text(content)
+
+    thread = threading.Thread(target=stage)
+    thread.start()
+    new_stamp = speculate.wait_for_change(index_path, stamp, settle=0.2, poll_interval=0.01)
+    thread.join()
+    # only returns once the last of the quick succession of changes has settled
+    assert new_stamp == speculate._index_stamp(index_path)
+    assert new_stamp[1] == 4
+
+
+def test_commit_uses_pregenerated_message(
+    capsys, new_repo: git.Repo, valid_config: pathlib.Path, completion_stream, mocker
+):
+    new_repo.index.add(["README.md", "main.py"])
+    create = openai.AsyncOpenAI.return_value.chat.completions.create
+    create.side_effect = lambda **_: completion_stream("feat: pregenerated message")
+    speculate.pregenerate(new_repo, ai.LLM())
+
+    create.side_effect = lambda **_: completion_stream("feat: generated on demand")
+    generate_diffs = mocker.spy(repo, "generate_diffs_with_context")
+    app("--dry-run", result_action="return_value")
+    stdout = capsys.readouterr().out
+    assert "generated ahead of time" in stdout
+    assert "feat: pregenerated message" in stdout
+    assert create.call_count == 1
+    # the lookup alone is enough, the diffs aren't built at all
+    assert generate_diffs.call_count == 0
+
+    app("--dry-run --no-cache", result_action="return_value")
+    assert "feat: generated on demand" in capsys.readouterr().out
+    assert generate_diffs.call_count == 1
+
+
+def test_watch_survives_errors(capsys, new_repo: git.Repo, valid_config: pathlib.Path, mocker):
+    new_repo.index.add(["README.md", "main.py"])
+    pregenerate = mocker.patch(
+        "diffweave.speculate.pregenerate", side_effect=[openai.APITimeoutError(request=None), "feat: second try"]
+    )
+    mocker.patch("diffweave.speculate.wait_for_change", side_effect=[None, KeyboardInterrupt])
+
+    with pytest.raises(KeyboardInterrupt):
+        speculate.watch(new_repo, ai.LLM())
+    assert pregenerate.call_count == 2
+    stdout = capsys.readouterr().out
+    assert "retrying on the next change" in stdout
+    assert "feat: second try" in stdout